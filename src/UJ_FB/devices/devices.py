@@ -2,6 +2,13 @@ import math
 import time
 from commanduino.exceptions import CMDeviceReplyTimeout
 
+# [fraction of max speed, seconds] steps run to get the stirrer bar spinning before stirring slowly
+DEFAULT_SPIN_UP = [[1.0, 1.5], [0.5, 1.5]]
+# stirring below this fraction of the max speed starts with the spin up steps
+DEFAULT_SPIN_UP_BELOW = 0.5
+# slowest speed as a fraction of the max speed
+DEFAULT_MIN_SPEED = 0.2
+
 
 class Device:
     """Class to represent a generic device, in this case a digital/analog pin.
@@ -141,6 +148,24 @@ class MagStirrer(Device):
         super(MagStirrer, self).__init__(stirrer_obj, s_lock)
         self.max_speed = device_config["fan_speed"]
         self.speed = 0.0
+        self.spin_up = device_config.get("spin_up", DEFAULT_SPIN_UP)
+        self.spin_up_below = device_config.get("spin_up_below", DEFAULT_SPIN_UP_BELOW)
+        self.min_speed = device_config.get("min_speed", DEFAULT_MIN_SPEED)
+
+    def ramp_profile(self, speed):
+        """Plans the steps to start stirring at a speed. Slow speeds are started by spinning the stirrer bar up first.
+
+        Args:
+            speed (float): the speed to stir at
+
+        Returns:
+            list: [(speed, seconds)] for each step. The last step holds the requested speed and has no duration.
+        """
+        steps = []
+        if speed < self.spin_up_below * self.max_speed:
+            steps = [(fraction * self.max_speed, secs) for fraction, secs in self.spin_up]
+        steps.append((max(speed, self.min_speed * self.max_speed), None))
+        return steps
 
     def start_stir(self, speed):
         self.speed = max(0, min(speed, self.max_speed))
@@ -154,6 +154,37 @@ class StepperMotor:
         self.watch_move()
         return True
 
+    def sampled_move(self, steps, read_func):
+        """Moves the motor by a number of steps, sampling a sensor throughout the movement. Each sample is paired with
+        the motor position midway between the position queries before and after the reading.
+
+        Args:
+            steps (int): Integer number of steps to move
+            read_func (func): function that returns the sensor reading
+
+        Returns:
+            tuple: lists of the step positions and the sensor readings at those positions
+        """
+        positions = []
+        readings = []
+        prev_position = self.get_current_position()
+        with self.serial_lock:
+            self.cmd_stepper.move(steps, False)
+        moving = True
+        while moving:
+            moving = self.is_moving
+            reading = read_func()
+            position = self.get_current_position()
+            positions.append((prev_position + position) / 2)
+            readings.append(reading)
+            prev_position = position
+            with self.stop_lock:
+                if self.stop_cmd:
+                    self.stop_cmd = False
+                    break
+        self.magnets_passed = self.cmd_stepper.magnets_passed
+        return positions, readings
+
     def move_to(self, position):
         """Moves the motor to a specific step position.
 
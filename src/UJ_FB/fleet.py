@@ -0,0 +1,187 @@
+"""This script contains the FleetHost class, which runs several fluidic backbone robots from one process. Each robot
+is configured from its own directory, as a single robot is configured from the package directory. The robots share
+one HTTP session, so robots using the same server share its connections, one reactor scheduler thread that runs the
+control loops of every reactor, one pool of image upload workers, and one logging pipeline that writes every robot's
+logs from a single thread. Each robot still runs its own manager thread, and its own threads for flushing its outbox,
+polling the server and listening for pushed events. The host can be run from the command line:
+
+    python -m UJ_FB.fleet robot1_dir robot2_dir --web --log-file fleet.log
+"""
+
+import sys
+import time
+import logging
+import argparse
+from queue import Queue
+from logging.handlers import QueueHandler, QueueListener
+import requests
+import UJ_FB.scheduler as scheduler
+import UJ_FB.web_listener as web_listener
+import UJ_FB.fbexceptions as fbexceptions
+from UJ_FB.fluidicbackbone import FluidicBackbone, json_loader, load_graph
+
+# seconds between status reports when run from the command line
+STATUS_INTERVAL = 10
+LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class FleetHost:
+    """
+    Runs a FluidicBackbone for each robot in the fleet, and reports the status of every robot
+    """
+
+    def __init__(self, config_dirs, web_enabled=False, simulation=False, log_file=None, stdout_log=False):
+        """
+        Args:
+            config_dirs (list): the directory holding each robot's configs folder
+            web_enabled (bool, optional): True if the robots connect to a server. Defaults to False.
+            simulation (bool, optional): True if the robots should be run in simulation mode. Defaults to False.
+            log_file (str, optional): the file that every robot's logs are written to. Defaults to None.
+            stdout_log (bool, optional): True if logs should print to stdout. Defaults to False.
+
+        Raises:
+            fbexceptions.FBConfigurationError: two robots have the same ID, or a robot's configuration is invalid. Any
+                robots already started are exited.
+        """
+        robot_ids = [self.read_robot_id(config_dir) for config_dir in config_dirs]
+        duplicates = {robot_id for robot_id in robot_ids if robot_ids.count(robot_id) > 1}
+        if duplicates:
+            raise fbexceptions.FBConfigurationError(f"Robot IDs must be unique, {', '.join(duplicates)} repeated")
+        # robot threads put their log records on a queue, and one thread writes them to the handlers
+        handlers = []
+        if log_file is not None:
+            handlers.append(logging.FileHandler(log_file))
+        if stdout_log:
+            handlers.append(logging.StreamHandler(sys.stdout))
+        for handler in handlers:
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.log_queue = Queue()
+        self.log_handler = QueueHandler(self.log_queue)
+        self.log_listener = QueueListener(self.log_queue, *handlers, respect_handler_level=True)
+        root_logger = logging.getLogger()
+        root_logger.addHandler(self.log_handler)
+        root_logger.setLevel(logging.INFO)
+        self.log_listener.start()
+        self.session = requests.Session()
+        self.reactor_scheduler = scheduler.ReactorScheduler("FleetReactorScheduler")
+        self.upload_pool = web_listener.UploadPool(name="FleetUpload")
+        # {robot ID: FluidicBackbone}
+        self.robots = {}
+        try:
+            for config_dir in config_dirs:
+                robot = FluidicBackbone(gui=False, web_enabled=web_enabled, simulation=simulation,
+                                        config_dir=config_dir, session=self.session,
+                                        reactor_scheduler=self.reactor_scheduler, upload_pool=self.upload_pool)
+                self.robots[robot.id] = robot
+        except Exception:
+            # stop the robots already started and the shared threads, so a robot that fails to start doesn't leave
+            # the rest of the fleet running
+            self.exit()
+            raise
+
+    @staticmethod
+    def read_robot_id(config_dir):
+        """Reads a robot's ID from its module connections, as FluidicBackbone does
+
+        Args:
+            config_dir (str): the directory holding the robot's configs folder
+
+        Returns:
+            str: the robot's ID
+        """
+        graph = load_graph(json_loader(config_dir, "configs/module_connections.json"))
+        robot_id = graph.nodes["meta"]["robot_id"]
+        return robot_id if robot_id else "UJ_FB1"
+
+    @staticmethod
+    def robot_status(robot):
+        """Summarises the state of a robot
+
+        Args:
+            robot (FluidicBackbone): the robot
+
+        Returns:
+            dict: {"ready", "execute", "paused", "error", "reaction", "staged", "queued", "tasks", "connected",
+                   "push", "outbox", "temps"}
+        """
+        listener = robot.listener
+        staged = robot.staged_reaction
+        return {"ready": robot.ready, "execute": bool(robot.execute), "paused": robot.paused, "error": robot.error,
+                "reaction": robot.reaction_name, "staged": staged["name"] if staged is not None else "",
+                "queued": robot.q.qsize(), "tasks": len(robot.tasks), "connected": listener.valid_connection,
+                "push": listener.push_active, "outbox": len(listener.outbox) if listener.outbox is not None else 0,
+                "temps": {name: round(reactor.cur_temp, 1) for name, reactor in robot.reactors.items()}}
+
+    def status(self):
+        """
+        Returns:
+            dict: the status of each robot, as returned by robot_status. {robot ID: status}
+        """
+        return {robot_id: self.robot_status(robot) for robot_id, robot in self.robots.items()}
+
+    def status_table(self):
+        """Formats the status of every robot as a table
+
+        Returns:
+            str: the table, with a row for each robot
+        """
+        lines = [f"{'robot':<12}{'state':<9}{'reaction':<20}{'staged':<20}{'queued':>7}{'tasks':>6}  "
+                 f"{'server':<8}{'outbox':>7}  temps"]
+        for robot_id, status in self.status().items():
+            if status["error"]:
+                state = "ERROR"
+            elif status["paused"]:
+                state = "PAUSED"
+            elif status["ready"]:
+                state = "IDLE"
+            else:
+                state = "BUSY"
+            if not status["connected"]:
+                server = "offline"
+            elif status["push"]:
+                server = "push"
+            else:
+                server = "polling"
+            temps = ", ".join(f"{name} {temp}" for name, temp in status["temps"].items())
+            lines.append(f"{robot_id:<12}{state:<9}{status['reaction'][:19]:<20}{status['staged'][:19]:<20}"
+                         f"{status['queued']:>7}{status['tasks']:>6}  {server:<8}{status['outbox']:>7}  {temps}")
+        return "\n".join(lines)
+
+    def exit(self):
+        """Exits every robot, waits for their managers to finish, then stops the shared threads
+        """
+        for robot in self.robots.values():
+            with robot.interrupt_lock:
+                robot.exit_flag = True
+                robot.interrupt = True
+        for robot in self.robots.values():
+            robot.join()
+        self.reactor_scheduler.exit = True
+        self.upload_pool.stop()
+        self.session.close()
+        self.log_listener.stop()
+        logging.getLogger().removeHandler(self.log_handler)
+        for handler in self.log_listener.handlers:
+            handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs several fluidic backbone robots from one process")
+    parser.add_argument("config_dirs", nargs="+", help="the directory holding each robot's configs folder")
+    parser.add_argument("--web", action="store_true", help="connect the robots to the server")
+    parser.add_argument("--simulation", action="store_true", help="run the robots in simulation mode")
+    parser.add_argument("--log-file", default=None)
+    parser.add_argument("--stdout-log", action="store_true")
+    args = parser.parse_args()
+    fleet = FleetHost(args.config_dirs, web_enabled=args.web, simulation=args.simulation, log_file=args.log_file,
+                      stdout_log=args.stdout_log)
+    try:
+        while True:
+            print(fleet.status_table(), flush=True)
+            time.sleep(STATUS_INTERVAL)
+    except KeyboardInterrupt:
+        fleet.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""This script contains the FlowRateModel class, which learns how fast each syringe pump can move each fluid.
+Moves that complete are recorded as safe, and moves that stall the pump (an encoder error) record the flow rate at
+which the stall happened. Flow rates are only raised above the highest safe flow rate by calibration, never during a
+protocol. The model is kept in the running configuration so it persists between runs.
+"""
+
+import logging
+from threading import Lock
+
+# fraction of the lowest stalling flow rate that is used as the maximum flow rate
+STALL_MARGIN = 0.8
+# factor by which calibration raises the flow rate after each successful move
+PROBE_STEP = 1.1
+# maximum multiple of the default flow rate that calibration will try
+MAX_DEFAULT_MULTIPLE = 4
+
+
+class FlowRateModel:
+    """
+    Records the flow rates at which each syringe pump completed or stalled while moving each fluid, and suggests the
+    highest flow rate that is expected to be safe.
+    """
+
+    def __init__(self, manager):
+        """
+        Args:
+            manager (UJ_FB.Manager): the manager for this robot
+        """
+        self.manager = manager
+        self.lock = Lock()
+        # {syringe name: {fluid: {"safe": highest completed flow rate, "stall": lowest stalling flow rate}}}
+        self.rates = self.manager.prev_run_config.setdefault("flow_rates", {})
+
+    def get_record(self, syringe, fluid):
+        fluids = self.rates.setdefault(syringe, {})
+        return fluids.setdefault(fluid if fluid else "unknown", {"safe": 0.0, "stall": None})
+
+    def record_success(self, syringe, fluid, flow_rate):
+        """Records that a move completed without stalling
+
+        Args:
+            syringe (str): the name of the syringe pump
+            fluid (str): the fluid that was moved
+            flow_rate (float): the flow rate of the move in uL/min
+        """
+        with self.lock:
+            record = self.get_record(syringe, fluid)
+            if flow_rate > record["safe"]:
+                record["safe"] = flow_rate
+                self.manager.rc_changes = True
+
+    def record_stall(self, syringe, fluid, flow_rate):
+        """Records that a move stalled the syringe pump
+
+        Args:
+            syringe (str): the name of the syringe pump
+            fluid (str): the fluid that was moved
+            flow_rate (float): the flow rate of the move in uL/min
+        """
+        with self.lock:
+            record = self.get_record(syringe, fluid)
+            if record["stall"] is None or flow_rate < record["stall"]:
+                record["stall"] = flow_rate
+            record["safe"] = min(record["safe"], flow_rate * STALL_MARGIN)
+            self.manager.rc_changes = True
+        self.manager.write_log(f"{syringe} stalled moving {fluid} at {round(flow_rate)} ul/min, limiting to "
+                               f"{round(flow_rate * STALL_MARGIN)} ul/min", level=logging.WARNING)
+
+    def pump_limit(self, syringe):
+        """
+        Args:
+            syringe (str): the name of the syringe pump
+
+        Returns:
+            float: the flow rate in uL/min at the pump's maximum motor speed, or None if it is not known
+        """
+        pump = self.manager.syringes.get(syringe)
+        if pump is None:
+            return None
+        return pump.max_flow_rate()
+
+    def max_flow_rate(self, syringe, fluid, default, limit=None):
+        """Suggests the highest flow rate expected to be safe: the highest successful flow rate, or the default if that
+        is higher, kept below any flow rate that has stalled the pump and the pump's maximum speed.
+
+        Args:
+            syringe (str): the name of the syringe pump
+            fluid (str): the fluid to be moved
+            default (float): the default flow rate for this kind of move in uL/min
+            limit (float, optional): the pump's maximum flow rate in uL/min. Defaults to the limit of the pump's motor.
+
+        Returns:
+            float: the suggested flow rate in uL/min
+        """
+        if limit is None:
+            limit = self.pump_limit(syringe)
+        with self.lock:
+            record = self.rates.get(syringe, {}).get(fluid if fluid else "unknown")
+            flow_rate = default
+            if record is not None:
+                flow_rate = max(default, record["safe"])
+                if record["stall"] is not None:
+                    flow_rate = min(flow_rate, record["stall"] * STALL_MARGIN)
+        if limit is not None:
+            flow_rate = min(flow_rate, limit)
+        return flow_rate
+
+    def next_probe(self, syringe, fluid, default, limit=None):
+        """Determines the next flow rate for calibration to try, a step above the highest successful flow rate
+
+        Args:
+            syringe (str): the name of the syringe pump
+            fluid (str): the fluid to be moved
+            default (float): the default flow rate for this kind of move in uL/min
+            limit (float, optional): the pump's maximum flow rate in uL/min. Defaults to the limit of the pump's motor.
+
+        Returns:
+            float: the flow rate in uL/min, or None if calibration is complete
+        """
+        if limit is None:
+            limit = self.pump_limit(syringe)
+        ceiling = default * MAX_DEFAULT_MULTIPLE
+        if limit is not None:
+            ceiling = min(ceiling, limit)
+        with self.lock:
+            record = self.rates.get(syringe, {}).get(fluid if fluid else "unknown")
+            if record is None or not record["safe"]:
+                return min(default, ceiling)
+            if record["stall"] is not None:
+                ceiling = min(ceiling, record["stall"] * STALL_MARGIN)
+            if record["safe"] >= ceiling:
+                return None
+            return min(record["safe"] * PROBE_STEP, ceiling)
+
+    def flow_rate(self, syringe, fluid, requested, default):
+        """Determines the flow rate to use for a move. Requested flow rates are kept unless they are above a flow
+        rate that has stalled the pump.
+
+        Args:
+            syringe (str): the name of the syringe pump
+            fluid (str): the fluid to be moved
+            requested (float): the requested flow rate in uL/min. 0 uses the suggested flow rate.
+            default (float): the default flow rate for this kind of move in uL/min
+
+        Returns:
+            float: the flow rate in uL/min
+        """
+        if not requested:
+            return self.max_flow_rate(syringe, fluid, default)
+        with self.lock:
+            record = self.rates.get(syringe, {}).get(fluid if fluid else "unknown")
+            if record is not None and record["stall"] is not None:
+                return min(requested, record["stall"] * STALL_MARGIN)
+        return requested
@@ -182,17 +182,14 @@ class FluidicBackboneUI:
                                command=lambda: self.jog_valve(valve_name, valve_print_name))
         jog_button.grid(row=5, column=col + 1)
 
-        for port_no in range(0, 5):
+        # ports are split between two columns
+        num_ports = self.manager.valves[valve_name].num_ports
+        column_length = (num_ports + 1) // 2
+        for port_no in range(num_ports):
             ports.append(tk.Button(self.valve_pump_frame, text=str(port_no + 1), font=self.fonts["buttons"], width=5,
                                    padx=5, bg=self.colours["other-button"], fg="white",
                                    command=lambda i=port_no + 1: self.move_valve(valve_name, i)))
-            ports[port_no].grid(row=6 + port_no, column=col)
-
-        for port_no in range(5, 10):
-            ports.append(tk.Button(self.valve_pump_frame, text=str(port_no + 1), font=self.fonts["buttons"], width=5,
-                                   padx=5, bg=self.colours["other-button"], fg="white",
-                                   command=lambda i=port_no + 1: self.move_valve(valve_name, i)))
-            ports[port_no].grid(row=1 + port_no, column=col + 1)
+            ports[port_no].grid(row=6 + port_no % column_length, column=col + port_no // column_length)
 
         # Append list of ports corresponding to valve_no to valves_buttons
         self.valves_buttons[valve_name] = ports
@@ -20,10 +20,19 @@ from queue import Queue
 from threading import Thread, Lock
 import commanduino
 import UJ_FB.web_listener as web_listener
+import UJ_FB.flow_model as flow_model
+import UJ_FB.scheduler as scheduler
 from UJ_FB.modules import syringepump, selectorvalve, reactor, modules, fluidstorage
 import UJ_FB.fbexceptions as fbexceptions
 from UJ_FB.fluidic_backbone_gui import FluidicBackboneUI
 
+# inner diameter of tubing in mm, used for connections that do not specify one
+DEFAULT_TUBING_ID = 1.5875
+# number of queued commands searched for valve moves that can be started early
+LOOKAHEAD_COMMANDS = 20
+# estimated seconds taken by a valve move, homing or other command without a known duration
+COMMAND_SECS = 5
+
 
 def json_loader(root, fp, object_hook=None):
     """Loads JSON files for robot configuration
@@ -81,18 +90,29 @@ class FluidicBackbone(Thread):
     retrieves commands from the queue to execute using the attached modules.
     """
 
-    def __init__(self, gui=None, web_enabled=False, simulation=False, stdout_log=False):
+    def __init__(self, gui=None, web_enabled=False, simulation=False, stdout_log=False, config_dir=None,
+                 session=None, reactor_scheduler=None, upload_pool=None):
         """
         Args:
             gui (bool, optional): True if GUI should be created. Defaults to None.
             web_enabled (bool, optional): True if robot is connecting to a server. Defaults to False.
             simulation (bool, optional): True if robot should be run in simulation mode. Defaults to False.
             stdout_log (bool, optional): True if logs should print to stdout. Defaults to False.
+            config_dir (str, optional): the directory holding this robot's configs folder. Defaults to None, which
+                uses the package directory.
+            session (requests.Session, optional): an HTTP session shared with other robots. Defaults to None.
+            reactor_scheduler (UJ_FB.scheduler.ReactorScheduler, optional): a reactor scheduler shared with other
+                robots. Defaults to None, which starts a scheduler for this robot.
+            upload_pool (UJ_FB.web_listener.UploadPool, optional): image upload workers shared with other robots.
+                Defaults to None, which starts upload workers for this robot.
         """
         Thread.__init__(self)
-        script_dir = os.path.abspath(fbexceptions.__file__)
-        script_dir = script_dir.split("\\")
-        self.script_dir = "\\".join(script_dir[:-1])
+        if config_dir is None:
+            script_dir = os.path.abspath(fbexceptions.__file__)
+            script_dir = script_dir.split("\\")
+            self.script_dir = "\\".join(script_dir[:-1])
+        else:
+            self.script_dir = config_dir
         cm_config = os.path.join(self.script_dir, "configs/cmd_config.json")
         self.cmd_mng = commanduino.CommandManager.from_configfile(cm_config, simulation)
         graph_config = json_loader(self.script_dir, "configs/module_connections.json")
@@ -107,7 +127,6 @@ class FluidicBackbone(Thread):
         self.logger = logging.getLogger(self.id)
         self.simulation = simulation
 
-        self.listener = web_listener.WebListener(self, self.id, self.key)
         self.web_enabled = web_enabled
 
         self.q = Queue()
@@ -115,6 +134,15 @@ class FluidicBackbone(Thread):
         self.error_queue = Queue()
 
         self.tasks = []
+        # resource claims for commands that may run concurrently. {module name: claim id}
+        self.claims = {}
+        self.claim_tasks = {}
+        self.claim_waits = set()
+        self.claim_count = 0
+        # valves moving ahead of their queued command. {valve name: Task}
+        self.premoves = {}
+        # reactors heating ahead of their queued heating command. {reactor name: temperature}
+        self.preheats = {}
         self.serial_lock = Lock()
         self.interrupt_lock = Lock()
         self.pause_after_rxn = False
@@ -130,6 +158,12 @@ class FluidicBackbone(Thread):
         self.reaction_ready = False
         self.reaction_name = ""
         self.reaction_id = None
+        self.reaction_start = 0.0
+        # the next reaction from the server, compiled into the pipeline while the current reaction runs.
+        # {"name", "reaction_id", "xdl", "clean_step", "compiled"}
+        self.staged_reaction = None
+        # the state the robot is projected to be in once the queued reaction ends, as returned by snapshot_state
+        self.projected_state = None
         self.error = False
         self.error_start = None
         self.error_flag = False
@@ -137,11 +171,21 @@ class FluidicBackbone(Thread):
         self.default_transfer_fr = 5000
         self.default_fr = 10000
         self.default_flush_fr = 20000
+        self.flow_model = flow_model.FlowRateModel(self)
         self.rc_changes = False
         self.xdl = ""
         self.syringes_ready = False
+        # created once the flags its background threads check are set
+        self.listener = web_listener.WebListener(self, self.id, self.key, session=session, upload_pool=upload_pool)
 
         self.valid_nodes = []
+        # dead volumes in uL. {(source, target): volume}
+        self.tubing_volumes = {}
+        # lowest dead volume route between each pair of modules. {(source, target): path}
+        self.routes = {}
+        self.route_volumes = {}
+        # transfer lines left filled with their vessel's contents by the planned moves. {(vessel, valve): fluid}
+        self.line_contents = {}
         self.num_valves = 0
         self.modules = {"valves": {}, "syringes": {}, "reactors": {}, "flasks": {}, "cameras": {}, "storage": {}}
         self.valves = self.modules["valves"]
@@ -151,6 +195,11 @@ class FluidicBackbone(Thread):
         self.cameras = self.modules["cameras"]
         self.storage = self.modules["storage"]
         self.gui_main = None
+        # runs the control loops of all reactors
+        self.owns_scheduler = reactor_scheduler is None
+        if self.owns_scheduler:
+            reactor_scheduler = scheduler.ReactorScheduler(f"{self.id}ReactorScheduler")
+        self.reactor_scheduler = reactor_scheduler
         self.setup_modules()
         self.write_running_config("configs/running_config.json")
 
@@ -251,55 +300,88 @@ class FluidicBackbone(Thread):
             g.nodes[valve]["object"] = self.valves[name]
             for node_name in g.adj[valve]:
                 port = g.adj[valve][node_name][0]["port"][1]
-                self.valves[name].ports[port] = g.nodes[node_name]["object"]
+                self.valves[name].attach(port, g.nodes[node_name]["object"])
                 if "valve" in node_name:
                     self.valves[name].adj_valves.append((node_name, port))
             syringe = self.valves[name].ports[-1]
             self.valves[name].syringe = syringe
             syringe.valve = self.valves[name]
+        self.build_route_table()
         self.reaction_name = self.graph.nodes["meta"].get("rxn_name")
         if self.reaction_name:
             self.write_log(f"Robot {self.id} is configured for reaction {self.reaction_name}")
 
+    def build_route_table(self):
+        """Calculates the dead volume of each tube from its length and inner diameter, then finds the route with the
+        lowest total dead volume between every pair of modules. Routes only pass through selector valves.
+        """
+        g = self.graph
+        self.tubing_volumes = {}
+        for source, target, edge in g.edges(data=True):
+            if (source, target) not in self.tubing_volumes:
+                tubing_id = edge.get("tubing_id", DEFAULT_TUBING_ID)
+                tubing_length = edge.get("tubing_length", 0)
+                self.tubing_volumes[(source, target)] = math.pow((tubing_id / 2), 2) * math.pi * tubing_length
+        valve_graph = nx.DiGraph()
+        valve_graph.add_nodes_from(self.valves)
+        for (source, target), volume in self.tubing_volumes.items():
+            if source in self.valves and target in self.valves:
+                valve_graph.add_edge(source, target, volume=volume)
+        valve_routes = dict(nx.all_pairs_dijkstra(valve_graph, weight="volume"))
+        self.routes = {}
+        self.route_volumes = {}
+        for source in self.valid_nodes:
+            if source in self.valves:
+                entries = [(source, 0.0)]
+            else:
+                entries = [(n, self.tubing_volumes[(source, n)]) for n in g.successors(source) if n in self.valves]
+            for target in self.valid_nodes:
+                if target == source:
+                    continue
+                if target in self.valves:
+                    exits = [(target, 0.0)]
+                else:
+                    exits = [(n, self.tubing_volumes[(n, target)]) for n in g.predecessors(target)
+                             if n in self.valves]
+                for entry, entry_volume in entries:
+                    distances, paths = valve_routes[entry]
+                    for exit_valve, exit_volume in exits:
+                        if exit_valve not in distances:
+                            continue
+                        volume = entry_volume + distances[exit_valve] + exit_volume
+                        if volume < self.route_volumes.get((source, target), math.inf):
+                            path = paths[exit_valve]
+                            if source != entry:
+                                path = [source] + path
+                            if target != exit_valve:
+                                path = path + [target]
+                            self.routes[(source, target)] = path
+                            self.route_volumes[(source, target)] = volume
+
     def init_syringes(self):
         """
-            Initialises the syringes by moving them to their endstop, dispensing contents into the nearest
-            waste container. If no waste container is found,  prints a message warning the user.
+            Initialises the valves and syringes. All valves are homed concurrently, and as soon as a valve is ready its
+            syringe is emptied into the nearest waste container by moving it to its endstop. Syringes whose nearest
+            waste container is on another valve are emptied along the backbone once every valve is ready. If no waste
+            container is found, prints a message warning the user. Phase timings are stored in the running
+            configuration.
         """
+        init_start = time.time()
+        timings = {"valves": {}}
+        waste_paths = self.find_waste_paths()
+        timings["waste_search"] = round(time.time() - init_start, 3)
         remaining_valves = {}
-        for valve in self.valves:
-            # home and prepare valve for running
-            if not self.simulation:
-                self.valves[valve].init_valve()
-            while not self.valves[valve].ready:
-                time.sleep(0.1)
-            syringe = self.valves[valve].syringe
-            # check if syringe needs to be homed
-            if not syringe.stepper.check_endstop() and not self.simulation:
-                # search for waste containers looking for shortest path
-                waste_containers = []
-                for n in list(self.graph.nodes):
-                    if "waste" in self.graph.nodes[n]["mod_type"]:
-                        waste_containers.append(n)
-                if not waste_containers:
-                    message = f"No waste containers are attached. Please manually empty {syringe.name} using the GUI"
-                    self.write_log(message, level=logging.WARNING)
-                    continue
-                shortest_waste_path = []
-                for waste in waste_containers:
-                    path_gen = nx.algorithms.simple_paths.all_simple_paths(self.graph, syringe.name, waste)
-                    path_list = [p for p in path_gen]
-                    if len(path_list[0]) < len(shortest_waste_path) or not shortest_waste_path:
-                        shortest_waste_path = path_list[0]
-                if len(shortest_waste_path) > 3:
-                    remaining_valves[valve] = shortest_waste_path
-                else:
-                    # Align valves without dispensing much liquid
-                    self.move_fluid(source=syringe.name, target=shortest_waste_path[-1], volume=0.1, flow_rate=10000,
-                                    init_move=True)
-                    # with valves at waste can move to 0
-                    self.add_to_queue(self.generate_cmd_dict("syringe_pump", syringe.name, "home", {"wait": True}))
-                    self.start_queue()
+        valve_threads = []
+        for valve in self.valves.values():
+            valve_thread = Thread(target=self.init_valve_syringe, name=valve.name + "init",
+                                  args=(valve, waste_paths, remaining_valves, timings["valves"]))
+            valve_threads.append(valve_thread)
+            valve_thread.start()
+        for valve_thread in valve_threads:
+            valve_thread.join()
+        timings["valves_ready"] = round(time.time() - init_start, 3)
+        while not self.q.empty() or self.tasks:
+            time.sleep(0.1)
         for v in remaining_valves:
             # soft home the syringe
             path = remaining_valves[v][1:-1]
@@ -319,6 +401,71 @@ class FluidicBackbone(Thread):
                             flow_rate=10000, init_move=True, pipeline=False)
             self.add_to_queue(self.generate_cmd_dict("syringe_pump", syringe.name, "home", {"wait": True}),
                               queue=self.q)
+        while not self.q.empty() or self.tasks:
+            time.sleep(0.1)
+        timings["syringes_ready"] = round(time.time() - init_start, 3)
+        self.prev_run_config["startup_timings"] = timings
+        self.rc_changes = True
+        self.write_log(f"Startup took {timings['syringes_ready']} s: waste search {timings['waste_search']} s, "
+                       f"valves ready at {timings['valves_ready']} s", level=logging.INFO)
+
+    def init_valve_syringe(self, valve, waste_paths, remaining_valves, valve_timings):
+        """Homes a valve, then queues the commands to empty its syringe into the nearest waste container if that
+        container is on the same valve. The commands claim only this valve and syringe, so syringes are emptied
+        concurrently.
+
+        Args:
+            valve (SelectorValve): the valve to initialise
+            waste_paths (dict): the path from each syringe to its nearest waste container
+            remaining_valves (dict): syringes that must be emptied along the backbone are added to this,
+                                     {valve name: path to waste}
+            valve_timings (dict): the time taken to home the valve is added to this
+        """
+        start_time = time.time()
+        # home and prepare valve for running
+        if not self.simulation:
+            valve.init_valve()
+        while not valve.ready:
+            time.sleep(0.1)
+        valve_timings[valve.name] = round(time.time() - start_time, 3)
+        syringe = valve.syringe
+        # check if syringe needs to be homed
+        if syringe.stepper.check_endstop() or self.simulation:
+            return
+        path = waste_paths.get(syringe.name)
+        if path is None:
+            message = f"No waste containers are attached. Please manually empty {syringe.name} using the GUI"
+            self.write_log(message, level=logging.WARNING)
+        elif len(path) > 3:
+            remaining_valves[valve.name] = path
+        else:
+            # Align valves without dispensing much liquid
+            commands = self.plan_fluid_move(syringe.name, path[-1], 0.1, 10000, init_move=True)
+            if commands is None:
+                return
+            # with valves at waste can move to 0
+            commands += self.generate_cmd_dict("syringe_pump", syringe.name, "home", {"wait": True})
+            self.add_to_queue(self.claim_commands(commands, {valve.name, syringe.name}, syringe.name), self.q)
+
+    def find_waste_paths(self):
+        """Finds the nearest waste container to every syringe with a single search outwards from all the waste
+        containers, weighted by dead volume.
+
+        Returns:
+            dict: {syringe name: path from the syringe to its nearest waste container}
+        """
+        wastes = [n for n in self.valid_nodes if "waste" in self.graph.nodes[n]["mod_type"]]
+        if not wastes:
+            return {}
+
+        def weight(u, v, edges):
+            # the search runs against the direction of flow, so edge u -> v is the connection v -> u
+            if v in self.valves or v in self.syringes:
+                return self.tubing_volumes.get((v, u), 0.0)
+            return None
+
+        _, paths = nx.multi_source_dijkstra(self.graph.reverse(copy=False), wastes, weight=weight)
+        return {name: paths[name][::-1] for name in self.syringes if name in paths}
 
     def reload_graph(self):
         graph_config = json_loader(self.script_dir, "configs/module_connections.json")
@@ -337,12 +484,15 @@ class FluidicBackbone(Thread):
                 Thread(target=self.init_syringes, name="syr_init").start()
                 self.syringes_ready = True
             self.check_task_completion()
+            # polled before taking the interrupt lock so the GUI isn't blocked while waiting for the server
+            if self.web_enabled:
+                server_execute = self.listener.update_execution()
             # interrupt lock used to synchronise access to pause, stop, and exit flags
             with self.interrupt_lock:
                 pause_flag = self.pause_flag
                 error = self.error
                 if self.web_enabled:
-                    execute = self.listener.update_execution()
+                    execute = server_execute
                     self.execute = execute
                 else:
                     execute = self.execute
@@ -370,22 +520,27 @@ class FluidicBackbone(Thread):
                     # log reaction completion once
                     if self.reaction_name:
                         self.write_log(f"Completed {self.reaction_name}, id {self.reaction_id}", level=logging.INFO)
+                        self.save_reactor_histories()
                         if self.reaction_id:
                             self.listener.update_status(True, reaction_complete=True)
                         self.reaction_name = ""
                         self.reaction_id = None
                         self.home_all_valves()
+                    if self.staged_reaction is not None:
+                        self.start_staged_reaction()
                     # Attempt to request reaction from server
-                    if self.web_enabled:
-                        if time.time() - rxn_last_check > 10:
+                    elif self.web_enabled:
+                        if time.time() - rxn_last_check > 10 or self.listener.reaction_pending:
                             rxn_last_check = time.time()
                             if self.listener.request_reaction():
                                 self.write_log(f"Prepared to run {self.reaction_name} reaction.", level=logging.INFO)
-                    time.sleep(2)
+                    # returns early when the server pushes an update
+                    self.listener.wait_for_push(2)
                 # a reaction has been queued
                 else:
                     if execute and not self.pause_after_rxn:
                         self.start_queue()
+                        self.reaction_start = time.time()
                         self.write_log(f"Started running {self.reaction_name}, id {self.reaction_id}",
                                        level=logging.INFO)
                         self.reaction_ready = False
@@ -393,6 +548,11 @@ class FluidicBackbone(Thread):
                         self.listener.update_status(False)
                         continue
             # execution ongoing
+            if self.web_enabled and not self.ready and not self.reaction_ready and self.staged_reaction is None:
+                # fetch and compile the next reaction so it can start as soon as this one ends
+                if time.time() - rxn_last_check > 10 or self.listener.reaction_pending:
+                    rxn_last_check = time.time()
+                    self.listener.request_reaction(stage=True)
             if error:
                 if self.web_enabled:
                     self.listener.update_status(self.ready, error=True)
@@ -407,10 +567,16 @@ class FluidicBackbone(Thread):
                     if not self.tasks:
                         with self.interrupt_lock:
                             self.waiting = False
+                    else:
+                        self.preposition_valves()
+                        self.preheat_reactors()
                 #  move on to next queued item
                 elif not self.q.empty():
-                    command_dict = self.q.get(block=False)
-                    if not self.command_module(command_dict):
+                    self.preheat_reactors()
+                    command_dict = self.next_command()
+                    if command_dict is None:
+                        self.preposition_valves()
+                    elif not self.dispatch_command(command_dict):
                         message = f"Failed to add command {command_dict['command']} for {command_dict['module_name']}"
                         self.write_log(message, level=logging.ERROR)
             elif self.error and not self.error_queue.empty():
@@ -482,6 +648,149 @@ class FluidicBackbone(Thread):
             if not self.listener.load_xdl(self.xdl, is_file=False):
                 return False
 
+    def snapshot_state(self):
+        """Copies the vessel, syringe and valve state needed to simulate a pipeline
+
+        Returns:
+            dict: {"vessels": {name: volume in uL}, "syringes": {name: volume in uL}, "valves": {name: port}}
+        """
+        state = {"vessels": {}, "syringes": {}, "valves": {}}
+        for vessels in (self.flasks, self.reactors):
+            for name, vessel in vessels.items():
+                state["vessels"][name] = vessel.cur_vol
+        for name, syringe in self.syringes.items():
+            state["syringes"][name] = syringe.contents[0][1] + syringe.contents[1][1]
+        for name, valve in self.valves.items():
+            state["valves"][name] = valve.current_port
+        return state
+
+    def validate_pipeline(self, commands=None, state=None):
+        """Dry-runs a list of command dicts against a copy of the robot state. Volumes are checked the same way
+        the modules check them during execution, so moves the modules would refuse are found before the robot is
+        committed to a reaction. Like the modules, taking more from a vessel than it is recorded to hold is only a
+        warning, as the recorded volume may be out of date.
+
+        Args:
+            commands (list, optional): the command dicts to simulate. Defaults to the contents of the pipeline.
+            state (dict, optional): the state to start from, as returned by snapshot_state. Defaults to the current
+                                    state of the robot.
+
+        Returns:
+            dict: {"valid": bool, "failed_step": index of the first failing command or None, "message": str,
+                   "warnings": [str], "peak_volumes": {module: uL},
+                   "reagents": {flask: {"contents": str, "volume": uL}},
+                   "state": the simulated state after the last successful command}
+        """
+        if commands is None:
+            commands = list(self.pipeline.queue)
+        if state is None:
+            state = self.snapshot_state()
+        vessels = dict(state["vessels"])
+        syringe_vols = dict(state["syringes"])
+        valve_ports = dict(state["valves"])
+        peak_volumes = {}
+        reagents = {}
+        warnings = []
+        report = {"valid": True, "failed_step": None, "message": "", "warnings": warnings,
+                  "peak_volumes": peak_volumes, "reagents": reagents}
+        for step, command_dict in enumerate(commands):
+            mod_type, name = command_dict.get("mod_type"), command_dict.get("module_name")
+            command, parameters = command_dict.get("command"), command_dict.get("parameters", {})
+            message = ""
+            if mod_type == "selector_valve":
+                valve = self.valves.get(name)
+                if valve is None:
+                    message = f"{name} is not attached to the robot"
+                elif type(command) is int:
+                    valve_ports[name] = command
+                elif command == "target":
+                    port = valve.find_port(parameters["target"])
+                    if port is None:
+                        message = f"{parameters['target']} not found on valve {name}"
+                    valve_ports[name] = port
+                elif command in ("home", "zero"):
+                    valve_ports[name] = 1
+            elif mod_type == "syringe_pump" and command == "move" and name not in self.syringes:
+                message = f"{name} is not attached to the robot"
+            elif mod_type == "syringe_pump" and command == "move":
+                syringe = self.syringes[name]
+                volume, direction = parameters["volume"], parameters["direction"]
+                target = parameters.get("target")
+                if parameters.get("track_volume") is False or (target is None and syringe.valve is None):
+                    target = None
+                elif target is None:
+                    port = valve_ports.get(syringe.valve.name)
+                    target = syringe.valve.ports.get(port)
+                    if target is not None and target.mod_type == "selector_valve":
+                        target = None
+                elif isinstance(target, str):
+                    target = self.find_target(target)
+                # the syringe may travel 2 mm past its zero position before the move is refused
+                tolerance = 0.0
+                if syringe.syringe_length:
+                    tolerance = syringe.calc_volume(2)
+                if direction == "A":
+                    syringe_vols[name] += volume
+                    if syringe_vols[name] > syringe.max_volume:
+                        message = f"{name} cannot aspirate {round(volume, 2)} ul"
+                else:
+                    syringe_vols[name] -= volume
+                    if syringe_vols[name] < -tolerance:
+                        message = f"{name} cannot dispense {round(volume, 2)} ul"
+                    syringe_vols[name] = max(syringe_vols[name], 0.0)
+                peak_volumes[name] = max(peak_volumes.get(name, state["syringes"][name]), syringe_vols[name])
+                if not message and target is not None and target.name in vessels and not parameters.get("air"):
+                    if direction == "A":
+                        vessels[target.name] -= volume
+                        if vessels[target.name] < 0:
+                            warning = f"Insufficient {target.contents[0]} in {target.name}"
+                            warnings.append(warning)
+                            self.write_log(f"Pipeline validation step {step}: {warning}", level=logging.WARNING)
+                        if target.mod_type == "flask":
+                            reagent = reagents.setdefault(target.name, {"contents": target.contents[0], "volume": 0.0})
+                            reagent["volume"] += volume
+                    else:
+                        vessels[target.name] += volume
+                        if vessels[target.name] > target.max_volume:
+                            message = f"Max volume of {target.name} would be exceeded"
+                    peak_volumes[target.name] = max(peak_volumes.get(target.name, state["vessels"][target.name]),
+                                                    vessels[target.name])
+            elif mod_type not in ("selector_valve", "syringe_pump", "reactor", "camera", "storage", "wait"):
+                message = f"{mod_type} is not recognised"
+            if message:
+                report.update(valid=False, failed_step=step, message=message)
+                self.write_log(f"Pipeline validation failed at step {step}: {message}", level=logging.WARNING)
+                break
+        report["state"] = {"vessels": vessels, "syringes": syringe_vols, "valves": valve_ports}
+        return report
+
+    def start_staged_reaction(self):
+        """Readies the staged reaction to run. The staged pipeline is checked against the current state of the robot,
+        and the reaction's XDL is compiled again if the pipeline was discarded or no longer validates.
+
+        Returns:
+            bool: True if the reaction is ready to run
+        """
+        staged, self.staged_reaction = self.staged_reaction, None
+        self.reaction_name = staged["name"]
+        self.reaction_id = staged["reaction_id"]
+        if staged["compiled"]:
+            report = self.validate_pipeline()
+            if report["valid"]:
+                self.projected_state = report["state"]
+                with self.interrupt_lock:
+                    self.reaction_ready = True
+                self.write_log(f"Prepared to run {self.reaction_name} reaction.", level=logging.INFO)
+                return True
+            self.write_log(f"Staged {self.reaction_name} no longer validates, compiling it again",
+                           level=logging.WARNING)
+        if self.listener.load_xdl(staged["xdl"], is_file=False, clean_step=staged["clean_step"]):
+            self.write_log(f"Prepared to run {self.reaction_name} reaction.", level=logging.INFO)
+            return True
+        self.reaction_name = ""
+        self.reaction_id = None
+        return False
+
     def start_queue(self):
         """
         Begins execution of the queued actions
@@ -524,6 +833,229 @@ class FluidicBackbone(Thread):
                 incomplete_tasks.append(task)
         self.tasks = incomplete_tasks
 
+    def next_command(self):
+        """Takes the next command that can be started from the queue. Commands without claims are taken in order,
+        once every claimed command has completed. A claimed command may be taken ahead of commands from other
+        claim groups when its own group is not waiting and none of the modules it claims are held by another group.
+
+        Returns:
+            dict: the command dict, or None if no command can be started yet
+        """
+        self.release_claims()
+        with self.q.mutex:
+            queue = self.q.queue
+            if not queue:
+                return None
+            if queue[0].get("claim_id") is None:
+                if self.claim_tasks or self.is_premoving(queue[0]):
+                    return None
+                return queue.popleft()
+            blocked = set()
+            for i, command_dict in enumerate(queue):
+                claim_id = command_dict.get("claim_id")
+                if claim_id is None:
+                    break
+                if claim_id in blocked:
+                    continue
+                if claim_id in self.claim_waits or self.is_premoving(command_dict) or \
+                        any(self.claims.get(resource, claim_id) != claim_id for resource in command_dict["claims"]):
+                    # keep the commands within a group in order
+                    blocked.add(claim_id)
+                    continue
+                del queue[i]
+                return command_dict
+        return None
+
+    def dispatch_command(self, command_dict):
+        """Commands the required module. Claimed commands never make the Manager wait. Instead, the next command in
+        their group is held back until the tasks of the group have completed.
+
+        Args:
+            command_dict (dict): dictionary containing all necessary information for the action
+
+        Returns:
+            bool: True if the command was successfully sent, False otherwise
+        """
+        claim_id = command_dict.get("claim_id")
+        if claim_id is None:
+            return self.command_module(command_dict)
+        wait = command_dict["parameters"].get("wait")
+        command_dict = dict(command_dict, parameters=dict(command_dict["parameters"], wait=False))
+        num_tasks = len(self.tasks)
+        if not self.command_module(command_dict):
+            return False
+        for resource in command_dict["claims"]:
+            self.claims[resource] = claim_id
+        self.claim_tasks.setdefault(claim_id, []).extend(self.tasks[num_tasks:])
+        if wait:
+            self.claim_waits.add(claim_id)
+        return True
+
+    def release_claims(self):
+        """Forgets completed claimed tasks, releasing the modules held by groups that have finished.
+        """
+        for claim_id in list(self.claim_tasks):
+            tasks = [task for task in self.claim_tasks[claim_id] if not task.is_complete]
+            if tasks:
+                self.claim_tasks[claim_id] = tasks
+            else:
+                del self.claim_tasks[claim_id]
+                self.claim_waits.discard(claim_id)
+        if self.claims:
+            with self.q.mutex:
+                queued = {command_dict.get("claim_id") for command_dict in self.q.queue}
+            for resource, claim_id in list(self.claims.items()):
+                if claim_id not in queued and claim_id not in self.claim_tasks:
+                    del self.claims[resource]
+
+    def preposition_valves(self):
+        """Looks ahead in the queue and starts moving idle valves to the ports needed by their next commands. A valve
+        is left in place while a running or earlier queued syringe command relies on its current port.
+        """
+        for valve_name in [name for name, task in self.premoves.items() if task.is_complete]:
+            del self.premoves[valve_name]
+        blocked = set(self.premoves)
+        for task in self.tasks:
+            if not task.is_complete:
+                blocked.update(self.valves_in_use(task.command_dict))
+        moves = {}
+        with self.q.mutex:
+            for i, command_dict in enumerate(self.q.queue):
+                if i >= LOOKAHEAD_COMMANDS:
+                    break
+                name = command_dict["module_name"]
+                if command_dict["mod_type"] == "selector_valve" and name in self.valves and name not in blocked:
+                    valve = self.valves[name]
+                    command = command_dict["command"]
+                    target = ""
+                    if command == "target":
+                        target = command_dict["parameters"]["target"]
+                        command = valve.find_port(target)
+                    if type(command) is int and valve.current_port not in (None, command):
+                        moves[name] = (command, target)
+                blocked.update(self.valves_in_use(command_dict))
+        for valve_name, (port, target) in moves.items():
+            valve = self.valves[valve_name]
+            command_dict = self.generate_cmd_dict("selector_valve", valve_name, port, {"wait": False})[0]
+            new_task = Task(command_dict, valve)
+            cmd_thread = Thread(target=valve.move_to_pos, name=valve_name + "premove", args=(port, target))
+            new_task.add_worker(cmd_thread)
+            self.tasks.append(new_task)
+            self.premoves[valve_name] = new_task
+            cmd_thread.start()
+
+    def preheat_reactors(self):
+        """Looks ahead in the queue for heating commands that wait for their reactor to reach temperature, and starts
+        heating those reactors once the commands before them are expected to take no longer than the reactor takes to
+        heat up. Reactors that are already in use, or that have no thermal model to predict their heating time, are
+        left alone.
+        """
+        # {reactor name: (temperature, seconds until the heating command runs)}, or None if not heated next
+        upcoming = {}
+        now = time.time()
+        # tasks already running finish before the queue moves on
+        queue_secs = 0.0
+        for task in self.tasks:
+            task_secs = self.estimate_command_secs(task.command_dict)
+            if task_secs is None:
+                return
+            queue_secs = max(queue_secs, task_secs - (now - task.start_time))
+        with self.q.mutex:
+            for i, command_dict in enumerate(self.q.queue):
+                if i >= LOOKAHEAD_COMMANDS:
+                    break
+                name = command_dict["module_name"]
+                if command_dict["mod_type"] == "reactor" and name in self.reactors and name not in upcoming:
+                    parameters = command_dict["parameters"]
+                    if command_dict["command"] == "start_heat" and parameters.get("target"):
+                        upcoming[name] = (parameters["temp"], queue_secs)
+                    else:
+                        # the reactor's next command isn't a heating command, so it shouldn't be heated yet
+                        upcoming[name] = None
+                command_secs = self.estimate_command_secs(command_dict)
+                if command_secs is None:
+                    # commands after this one can't be timed
+                    break
+                queue_secs += command_secs
+        for name, heat in upcoming.items():
+            reactor = self.reactors[name]
+            if heat is None or name in self.preheats or reactor.heating or reactor.tuning:
+                continue
+            temp, start_in = heat
+            ready_in = reactor.time_to_target(temp)
+            if ready_in is None or start_in > ready_in:
+                continue
+            self.preheats[name] = temp
+            reactor.heat_task = None
+            reactor.start_heat(temp, 0, True, None)
+            self.write_log(f"{name} started heating to {temp}°C ahead of its heating step in about "
+                           f"{round(start_in)} s, ready in about {round(ready_in)} s")
+
+    def estimate_command_secs(self, command_dict):
+        """Estimates how long a command takes to run
+
+        Args:
+            command_dict (dict): a queued or running command
+
+        Returns:
+            float: the estimated time in seconds, or None if it can't be estimated
+        """
+        mod_type, name, command = command_dict["mod_type"], command_dict["module_name"], command_dict["command"]
+        parameters = command_dict["parameters"]
+        if mod_type == "syringe_pump" and command == "move":
+            flow_rate = parameters.get("flow_rate") or self.default_fr
+            return parameters["volume"] / flow_rate * 60 + min(flow_rate / 5000, syringepump.MAX_SETTLE_SECS)
+        elif mod_type == "wait":
+            return parameters["time"] if command == "wait" else None
+        elif mod_type == "reactor":
+            if command == "start_heat" and parameters.get("wait"):
+                if not parameters.get("target"):
+                    return parameters["heat_secs"]
+                if name not in self.reactors:
+                    return None
+                ready_in = self.reactors[name].time_to_target(parameters["temp"])
+                return None if ready_in is None else ready_in + parameters["heat_secs"]
+            elif command == "start_stir" and parameters.get("wait"):
+                return parameters["stir_secs"]
+            elif command == "autotune":
+                return None
+            return 0.0
+        return COMMAND_SECS
+
+    def stop_preheats(self):
+        for name in self.preheats:
+            self.reactors[name].stop_heat()
+        self.preheats = {}
+
+    def valves_in_use(self, command_dict):
+        """
+        Args:
+            command_dict (dict): a queued or running command
+
+        Returns:
+            set: the names of the valves that the command moves or relies on the current port of
+        """
+        name = command_dict["module_name"]
+        if command_dict["mod_type"] == "selector_valve":
+            return {name}
+        valves = set()
+        if command_dict["mod_type"] == "syringe_pump" and name in self.syringes:
+            if self.syringes[name].valve is not None:
+                valves.add(self.syringes[name].valve.name)
+            target = command_dict["parameters"].get("target")
+            if target in self.syringes and self.syringes[target].valve is not None:
+                valves.add(self.syringes[target].valve.name)
+        return valves
+
+    def is_premoving(self, command_dict):
+        task = self.premoves.get(command_dict["module_name"])
+        return task is not None and not task.is_complete
+
+    def clear_claims(self):
+        self.claims = {}
+        self.claim_tasks = {}
+        self.claim_waits = set()
+
     def pause_all(self):
         """
         Pauses all currently running tasks and queue execution.
@@ -533,6 +1065,8 @@ class FluidicBackbone(Thread):
         for task in self.tasks:
             if not task.module_ready:
                 task.pause()
+        # heating started ahead of its command restarts with the command when resumed
+        self.stop_preheats()
         if self.stop_flag:
             self.stop_all()
 
@@ -541,8 +1075,15 @@ class FluidicBackbone(Thread):
         Removes all queued actions, should be called after pause if stopping.
         """
         self.tasks = []
+        self.premoves = {}
+        self.clear_claims()
         with self.q.mutex:
             self.q.queue.clear()
+        # the staged pipeline was validated against the end state of the stopped reaction
+        if self.staged_reaction is not None and self.staged_reaction["compiled"]:
+            self.staged_reaction["compiled"] = False
+            self.pipeline.queue.clear()
+        self.projected_state = None
         self.paused = False
         self.pause_flag = False
         self.stop_flag = False
@@ -567,6 +1108,8 @@ class FluidicBackbone(Thread):
             command_dict = self.q.get(block=False)
             new_q.put(command_dict)
         self.q = new_q
+        self.premoves = {}
+        self.clear_claims()
         self.error_flag = False
         self.error = False
         self.pause_flag = False
@@ -648,6 +1191,11 @@ class FluidicBackbone(Thread):
         elif command == "jog":
             cmd_thread = Thread(target=self.syringes[name].jog, name=name + "jog",
                                 args=(parameters["steps"], parameters["direction"], new_task))
+        elif command == "calibrate":
+            fluid = parameters.get("fluid", "air")
+            default = self.default_flush_fr if fluid == "air" else self.default_fr
+            cmd_thread = Thread(target=self.syringes[name].calibrate_flow_rate, name=name + "calibrate",
+                                args=(fluid, parameters["volume"], default, new_task))
         elif command == "setpos":
             position = parameters["pos"]
             cmd_thread = Thread(target=self.syringes[name].set_pos, name=name + "setpos", args=(position,))
@@ -674,7 +1222,7 @@ class FluidicBackbone(Thread):
         """
         new_task = Task(command_dict, self.valves[name])
         self.tasks.append(new_task)
-        if type(command) is int and 0 <= command < 11:
+        if type(command) is int and command in self.valves[name].pos_dict:
             port = command
             cmd_thread = Thread(target=self.valves[name].move_to_pos, name=name + "movepos", args=(port,))
         elif command == "target":
@@ -766,11 +1314,15 @@ class FluidicBackbone(Thread):
             temp = parameters["temp"]
             heat_secs = parameters["heat_secs"]
             target = parameters["target"]
-            self.reactors[name].start_heat(temp, heat_secs, target, new_task)
-            self.reactors[name].heat_task = new_task
+            preheated = self.preheats.pop(name, None) is not None
+            if not (preheated and target and self.reactors[name].take_over_heat(temp, heat_secs, new_task)):
+                self.reactors[name].start_heat(temp, heat_secs, target, new_task)
+                self.reactors[name].heat_task = new_task
         elif command == "stop_heat":
             self.reactors[name].stop_heat()
             new_task.complete = True
+        elif command == "autotune":
+            self.reactors[name].start_autotune(parameters["temps"], new_task)
         else:
             self.write_log(f"{command} is not a valid command", level=logging.WARNING)
             return False
@@ -896,7 +1448,7 @@ class FluidicBackbone(Thread):
             time.sleep(1)
 
     def move_fluid(self, source, target, volume, flow_rate, init_move=False, adjust_dead_vol=True, transfer=False,
-                   pipeline=True):
+                   pipeline=True, keep_primed=False):
         """
         Adds the necessary command dicts to the pipeline to enact a fluid movement from source to target
 
@@ -909,14 +1461,43 @@ class FluidicBackbone(Thread):
             adjust_dead_vol (bool): Whether to account for dead volume in tubing
             transfer (bool): Whether the fluid involves transfer from a source other than a reagent bottle
             pipeline (bool): True - add the commands to the pipeline. False - add to main queue.
+            keep_primed (bool): Whether to leave a transfer line filled for later transfers from the same source,
+                                rather than flushing it back into the source. See flush_primed_lines.
         Returns:
             True if successfully queued or False otherwise
         """
+        pipelined_steps = self.plan_fluid_move(source, target, volume, flow_rate, init_move, adjust_dead_vol,
+                                               transfer, keep_primed)
+        if pipelined_steps is None:
+            return False
+        if not pipeline:
+            self.add_to_queue(pipelined_steps, self.q)
+        else:
+            self.add_to_queue(pipelined_steps, self.pipeline)
+        return True
+
+    def plan_fluid_move(self, source, target, volume, flow_rate, init_move=False, adjust_dead_vol=True,
+                        transfer=False, keep_primed=False):
+        """
+        Generates the command dicts to enact a fluid movement from source to target without queueing them
+
+        Args:
+            source (str): the name of the source module
+            target (str): the name of the target module
+            volume (float): the volume of fluid in uL to be moved
+            flow_rate (int): uL per second to move
+            init_move (bool): whether this is an initialisation move (clearing lines from prev run) not
+            adjust_dead_vol (bool): Whether to account for dead volume in tubing
+            transfer (bool): Whether the fluid involves transfer from a source other than a reagent bottle
+            keep_primed (bool): Whether to leave a transfer line filled for later transfers from the same source
+        Returns:
+            list: the command dicts for the movement, or None if the movement is not possible
+        """
 
         # Returns a simple path from source to target. No nodes are repeated.
         path = self.find_path(source, target)
         if len(path) < 1:
-            return False
+            return None
         pipelined_steps = []
         volume = (volume * 1000) + 50  # testing shows ~50 ul remains in the syringe after transfers
         prev_max_vol = 999999.00
@@ -948,32 +1529,100 @@ class FluidicBackbone(Thread):
             dead_volume = max(transfer_dv, req_last_dv, max_valves_dv)
         max_volume = max_vol - min_vol - dead_volume
         if max_volume < 0:
-            return False
+            return None
         nr_full_moves = int(volume / max_volume)
         remaining_volume = volume % max_volume
-        if nr_full_moves >= 1:
-            full_move = self.generate_moves(source, target, valves, max_volume, dead_volume, flow_rate, transfer,
-                                            init_move)
-            for i in range(0, nr_full_moves):
-                pipelined_steps += full_move
+        strokes = [max_volume] * nr_full_moves
         if remaining_volume > 0.0:
-            partial_move = self.generate_moves(source, target, valves, remaining_volume, dead_volume, flow_rate,
-                                               transfer,
-                                               init_move)
-            pipelined_steps += partial_move
+            strokes.append(remaining_volume)
+        # lines primed with another fluid are returned to their vessel before they are used
+        pipelined_steps += self.flush_primed_lines(self.find_primed_lines(source, target, valves, transfer))
+        for stroke in strokes:
+            # the transfer line stays primed between strokes, so only the first stroke needs to fill it
+            moves = self.generate_moves(source, target, valves, stroke, dead_volume, flow_rate, transfer, init_move)
+            if moves is None:
+                return None
+            pipelined_steps += moves
+        if transfer and not keep_primed:
+            pipelined_steps += self.flush_primed_lines([(source.name, valves[0])])
+        return pipelined_steps
+
+    def move_fluids_concurrently(self, moves, pipeline=True):
+        """Adds the command dicts for several fluid movements to the pipeline. Consecutive movements whose routes
+        share no valves or syringes are interleaved and tagged with the modules they claim, allowing the Manager
+        to run them at the same time. Movements that share a valve or syringe are kept in the order requested.
+
+        Args:
+            moves (list): (source, target, volume, flow_rate) tuples, in the order requested
+            pipeline (bool): True - add the commands to the pipeline. False - add to main queue.
+
+        Returns:
+            bool: True if all movements were successfully queued, False otherwise
+        """
+        batches = []
+        for move in moves:
+            path = self.find_path(move[0], move[1])
+            if len(path) < 3:
+                return False
+            resources = set(path[1:-1])
+            resources.update(valve for _, valve in self.find_primed_lines(path[0], path[-1], path[1:-1]))
+            resources.update(self.valves[valve].syringe.name for valve in list(resources))
+            if batches and all(resources.isdisjoint(claims) for _, claims in batches[-1]):
+                batches[-1].append((move, resources))
+            else:
+                batches.append([(move, resources)])
+        pipelined_steps = []
+        for batch in batches:
+            segments = []
+            for move, resources in batch:
+                steps = self.plan_fluid_move(*move)
+                if steps is None:
+                    return False
+                if len(batch) == 1:
+                    pipelined_steps += steps
+                    continue
+                # split the movement after each command that the Manager would wait for
+                move_segments = [[]]
+                for command_dict in self.claim_commands(steps, resources, f"{move[0]}-{move[1]}"):
+                    move_segments[-1].append(command_dict)
+                    if command_dict["parameters"].get("wait"):
+                        move_segments.append([])
+                segments.append([segment for segment in move_segments if segment])
+            while segments:
+                for move_segments in segments:
+                    pipelined_steps += move_segments.pop(0)
+                segments = [move_segments for move_segments in segments if move_segments]
         if not pipeline:
             self.add_to_queue(pipelined_steps, self.q)
         else:
             self.add_to_queue(pipelined_steps, self.pipeline)
         return True
 
+    def claim_commands(self, commands, resources, name):
+        """Tags commands with the modules they claim, so that the Manager can run them alongside other claimed groups.
+
+        Args:
+            commands (list): the command dicts of the group, in order
+            resources (set): the names of the modules used by the group
+            name (str): a name for the group
+
+        Returns:
+            list: the tagged command dicts
+        """
+        self.claim_count += 1
+        claim_id = f"{name}-{self.claim_count}"
+        claims = sorted(resources)
+        return [dict(command_dict, claims=claims, claim_id=claim_id) for command_dict in commands]
+
     def find_path(self, source, target):
         """
-        Finds a path using networkx graph from source to target
+        Finds the route with the lowest dead volume from source to target
 
         Args:
             source (str): the name of the source module
             target (str): the name of the target module
+        Returns:
+            list: the names of the nodes along the path, or an empty list if no path exists
         """
         source_found = False
         target_found = False
@@ -982,10 +1631,9 @@ class FluidicBackbone(Thread):
         if target in self.valid_nodes:
             target_found = True
         if source_found and target_found:
-            paths = nx.algorithms.all_simple_paths(self.graph, source, target)
-            path_list = [p for p in paths]
-            if path_list:
-                return path_list[0]
+            path = self.routes.get((source, target))
+            if path:
+                return list(path)
         if not source_found:
             self.write_log(f"{source} not present", level=logging.WARNING)
         if not target_found:
@@ -994,6 +1642,7 @@ class FluidicBackbone(Thread):
 
     def flush_flask_transfer_dv(self, valve, source, dead_volume, intake):
         steps = []
+        flush_fr = self.flow_model.flow_rate(valve.syringe.name, "air", 0, self.default_flush_fr)
         if dead_volume > 0:
             if intake:
                 # Command to index valve to required position to remove dead volume in tube
@@ -1001,24 +1650,67 @@ class FluidicBackbone(Thread):
                                                 {"target": source.name, "wait": True})
                 # Command to aspirate syringe to remove dead volume - doesn't update volumes
                 steps += self.generate_cmd_dict("syringe_pump", valve.syringe.name, "move",
-                                                {"volume": dead_volume, "flow_rate": self.default_flush_fr,
+                                                {"volume": dead_volume, "flow_rate": flush_fr,
                                                  "target": None, "direction": "A", "air": True, "wait": True})
             else:
                 steps += self.generate_cmd_dict("selector_valve", valve.name, "target",
                                                 {"target": "empty", "wait": True})
                 steps += self.generate_cmd_dict("syringe_pump", valve.syringe.name, "move",
-                                                {"volume": dead_volume, "flow_rate": self.default_flush_fr,
+                                                {"volume": dead_volume, "flow_rate": flush_fr,
                                                  "target": None, "direction": "A", "air": True, "wait": True})
                 # Command to index valve to required position for outlet
                 steps += self.generate_cmd_dict("selector_valve", valve.name, "target",
                                                 {"target": source.name, "wait": True})
                 # Command to dispense air to blow out dead volume
                 steps += self.generate_cmd_dict("syringe_pump", valve.syringe.name, "move",
-                                                {"volume": dead_volume, "flow_rate": self.default_flush_fr,
+                                                {"volume": dead_volume, "flow_rate": flush_fr,
                                                  "target": source.name, "direction": "D", "air": True,
                                                  "wait": True})
         return steps
 
+    def find_primed_lines(self, source, target, valves, transfer=False):
+        """Finds the primed transfer lines that must be flushed before a movement. A line is kept primed only if the
+        movement is a transfer from the same vessel through the same valve.
+
+        Args:
+            source (Module/str): the source of the movement
+            target (Module/str): the target of the movement
+            valves (list): the names of the valves along the path of the movement
+            transfer (bool): whether the movement is a transfer from a non-reagent vessel
+
+        Returns:
+            list: the (vessel, valve) lines to flush
+        """
+        source = getattr(source, "name", source)
+        target = getattr(target, "name", target)
+        lines = []
+        for vessel, valve in self.line_contents:
+            if transfer and (vessel, valve) == (source, valves[0]):
+                continue
+            if valve in valves or vessel in (source, target):
+                lines.append((vessel, valve))
+        return lines
+
+    def flush_primed_lines(self, lines=None):
+        """Generates the commands to return the liquid held in primed transfer lines to their vessels
+
+        Args:
+            lines (list, optional): the (vessel, valve) lines to flush. Defaults to all primed lines.
+
+        Returns:
+            list: the command dicts to flush the lines
+        """
+        if lines is None:
+            lines = list(self.line_contents)
+        steps = []
+        for vessel, valve in lines:
+            if self.line_contents.pop((vessel, valve), None) is None:
+                continue
+            transfer_dv = self.calc_tubing_volume(vessel, valve, 0.75)
+            steps += self.flush_flask_transfer_dv(self.valves[valve], self.graph.nodes[vessel]["object"],
+                                                  transfer_dv, False)
+        return steps
+
     def calc_tubing_volume(self, source, target, adjust=0.0):
         """
         Args:
@@ -1026,10 +1718,14 @@ class FluidicBackbone(Thread):
             target (Module): target node
             adjust (float): whether to account for an additional 20% loss
         """
-        tubing_length = self.graph.adj[source][target][0]["tubing_length"]
+        volume = self.tubing_volumes.get((source, target))
+        if volume is None:
+            edge = self.graph.adj[source][target][0]
+            tubing_id = edge.get("tubing_id", DEFAULT_TUBING_ID)
+            volume = math.pow((tubing_id / 2), 2) * math.pi * edge["tubing_length"]
         # factor of safety is 20%
         factor = 1 + (0.2 * adjust)
-        return math.pow((1.5875 / 2), 2) * math.pi * tubing_length * factor
+        return volume * factor
 
     def generate_moves(self, source, target, valves, volume, dead_volume, flow_rate, transfer, init_move=False):
         """
@@ -1047,13 +1743,17 @@ class FluidicBackbone(Thread):
 
             init_move (bool): whether this is an initialisation move or not
         Returns:
-            moves (list): the moves to queue
+            moves (list): the moves to queue. A transfer leaves its source line primed, see flush_primed_lines.
         """
         moves = []
-        # flush out non-reagent line
+        fluid = self.get_fluid(source)
+        # flush out non-reagent line, unless it is already primed with the source's contents
         if transfer:
-            transfer_dv = self.calc_tubing_volume(source.name, valves[0], 0.75)
-            moves += self.flush_flask_transfer_dv(self.valves[valves[0]], source, transfer_dv, True)
+            transfer_dv = 0
+            if self.line_contents.get((source.name, valves[0])) != source.name:
+                transfer_dv = self.calc_tubing_volume(source.name, valves[0], 0.75)
+                moves += self.flush_flask_transfer_dv(self.valves[valves[0]], source, transfer_dv, True)
+                self.line_contents[(source.name, valves[0])] = source.name
         # Take up the air required to push through all dead volume
         if dead_volume > 0:
             if self.valves[valves[0]].find_open_port() is None:
@@ -1066,27 +1766,43 @@ class FluidicBackbone(Thread):
             moves += self.generate_cmd_dict("selector_valve", valves[0], "target",
                                             {"target": "empty", "wait": True})
             # Command to aspirate air to fill dead volume
-            moves += self.generate_cmd_dict("syringe_pump", self.valves[valves[0]].syringe.name, "move",
-                                            {"volume": add_dead_volume, "flow_rate": self.default_flush_fr,
+            syringe_name = self.valves[valves[0]].syringe.name
+            flush_fr = self.flow_model.flow_rate(syringe_name, "air", 0, self.default_flush_fr)
+            moves += self.generate_cmd_dict("syringe_pump", syringe_name, "move",
+                                            {"volume": add_dead_volume, "flow_rate": flush_fr,
                                              "target": None, "direction": "A", "air": True, "wait": True})
         # Move liquid into first syringe pump
         if not init_move:
             moves += self.generate_sp_move(source, self.valves[valves[0]], self.valves[valves[0]].syringe, volume,
-                                           dead_volume, flow_rate)
+                                           dead_volume, flow_rate, fluid)
         # transfer liquid along backbone
         if len(valves) > 1:
             for i in range(len(valves) - 1):
                 moves += self.generate_sp_transfer(self.valves[valves[i]], self.valves[valves[i + 1]], volume,
-                                                   dead_volume, flow_rate)
+                                                   dead_volume, flow_rate, fluid)
         # Move liquid from last syringe pump into target
         valve = self.valves[valves[-1]]
-        moves += self.generate_sp_move(valve.syringe, valve, target, volume, dead_volume, flow_rate)
-        # If transferring from a non-reagent line, flush the dead volume back into the source
-        if transfer:
-            moves += self.flush_flask_transfer_dv(self.valves[valves[0]], source, transfer_dv, False)
+        moves += self.generate_sp_move(valve.syringe, valve, target, volume, dead_volume, flow_rate, fluid)
         return moves
 
-    def generate_sp_move(self, source, valve, target, volume, dead_volume, flow_rate):
+    @staticmethod
+    def get_fluid(module):
+        """
+        Args:
+            module (Module): the module holding the fluid
+
+        Returns:
+            str: the name of the fluid held by the module, or an empty string if not known
+        """
+        if module is None:
+            return ""
+        if module.mod_type == "syringe_pump":
+            return module.contents[1][0]
+        if module.mod_type in ("flask", "waste", "reactor"):
+            return module.contents[0]
+        return ""
+
+    def generate_sp_move(self, source, valve, target, volume, dead_volume, flow_rate, fluid=""):
         """
         Generates the commands to dispense or aspirate a syringe
         Args:
@@ -1095,7 +1811,8 @@ class FluidicBackbone(Thread):
             target (Module): Module object for the target
             volume (float): volume to move in uL
             dead_volume (float): the dead volume of air to move in uL
-            flow_rate (int): flow rate in uL/min
+            flow_rate (int): flow rate in uL/min. 0 uses the highest flow rate learned to be safe for the fluid.
+            fluid (str): the name of the fluid being moved
         Returns:
             commands (list): List containing the command dictionaries for the move
         """
@@ -1116,8 +1833,7 @@ class FluidicBackbone(Thread):
                 target_name = "empty"
             else:
                 target_name = source.name
-        if flow_rate == 0:
-            flow_rate = self.default_fr
+        flow_rate = self.flow_model.flow_rate(name, fluid, flow_rate, self.default_fr)
 
         # Command to index valve to required position
         commands += self.generate_cmd_dict("selector_valve", valve.name, "target",
@@ -1132,7 +1848,7 @@ class FluidicBackbone(Thread):
                                                 "direction": direction, "wait": True})
         return commands
 
-    def generate_sp_transfer(self, source_valve, target_valve, volume, dead_volume, flow_rate):
+    def generate_sp_transfer(self, source_valve, target_valve, volume, dead_volume, flow_rate, fluid=""):
         """
         Generates the commands necessary to transfer liquid between two adjacent valves
 
@@ -1141,6 +1857,7 @@ class FluidicBackbone(Thread):
         target_valve (SelectorValve): target valve object
         volume (float): volume to be transferred in uL
         flow_rate (int): flow rate in ul/min
+        fluid (str): the name of the fluid being transferred
 
         Returns:
          list of command dicts
@@ -1156,8 +1873,11 @@ class FluidicBackbone(Thread):
                 target_port = adj_valve[1]
         if source_port is None or target_port is None:
             return False
-        if flow_rate == 0 or flow_rate > self.default_transfer_fr:
-            flow_rate = self.default_transfer_fr
+        # both syringes move together, so the transfer is limited by the slower of the two
+        max_fr = min(self.flow_model.max_flow_rate(syringe.name, fluid, self.default_transfer_fr)
+                     for syringe in (source_valve.syringe, target_valve.syringe))
+        if flow_rate == 0 or flow_rate > max_fr:
+            flow_rate = max_fr
         # add commands to index valves to required ports for transfer
         commands += self.generate_cmd_dict("selector_valve", source_valve.name, source_port,
                                            {"wait": True})
@@ -1251,6 +1971,18 @@ class FluidicBackbone(Thread):
             command_dict = FluidicBackbone.generate_cmd_dict("reactor", reactor_name, command, {})
             self.add_to_queue(command_dict)
 
+    def autotune_reactor(self, reactor_name, temps, wait=True):
+        """Adds a command to auto-tune the reactor's heating to the manager queue
+
+        Args:
+            reactor_name (str): Name of the reactor to tune
+            temps (list): the temperatures to tune at. Gains are scheduled between them.
+            wait (bool, optional): whether to wait for tuning to finish. Defaults to True.
+        """
+        params = {"temps": temps, "wait": wait}
+        command_dict = FluidicBackbone.generate_cmd_dict("reactor", reactor_name, "autotune", params)
+        self.add_to_queue(command_dict)
+
     def send_image(self, img_num, img_processing, task):
         cam = self.cameras["camera1"]
         image_metadata = {"robot_id": self.id, "robot_key": self.key, "reaction_id": self.reaction_id,
@@ -1305,9 +2037,29 @@ class FluidicBackbone(Thread):
             if self.reactors[r].stirring and self.reactors[r].stir_start_time - time.time() > 300:
                 self.reactors[r].stop_stir()
 
-    def home_all_valves(self):
+    def save_reactor_histories(self):
+        """Saves each reactor's temperature, heater and stirrer history over the reaction to
+        configs/reactor_history/<reaction>_<reactor>.npy
+        """
+        reaction = self.reaction_id if self.reaction_id else self.reaction_name
+        for name, r in self.reactors.items():
+            fp = os.path.join(self.script_dir, "configs", "reactor_history", f"{reaction}_{name}.npy")
+            try:
+                r.save_history(fp, self.reaction_start)
+            except OSError as e:
+                self.write_log(f"Could not save the history of {name}: {e}", level=logging.WARNING)
+
+    def home_all_valves(self, force=False):
+        """Queues homing for the valves whose position confidence has dropped below the threshold
+
+        Args:
+            force (bool, optional): whether to home every valve regardless of confidence. Defaults to False.
+        """
         home_cmds = []
         for valve in self.valves:
+            self.valves[valve].save_telemetry()
+            if not force and not self.valves[valve].needs_homing:
+                continue
             home_cmds.append({"mod_type": "selector_valve", "module_name": valve, "command": "home",
                               "parameters": {"wait": True}})
         self.add_to_queue(home_cmds, self.q)
@@ -1319,9 +2071,15 @@ class FluidicBackbone(Thread):
             self.cameras[cam].exit_flag = True
         for valve in self.valves:
             self.prev_run_config["valve_pos"][valve] = self.valves[valve].current_port
+            self.valves[valve].save_telemetry()
         self.write_running_config("configs\\running_config.json")
         for r in self.reactors:
             self.reactors[r].exit = True
+            self.reactor_scheduler.remove(self.reactors[r])
+        # a shared scheduler keeps running the other robots' reactors
+        if self.owns_scheduler:
+            self.reactor_scheduler.exit = True
+        self.listener.stop()
         self.quit_safe = True
 
 
@@ -1334,6 +2092,7 @@ class Task:
         self.command_dict = command_dict
         self.command_dicts = [self.command_dict]
         self.module = module
+        self.start_time = time.time()
         self.worker = None
         self.single_action = single_action
         self.complete = False
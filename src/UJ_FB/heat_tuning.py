@@ -0,0 +1,210 @@
+"""This script contains the RelayTuner class and functions used to auto-tune the reactor heating PID controllers.
+The heater is switched fully on below the set point and off above it, which makes the temperature oscillate about the
+set point. The amplitude and period of the oscillation give the ultimate gain and period of the reactor, which are
+used to calculate PID gains and to identify a first order plus dead time model of the reactor. The same model can be
+fitted to the heating curves logged during preheats, and is used to predict how long a reactor takes to reach a
+temperature.
+"""
+
+import math
+import numpy as np
+
+# the temperature must pass this far beyond the set point before the relay switches, in °C
+RELAY_HYSTERESIS = 0.5
+# oscillation cycles measured at each set point. The first cycle is discarded as it starts from ambient.
+RELAY_CYCLES = 4
+# maximum time spent tuning at each set point, in seconds
+TUNE_TIMEOUT = 3600
+# readings needed to fit a model to a heating curve
+MIN_FIT_SAMPLES = 20
+# temperature rise in °C needed to fit a model to a heating curve
+MIN_FIT_RISE = 5
+# temperature rise in °C that marks the end of the dead time
+RISE_THRESHOLD = 0.5
+
+
+class RelayTuner:
+    """
+    Runs a relay feedback experiment at one set point and calculates the results once enough cycles are measured.
+    """
+
+    def __init__(self, setpoint, start_time, ambient, max_power):
+        """
+        Args:
+            setpoint (float): the temperature to oscillate about in °C
+            start_time (float): the time that tuning started
+            ambient (float): the ambient temperature in °C
+            max_power (float): the power of the heater when fully on in W
+        """
+        self.setpoint = setpoint
+        self.start_time = start_time
+        self.ambient = ambient
+        self.max_power = max_power
+        self.heating = True
+        # times the heater was switched on, after the first switch off
+        self.on_times = []
+        self.peaks = []
+        self.troughs = []
+        self.cur_max = -math.inf
+        self.cur_min = math.inf
+        # [(time, temperature, heater on)]
+        self.samples = []
+
+    def update(self, now, temp):
+        """Records a temperature reading and switches the relay if the temperature has passed the set point
+
+        Args:
+            now (float): the time of the reading
+            temp (float): the temperature in °C
+
+        Returns:
+            bool: True if the heater should be on
+        """
+        self.samples.append((now, temp, self.heating))
+        if self.heating:
+            self.cur_min = min(self.cur_min, temp)
+            if temp > self.setpoint + RELAY_HYSTERESIS:
+                self.heating = False
+                if self.on_times:
+                    self.troughs.append(self.cur_min)
+                self.cur_max = temp
+        else:
+            self.cur_max = max(self.cur_max, temp)
+            if temp < self.setpoint - RELAY_HYSTERESIS:
+                self.heating = True
+                self.peaks.append(self.cur_max)
+                self.on_times.append(now)
+                self.cur_min = temp
+        return self.heating
+
+    @property
+    def complete(self):
+        return len(self.on_times) >= RELAY_CYCLES + 2
+
+    def timed_out(self, now):
+        return now - self.start_time > TUNE_TIMEOUT
+
+    def result(self):
+        """Calculates the ultimate gain and period from the measured cycles, and identifies the reactor's thermal
+        model from them
+
+        Returns:
+            dict: {"temp", "ku", "tu", "plant"}, or None if fewer than two cycles were measured
+        """
+        if len(self.on_times) < 3 or not self.troughs:
+            return None
+        # skip the first cycle, which started from ambient
+        periods = np.diff(self.on_times[1:])
+        tu = float(np.mean(periods))
+        amplitude = (np.mean(self.peaks[1:]) - np.mean(self.troughs)) / 2
+        relay_amplitude = self.max_power / 2
+        ku = 4 * relay_amplitude / (math.pi * math.sqrt(max(amplitude ** 2 - RELAY_HYSTERESIS ** 2, 1e-6)))
+        cycles = [sample for sample in self.samples if sample[0] >= self.on_times[1]]
+        mean_temp = np.mean([sample[1] for sample in cycles])
+        mean_power = np.mean([sample[2] for sample in cycles]) * self.max_power
+        gain = (mean_temp - self.ambient) / mean_power if mean_power > 0 else 0.0
+        return {"temp": self.setpoint, "ku": ku, "tu": tu, "plant": fopdt_from_relay(ku, tu, gain, self.ambient)}
+
+
+def fopdt_from_relay(ku, tu, gain, ambient):
+    """Identifies a first order plus dead time model from the ultimate gain and period, and the static gain
+
+    Args:
+        ku (float): the ultimate gain in W/°C
+        tu (float): the ultimate period in seconds
+        gain (float): the static gain of the reactor in °C/W
+        ambient (float): the ambient temperature in °C
+
+    Returns:
+        dict: {"gain": °C/W, "time_constant": s, "dead_time": s, "ambient": °C}
+    """
+    loop_gain = gain * ku
+    time_constant = tu / (2 * math.pi) * math.sqrt(max(loop_gain ** 2 - 1, 0.0))
+    dead_time = tu / (2 * math.pi) * (math.pi - math.atan(2 * math.pi * time_constant / tu))
+    return {"gain": float(gain), "time_constant": float(time_constant), "dead_time": float(dead_time),
+            "ambient": float(ambient)}
+
+
+def pid_from_relay(ku, tu):
+    """Calculates PID gains from the ultimate gain and period with the Ziegler-Nichols no overshoot rule
+
+    Args:
+        ku (float): the ultimate gain in W/°C
+        tu (float): the ultimate period in seconds
+
+    Returns:
+        tuple: the proportional (W/°C), integral (W/°C/s) and derivative (W.s/°C) gains
+    """
+    kp = 0.2 * ku
+    ti = tu / 2
+    td = tu / 3
+    return kp, kp / ti, kp * td
+
+
+def fit_first_order(times, temps, powers, ambient):
+    """Fits a first order plus dead time model to a logged heating curve. The dead time is the delay before the
+    temperature first rises, and the gain and time constant are found by a least squares fit of
+    dT/dt = (gain * power - (T - ambient)) / time_constant, using the power applied one dead time earlier.
+
+    Args:
+        times (numpy.ndarray): the times of the readings in seconds
+        temps (numpy.ndarray): the temperatures in °C
+        powers (numpy.ndarray): the heater power applied at each reading in W
+        ambient (float): the ambient temperature in °C
+
+    Returns:
+        dict: {"gain": °C/W, "time_constant": s, "dead_time": s, "ambient": °C}, or None if the curve doesn't fit
+    """
+    if times.size < MIN_FIT_SAMPLES or temps[-1] - temps[0] < MIN_FIT_RISE:
+        return None
+    risen = np.flatnonzero(temps - temps[0] > RISE_THRESHOLD)
+    dead_time = float(times[risen[0]] - times[0]) if risen.size else 0.0
+    # the power that is affecting each reading was applied one dead time earlier
+    delayed = np.searchsorted(times, times - dead_time, side="right") - 1
+    delayed_powers = np.where(delayed >= 0, powers[np.maximum(delayed, 0)], 0.0)
+    slopes = np.gradient(temps, times)
+    a = np.column_stack((delayed_powers, -(temps - ambient)))
+    (k, b), *_ = np.linalg.lstsq(a, slopes, rcond=None)
+    if k <= 0 or b <= 0:
+        return None
+    return {"gain": float(k / b), "time_constant": float(1 / b), "dead_time": dead_time, "ambient": float(ambient)}
+
+
+def time_to_temp(model, start_temp, temp, power):
+    """Predicts the time for a reactor to reach a temperature, heating at a constant power or cooling with the heater
+    off
+
+    Args:
+        model (dict): the reactor's first order plus dead time model
+        start_temp (float): the current temperature in °C
+        temp (float): the temperature to reach in °C
+        power (float): the heater power while heating in W
+
+    Returns:
+        float: the time in seconds, or None if the temperature can't be reached
+    """
+    ambient = model["ambient"]
+    if temp >= start_temp:
+        final_temp = ambient + model["gain"] * power
+        if temp >= final_temp:
+            return None
+        return model["dead_time"] + model["time_constant"] * math.log((final_temp - start_temp) / (final_temp - temp))
+    if temp <= ambient:
+        return None
+    return model["dead_time"] + model["time_constant"] * math.log((start_temp - ambient) / (temp - ambient))
+
+
+def pid_from_model(model):
+    """Calculates PI gains from a first order plus dead time model with the SIMC rule, using a closed loop time
+    constant equal to the dead time
+
+    Args:
+        model (dict): the reactor's first order plus dead time model
+
+    Returns:
+        tuple: the proportional (W/°C), integral (W/°C/s) and derivative (W.s/°C) gains
+    """
+    closed_loop = max(model["dead_time"], 1.0)
+    kp = model["time_constant"] / (model["gain"] * 2 * closed_loop)
+    ti = min(model["time_constant"], 8 * closed_loop)
+    return kp, kp / ti, 0.0
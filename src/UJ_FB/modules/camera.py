@@ -3,6 +3,14 @@ import logging
 import cv2 as cv
 from threading import Thread, Lock
 
+# file extension, OpenCV quality parameter, and MIME type of each image format the camera can encode
+ENCODERS = {"png": (".png", cv.IMWRITE_PNG_COMPRESSION, "image/png"),
+            "jpeg": (".jpg", cv.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+            "webp": (".webp", cv.IMWRITE_WEBP_QUALITY, "image/webp")}
+DEFAULT_IMAGE_FORMAT = "png"
+# PNG compression level (0-9), or JPEG and WebP quality (1-100)
+DEFAULT_IMAGE_QUALITY = {"png": 3, "jpeg": 95, "webp": 95}
+
 
 class Camera(modules.Module):
     """Class for managing the robot's camera
@@ -19,6 +27,12 @@ class Camera(modules.Module):
         super(Camera, self).__init__(name, module_info, None, manager)
         module_config = module_info["mod_config"]
         self.roi = module_config["ROI"]
+        self.image_format = module_config.get("image_format", DEFAULT_IMAGE_FORMAT)
+        if self.image_format not in ENCODERS:
+            self.write_log(f"{name} image format {self.image_format} is not one of {', '.join(ENCODERS)}, using "
+                           f"{DEFAULT_IMAGE_FORMAT}", level=logging.ERROR)
+            self.image_format = DEFAULT_IMAGE_FORMAT
+        self.image_quality = module_config.get("image_quality", DEFAULT_IMAGE_QUALITY[self.image_format])
         self.cap = cv.VideoCapture(0)
         self.last_frame = None
         self.frame_lock = Lock()
@@ -53,32 +67,40 @@ class Camera(modules.Module):
                 frame = self.last_frame
                 return frame
 
+    def encode_image(self, frame):
+        """Encodes a frame in the camera's image format
+
+        Args:
+            frame (np.array): the image in BGR
+
+        Returns:
+            tuple: the encoded image (np.array) and its MIME type, or None if encoding failed
+        """
+        extension, quality_param, content_type = ENCODERS[self.image_format]
+        ret, enc_image = cv.imencode(extension, frame, [quality_param, self.image_quality])
+        if not ret:
+            return None
+        return enc_image, content_type
+
     def send_image(self, listener, metadata, task):
-        """Sends an image to the server for storage and analysis
+        """Captures an image and queues it to be uploaded to the server for storage and analysis. The task completes
+        once the image is queued.
 
         Args:
             listener (UJ_FB.web_listener.WebListener): the WebListener for this robot
             metadata (dict): the image metadata, such as the filename.
             task (UJ_FB.fluidicbackbone.Task): the task object for this image send
         """
-        num_retries = 0
-        while num_retries < 5:
-            frame = self.capture_image(task)
-            if task.error:
-                return
-            ret, enc_image = cv.imencode(".png", frame)
-            response = listener.send_image(metadata, enc_image)
-            if response is not False:
-                if response.ok:
-                    break
-                else:
-                    num_retries += 1
-            else:
-                num_retries += 1
-            self.write_log(f"Received response: {response.json()}")
-        if num_retries > 4:
+        frame = self.capture_image(task)
+        if task.error:
+            return
+        encoded = self.encode_image(frame)
+        if encoded is None:
             task.error = True
-            self.write_log("Unable to send image", level=logging.WARNING)
+            self.write_log("Unable to encode image", level=logging.WARNING)
+            return
+        enc_image, content_type = encoded
+        listener.send_image({**metadata, "img_format": self.image_format}, enc_image, content_type)
 
     def resume(self, command_dicts):
         return True
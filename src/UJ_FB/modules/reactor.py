@@ -1,9 +1,29 @@
 from UJ_FB.modules import modules
-from threading import Thread, Lock
+from UJ_FB import heat_tuning, telemetry
+from threading import Lock
 from commanduino import exceptions
 import math
 import time
 import logging
+import numpy as np
+
+# [kd, ki, kp] used until the reactor is auto-tuned
+DEFAULT_PID_CONSTANTS = [10, 0.25, 5]
+HEATER_RESISTANCE = 1.15
+MAX_HEATER_VOLTAGE = 12
+# power of the heater when fully on, in W
+MAX_HEATER_POWER = MAX_HEATER_VOLTAGE ** 2 / HEATER_RESISTANCE
+# the PID integral only accumulates within this many °C of the target
+INTEGRAL_BAND = 5
+# preheating is complete within this many °C of the target
+PREHEAT_TOLERANCE = 0.5
+# maximum preheat time in seconds
+PREHEAT_TIMEOUT = 1200
+# weight of each new preheat fit in the reactor's thermal model
+MODEL_UPDATE_WEIGHT = 0.5
+HISTORY_DTYPE = [("time", "f8"), ("temp", "f4"), ("setpoint", "f4"), ("heater", "f4"), ("stir_speed", "f4")]
+# (interval in seconds, records) of each history tier: 1 s for an hour, 1 min for a day and 1 h for a month
+HISTORY_TIERS = ((1, 3600), (60, 1440), (3600, 720))
 
 
 class Reactor(modules.FBFlask):
@@ -30,7 +50,30 @@ class Reactor(modules.FBFlask):
             volume = float(split_num[0])
         # Joule/K
         self.heat_rate = 880 * volume * 2770
-        self.pid_constants = [10, 0.25, 5]
+        # {"gains": [{"temp": set point, "pid": [kd, ki, kp], "ku": ultimate gain, "tu": ultimate period,
+        #             "plant": thermal model}]}
+        self.tuning_record = self.manager.prev_run_config.setdefault("reactor_tuning", {}).setdefault(
+            self.name, {"gains": []})
+        self.pid_constants = list(DEFAULT_PID_CONSTANTS)
+        self.tuning = False
+        self.tuner = None
+        self.tune_temps = []
+        self.tune_index = 0
+        self.tune_results = []
+        self.tune_ambient = 0.0
+        self.tune_task = None
+        # [(time, temperature, heater power)] logged during the current preheat
+        self.preheat_log = []
+        # whether the preheat has stopped heating at full power
+        self.coasting = False
+        # predicted time that the reactor reaches its target, or None if unknown
+        self.ready_at = None
+        self.stir_speed = 0
+        # [(speed, seconds)] spin up steps still to run, and the time the current step ends
+        self.stir_ramp = []
+        self.ramp_step_end = None
+        # temperature, set point, heater output and stir speed over time
+        self.history = telemetry.TieredBuffer(HISTORY_DTYPE, HISTORY_TIERS)
         self.pid_range = 255
         self.last_voltage = 0
         self.cur_temp = 0.0
@@ -51,18 +94,23 @@ class Reactor(modules.FBFlask):
         self.prev_error = 0.0
         self.integral_error = 0.0
         self.prev_time = 0.0
-        self.polling_rate = 2
+        # control updates per second while heating or stirring
+        self.polling_rate = module_info["mod_config"].get("polling_rate", 2)
         self.heat_time = 0.0
         self.heat_start_time = 0.0
         self.heat_rem_time = 0.0
         self.stir_time = 0.0
         self.stir_start_time = 0.0
         self.stir_rem_time = 0.0
+        self.preheat_start = 0.0
+        self.cooling_start = 0.0
         self.exit = False
         self.stir_lock = Lock()
         self.heat_lock = Lock()
-        self.thread = Thread(target=self.run, name=self.name, daemon=True)
-        self.thread.start()
+        # the reactor's control loop is run by the scheduler shared by all reactors
+        self.scheduler = self.manager.reactor_scheduler
+        self.thread = self.scheduler
+        self.scheduler.add(self)
 
     def start_heat(self, temp, heat_secs, target, task):
         """Starts temperature regulation
@@ -74,12 +122,18 @@ class Reactor(modules.FBFlask):
             task (UJ_FB.fluidicbackbone.Task): the task for this heating operation
         """
         with self.heat_lock:
+            if self.tuning:
+                self.stop_autotune()
             self.target_temp = temp
+            self.ready_at = None
+            self.pid_constants = self.scheduled_gains(temp)
+            self.reset_integral()
             self.prev_time = time.time()
             cart_voltage = self.calc_voltage(temp)
             if cart_voltage == -273.15:
                 self.write_log("Temperature sensor is not connected", level=logging.ERROR)
-                task.error = True
+                if task is not None:
+                    task.error = True
             else:
                 self.last_voltage = cart_voltage
             self.heating = True
@@ -91,6 +145,30 @@ class Reactor(modules.FBFlask):
             for heater in self.heaters:
                 heater.start_heat(cart_voltage)
             self.heat_time = heat_secs
+        self.scheduler.wake(self)
+
+    def take_over_heat(self, temp, heat_secs, task):
+        """Hands a running preheat over to a heating task, so the preheat isn't restarted partway through its ramp
+
+        Args:
+            temp (float): the temperature the task heats to
+            heat_secs (int): seconds to heat for. Does not count preheating
+            task (UJ_FB.fluidicbackbone.Task): the task for this heating operation
+
+        Returns:
+            bool: True if the reactor was already heating to temp and the task has taken over, False otherwise
+        """
+        with self.heat_lock:
+            if not self.heating or self.tuning or self.target_temp != temp:
+                return False
+            self.heat_task = task
+            self.heat_time = heat_secs
+            # heat_secs counts from reaching the temperature, which has already happened if the preheat is complete
+            if not (self.target or self.preheating or self.cooling):
+                self.heat_start_time = time.time()
+        self.write_log(f"{self.name} continued heating to {temp}°C from its preheat", level=logging.INFO)
+        self.scheduler.wake(self)
+        return True
 
     def start_stir(self, speed, stir_secs):
         """Starts stirring using the magnetic stirrer bar
@@ -102,122 +180,226 @@ class Reactor(modules.FBFlask):
         with self.stir_lock:
             self.stirring = True
             self.ready = False
-            max_speed = self.mag_stirrers[0].max_speed
-            if speed < (0.5 * max_speed):
-                self.mag_stirrers[0].start_stir(max_speed)
-                time.sleep(1.5)
-                self.mag_stirrers[0].start_stir(0.5 * max_speed)
-                time.sleep(1.5)
-                if speed > (0.2 * max_speed):
-                    self.mag_stirrers[0].start_stir(speed)
-                else:
-                    self.mag_stirrers[0].start_stir(0.2 * max_speed)
-            else:
-                self.mag_stirrers[0].start_stir(speed)
-            self.stir_start_time = time.time()
+            # the spin up steps are run by the control loop, so this returns straight away
+            self.stir_ramp = self.mag_stirrers[0].ramp_profile(speed)
+            now = time.time()
+            self.next_ramp_step(now)
+            # the stir time starts once the stirrer reaches its speed
+            self.stir_start_time = now + sum(secs for _, secs in self.stir_ramp if secs is not None) \
+                + (self.ramp_step_end - now if self.ramp_step_end is not None else 0.0)
             self.stir_time = stir_secs
             self.write_log(f"{self.name} started stirring at {speed}", level=logging.INFO)
+        self.scheduler.wake(self)
 
-    def run(self):
-        """This method is run continuously to maintain heating, stirring, and updates to the sensor readings 
-        """
-        while not self.exit:
-            time.sleep(1/self.polling_rate)
-            with self.heat_lock:
-                if self.target:
-                    self.target = False
-                    self.cur_temp = self.read_temp()
-                    if self.cur_temp < self.target_temp:
-                        self.preheating = True
-                        preheat_start = time.time()
-                    else:
-                        self.cooling = True
-                        cooling_start = time.time()
-            with self.heat_lock:
-                if self.preheating:
-                    self.preheat(preheat_start)
-                elif self.cooling:
-                    self.cur_temp = self.read_temp()
-                    if self.cur_temp <= self.target_temp:
-                        self.cooling = False
-                        self.integral_error = 0
-                        self.heat_time = time.time() - cooling_start
-                        self.heat_start_time = time.time()
-                elif self.heating:
-                    if self.heat_time > 0:
-                        if time.time() - self.heat_start_time > self.heat_time:
-                            self.stop_heat()
-                    else:
-                        if self.heat_task:
-                            self.heat_task.complete = True
-                    new_voltage = self.calc_voltage(self.target_temp)
+    def tick(self, now, reading=None):
+        """Runs one update of heating, stirring, idle temperature updates and stop requests. Called by the
+        ReactorScheduler.
+
+        Args:
+            now (float): the time of the update
+            reading (float, optional): the temperature read for this update. None if the sensor wasn't read.
+        """
+        with self.heat_lock:
+            if self.tuning:
+                if reading is not None:
+                    self.autotune_step(now, reading)
+            if self.target:
+                self.target = False
+                if reading is not None:
+                    self.cur_temp = reading
+                if self.cur_temp < self.target_temp:
+                    self.preheating = True
+                    self.preheat_start = now
+                    self.preheat_log = []
+                    self.coasting = False
+                    self.ready_at = self.predict_ready(now, self.cur_temp)
+                else:
+                    self.cooling = True
+                    self.cooling_start = now
+                    self.ready_at = self.predict_ready(now, self.cur_temp)
+            if self.preheating:
+                self.preheat(self.preheat_start, reading)
+            elif self.cooling:
+                if reading is not None:
+                    self.cur_temp = reading
+                if self.cur_temp <= self.target_temp:
+                    self.cooling = False
+                    self.ready_at = now
+                    self.reset_integral()
+                    self.heat_time = now - self.cooling_start
+                    self.heat_start_time = now
+            elif self.heating:
+                if self.heat_time > 0:
+                    if now - self.heat_start_time > self.heat_time:
+                        self.stop_heat()
+                else:
+                    if self.heat_task:
+                        self.heat_task.complete = True
+                # the heater stays off once heating has stopped
+                if self.heating and reading is not None:
+                    new_voltage = self.calc_voltage(self.target_temp, reading)
                     if new_voltage != self.last_voltage:
                         for heater in self.heaters:
                             heater.start_heat(new_voltage)
                         self.last_voltage = new_voltage
-            with self.stir_lock:
-                if self.stirring:
-                    if self.stir_time > 0:
-                        if time.time() - self.stir_start_time > self.stir_time:
-                            self.stirring = False
-                    else:
-                        if self.stir_task:
-                            self.stir_task.complete = True
-            with self.heat_lock:
-                if not self.heating and time.time() - self.heat_last_update_time > self.heat_update_delay:
-                    self.cur_temp = self.read_temp()
-                    self.heat_last_update_time = time.time()
-            with self.stop_lock:
-                if self.stop_cmd:
-                    self.stop_cmd = False
-                    if self.heating:
-                        self.stop_heat()
-                        elapsed_time = time.time() - self.heat_start_time
-                        if self.heat_time > elapsed_time:
-                            self.heat_rem_time = self.heat_time - elapsed_time
-                        self.resume_heating = True
-                    if self.stirring:
+            if not self.heating and now - self.heat_last_update_time > self.heat_update_delay:
+                if reading is not None:
+                    self.cur_temp = reading
+                self.heat_last_update_time = now
+        with self.stir_lock:
+            if self.stirring:
+                if self.ramp_step_end is not None and now >= self.ramp_step_end:
+                    self.next_ramp_step(now)
+                if self.stir_time > 0:
+                    if now - self.stir_start_time > self.stir_time:
                         self.stop_stir()
-                        elapsed_time = time.time() - self.stir_start_time
-                        if self.stir_time > elapsed_time:
-                            self.stir_rem_time = self.stir_time - elapsed_time
-                        self.resume_stirring = True
-                    self.ready = True                 
+                else:
+                    if self.stir_task:
+                        self.stir_task.complete = True
+        with self.stop_lock:
+            if self.stop_cmd:
+                self.stop_cmd = False
+                if self.tuning:
+                    with self.heat_lock:
+                        self.stop_autotune()
+                    self.write_log(f"{self.name} auto-tuning stopped", level=logging.WARNING)
+                if self.heating:
+                    self.stop_heat()
+                    elapsed_time = now - self.heat_start_time
+                    if self.heat_time > elapsed_time:
+                        self.heat_rem_time = self.heat_time - elapsed_time
+                    self.resume_heating = True
+                if self.stirring:
+                    self.stop_stir()
+                    elapsed_time = max(now - self.stir_start_time, 0.0)
+                    if self.stir_time > elapsed_time:
+                        self.stir_rem_time = self.stir_time - elapsed_time
+                    self.resume_stirring = True
+                self.ready = True
+        if reading is not None:
+            self.record_history(now, reading)
+
+    def record_history(self, now, reading):
+        """Adds the reactor's state to its history
+
+        Args:
+            now (float): the time of the reading
+            reading (float): the temperature in °C
+        """
+        heating = self.heating or self.tuning
+        setpoint = self.target_temp if self.heating else np.nan
+        heater = self.last_voltage if heating else 0.0
+        stir_speed = self.stir_speed if self.stirring else 0.0
+        self.history.append((now, reading, setpoint, heater, stir_speed))
+
+    def save_history(self, fp, start=0.0):
+        """Saves the reactor's history since a time
 
-    def preheat(self, preheat_start):
+        Args:
+            fp (str): the file path. Saved as CSV if the extension is .csv, otherwise as a .npy file.
+            start (float, optional): the earliest time to include. Defaults to 0.0.
+        """
+        self.history.save(fp, start)
+
+    def needs_reading(self, now):
+        """
+        Args:
+            now (float): the time of the update
+
+        Returns:
+            bool: True if the next update needs a temperature reading
+        """
+        return self.heating or self.target or self.tuning or \
+            now - self.heat_last_update_time > self.heat_update_delay
+
+    def next_update(self, now):
+        """
+        Args:
+            now (float): the current time
+
+        Returns:
+            float: seconds until the next update. Idle reactors are only updated to refresh the temperature.
+        """
+        if self.ramp_step_end is not None:
+            return min(1 / self.polling_rate, max(self.ramp_step_end - now, 0.0))
+        if self.heating or self.stirring or self.target or self.tuning or self.stop_cmd:
+            return 1 / self.polling_rate
+        return max(1 / self.polling_rate, self.heat_last_update_time + self.heat_update_delay - now)
+
+    def read_sensor(self):
+        """Reads the temperature for the next update. Idle readings use read_temp, so they are skipped in simulation.
+
+        Returns:
+            float: the temperature, or None if the sensor didn't reply
+        """
+        try:
+            if self.heating or self.target or self.tuning:
+                return self.temp_sensors[0].read_temp()
+            return self.read_temp()
+        except exceptions.CMDeviceReplyTimeout:
+            return None
+
+    def preheat(self, preheat_start, reading=None):
         """Preheats the reactor to the desired temperature
 
         Args:
             preheat_start (float): the time that the preheat was started.
+            reading (float, optional): the current temperature. Read from the sensor if not given.
         """
-        self.cur_temp = self.temp_sensors[0].read_temp()
-        if self.cur_temp < self.target_temp:
-            cart_voltage = self.calc_voltage(self.target_temp)
+        if reading is None:
+            reading = self.temp_sensors[0].read_temp()
+        now = time.time()
+        self.cur_temp = reading
+        self.preheat_log.append((now, reading, self.heater_power(self.last_voltage)))
+        model = self.thermal_model
+        if self.cur_temp < self.target_temp - PREHEAT_TOLERANCE:
+            if model is None:
+                cart_voltage = self.calc_voltage(self.target_temp, reading)
+            else:
+                # heat at full power until the heat already applied will carry the reactor to the target, then let
+                # the PID controller take over from the power that the model predicts will maintain the target
+                if not self.coasting and self.predict_peak(model, reading) >= self.target_temp:
+                    self.coasting = True
+                    self.reset_integral()
+                    self.prev_error = self.target_temp - reading
+                    self.prev_time = now
+                if self.coasting:
+                    cart_voltage = self.calc_voltage(self.target_temp, reading)
+                else:
+                    cart_voltage = 255
             for heater in self.heaters:
                 heater.start_heat(cart_voltage)
+            self.last_voltage = cart_voltage
+            self.ready_at = self.predict_ready(now, reading)
         else:
             self.preheating = False
-            self.heat_start_time = time.time()
-            self.integral_error = 0 
-            self.write_log(f"Reactor reached {self.target_temp}°C", level=logging.INFO)
-        if time.time() - preheat_start > 1200:
+            self.heat_start_time = now
+            self.ready_at = now
+            self.reset_integral()
+            self.write_log(f"Reactor reached {self.target_temp}°C in {round(now - preheat_start)} s",
+                           level=logging.INFO)
+            self.update_model()
+        if now - preheat_start > PREHEAT_TIMEOUT:
             self.preheating = False
-            self.heat_start_time = time.time()
+            self.heat_start_time = now
 
-    def calc_voltage(self, temp):
+    def calc_voltage(self, temp, reading=None):
         """Calculates the voltage for the heating element to maintain a desired temperature using a PID controller
 
         Args:
             temp (float): the target temperature
+            reading (float, optional): the current temperature. Read from the sensor if not given.
 
         Returns:
             float: voltage for the heating element
         """
         kd, ki, kp,  = self.pid_constants
-        try:
-            self.cur_temp = self.temp_sensors[0].read_temp()
-        except exceptions.CMDeviceReplyTimeout:
-            return self.last_voltage
+        if reading is None:
+            try:
+                reading = self.temp_sensors[0].read_temp()
+            except exceptions.CMDeviceReplyTimeout:
+                return self.last_voltage
+        self.cur_temp = reading
         if self.cur_temp == -273.15:
             return self.cur_temp
         cur_time = time.time()
@@ -225,7 +407,8 @@ class Reactor(modules.FBFlask):
         dt = cur_time - self.prev_time
         self.prev_time = cur_time
         d = (error - self.prev_error)/dt
-        i = error * dt
+        # only integrate close to the target, so the integral doesn't wind up while heating towards it
+        i = error * dt if abs(error) < INTEGRAL_BAND else 0.0
         self.integral_error += i
         raw_signal = kp*error + ki*self.integral_error + kd*d
         control_signal = max(0, raw_signal)
@@ -233,12 +416,236 @@ class Reactor(modules.FBFlask):
         # DT/dt = V^2/(R*Cp*Vol*rho)
         # DT = V^2/(R*Cp*Vol*rho) * dt
         # R = ~1.16ohm
-        voltage = math.sqrt(((control_signal/dt)*1.15*self.heat_rate))
-        voltage = max(0.0, min(voltage, 12))
-        voltage = voltage/12 * 255
+        voltage = math.sqrt(((control_signal/dt)*HEATER_RESISTANCE*self.heat_rate))
+        if voltage > MAX_HEATER_VOLTAGE and error > 0:
+            # the heater is saturated, so stop the integral winding up and overshooting the target
+            self.integral_error -= i
+        voltage = max(0.0, min(voltage, MAX_HEATER_VOLTAGE))
+        voltage = voltage/MAX_HEATER_VOLTAGE * 255
         self.prev_error = error
         return voltage
 
+    def start_autotune(self, temps, task):
+        """Starts relay auto-tuning of the heating PID controller at each set point in turn
+
+        Args:
+            temps (list): the set points to tune at in °C. Gains are scheduled between them.
+            task (UJ_FB.fluidicbackbone.Task): the task for this tuning operation
+        """
+        with self.heat_lock:
+            if self.heating:
+                self.write_log(f"{self.name} can't be auto-tuned while heating", level=logging.WARNING)
+                task.error = True
+                task.complete = True
+                return
+            self.tune_temps = sorted(temps)
+            self.tune_index = 0
+            self.tune_results = []
+            self.tune_task = task
+            self.tuner = None
+            self.tuning = True
+            self.ready = False
+        self.write_log(f"{self.name} started auto-tuning at {self.tune_temps} °C", level=logging.INFO)
+        self.scheduler.wake(self)
+
+    def autotune_step(self, now, reading):
+        """Switches the heater for the relay experiment, and moves to the next set point once the current one is
+        measured
+
+        Args:
+            now (float): the time of the reading
+            reading (float): the temperature in °C
+        """
+        if self.tuner is None:
+            if self.tune_index == 0:
+                # tuning starts from an idle reactor, so the first reading is taken as the ambient temperature
+                self.tune_ambient = reading
+            self.tuner = heat_tuning.RelayTuner(self.tune_temps[self.tune_index], now, self.tune_ambient,
+                                                MAX_HEATER_POWER)
+        voltage = 255 if self.tuner.update(now, reading) else 0
+        if voltage != self.last_voltage:
+            for heater in self.heaters:
+                heater.start_heat(voltage)
+            self.last_voltage = voltage
+        if not self.tuner.complete and not self.tuner.timed_out(now):
+            return
+        result = self.tuner.result()
+        if result is None:
+            self.write_log(f"{self.name} did not oscillate about {self.tuner.setpoint} °C, skipping",
+                           level=logging.WARNING)
+        else:
+            result["pid"] = self.controller_gains(*heat_tuning.pid_from_relay(result["ku"], result["tu"]))
+            self.tune_results.append(result)
+            plant = result["plant"]
+            self.write_log(f"{self.name} at {result['temp']} °C: time constant {round(plant['time_constant'])} s, "
+                           f"dead time {round(plant['dead_time'])} s, gain {round(plant['gain'], 3)} °C/W",
+                           level=logging.INFO)
+        self.tuner = None
+        self.tune_index += 1
+        if self.tune_index >= len(self.tune_temps):
+            self.finish_autotune()
+
+    def finish_autotune(self):
+        """Stores the tuned gains in the running configuration and turns the heater off"""
+        if self.tune_results:
+            tuned = {entry["temp"]: entry for entry in self.tuning_record["gains"]}
+            tuned.update({entry["temp"]: entry for entry in self.tune_results})
+            self.tuning_record["gains"] = [tuned[temp] for temp in sorted(tuned)]
+            self.manager.rc_changes = True
+            self.write_log(f"{self.name} finished auto-tuning", level=logging.INFO)
+        else:
+            self.write_log(f"{self.name} auto-tuning failed", level=logging.ERROR)
+            self.tune_task.error = True
+        self.stop_autotune()
+
+    def stop_autotune(self):
+        self.tuning = False
+        self.tuner = None
+        for heater in self.heaters:
+            heater.stop_heat()
+        self.last_voltage = 0
+        self.ready = True
+        if self.tune_task is not None:
+            self.tune_task.complete = True
+
+    def controller_gains(self, kp, ki, kd):
+        """Converts PID gains in W to the controller's temperature change per update
+
+        Returns:
+            list: [kd, ki, kp]
+        """
+        scale = 1 / (self.polling_rate * self.heat_rate)
+        return [kd * scale, ki * scale, kp * scale]
+
+    def scheduled_gains(self, temp):
+        """Interpolates the tuned gains to a set point. Set points outside the tuned range use the nearest gains.
+        Without tuned gains, gains are calculated from the thermal model fitted to previous preheats if there is one.
+
+        Args:
+            temp (float): the set point in °C
+
+        Returns:
+            list: [kd, ki, kp]
+        """
+        gains = self.tuning_record["gains"]
+        if not gains:
+            model = self.tuning_record.get("model")
+            if model is not None:
+                return self.controller_gains(*heat_tuning.pid_from_model(model))
+            return list(DEFAULT_PID_CONSTANTS)
+        if temp <= gains[0]["temp"]:
+            return list(gains[0]["pid"])
+        for lower, upper in zip(gains, gains[1:]):
+            if temp <= upper["temp"]:
+                frac = (temp - lower["temp"]) / (upper["temp"] - lower["temp"])
+                return [low + frac * (high - low) for low, high in zip(lower["pid"], upper["pid"])]
+        return list(gains[-1]["pid"])
+
+    def scheduled_plant(self, temp):
+        """
+        Args:
+            temp (float): the set point in °C
+
+        Returns:
+            dict: the thermal model identified closest to the set point, or None if the reactor isn't tuned
+        """
+        gains = self.tuning_record["gains"]
+        if not gains:
+            return None
+        return min(gains, key=lambda entry: abs(entry["temp"] - temp))["plant"]
+
+    def reset_integral(self):
+        """Resets the PID integral to hold the power that the thermal model predicts will maintain the target, so the
+        integral only has to correct the model's error
+        """
+        self.integral_error = 0.0
+        plant = self.thermal_model
+        ki = self.pid_constants[1]
+        if plant is None or plant["gain"] <= 0 or ki <= 0:
+            return
+        power = max(self.target_temp - plant["ambient"], 0.0) / plant["gain"]
+        # convert from W to the controller's temperature change per update
+        self.integral_error = power / (self.polling_rate * self.heat_rate) / ki
+
+    @property
+    def thermal_model(self):
+        """
+        Returns:
+            dict: the model fitted to previous preheats, or the model identified by auto-tuning, or None if neither
+        """
+        model = self.tuning_record.get("model")
+        if model is None:
+            model = self.scheduled_plant(self.target_temp)
+        return model
+
+    @staticmethod
+    def heater_power(voltage):
+        """
+        Args:
+            voltage (float): the heater output, 0-255
+
+        Returns:
+            float: the heater power in W
+        """
+        return (voltage / 255 * MAX_HEATER_VOLTAGE) ** 2 / HEATER_RESISTANCE
+
+    def predict_peak(self, model, temp):
+        """Predicts the temperature the reactor will coast to if the heater is turned down now, from the heat applied
+        over the last dead time
+
+        Args:
+            model (dict): the reactor's thermal model
+            temp (float): the current temperature in °C
+
+        Returns:
+            float: the predicted temperature in °C
+        """
+        power = self.heater_power(self.last_voltage)
+        slope = (model["gain"] * power - (temp - model["ambient"])) / model["time_constant"]
+        return temp + max(slope, 0.0) * model["dead_time"]
+
+    def time_to_target(self, temp, start_temp=None):
+        """Predicts how long the reactor takes to reach a temperature, preheating at full power
+
+        Args:
+            temp (float): the target temperature in °C
+            start_temp (float, optional): the starting temperature. Defaults to the current temperature.
+
+        Returns:
+            float: the time in seconds, or None if there is no thermal model or the target can't be reached
+        """
+        model = self.thermal_model
+        if model is None or model["time_constant"] <= 0:
+            return None
+        if start_temp is None:
+            start_temp = self.cur_temp
+        return heat_tuning.time_to_temp(model, start_temp, temp, MAX_HEATER_POWER)
+
+    def predict_ready(self, now, temp):
+        remaining = self.time_to_target(self.target_temp, temp)
+        if remaining is None:
+            return None
+        return now + remaining
+
+    def update_model(self):
+        """Fits the thermal model to the heating curve logged during the last preheat, and blends it into the stored
+        model
+        """
+        if not self.preheat_log:
+            return
+        times, temps, powers = (np.array(values, dtype=float) for values in zip(*self.preheat_log))
+        self.preheat_log = []
+        model = self.thermal_model
+        ambient = temps[0] if model is None else min(temps[0], model["ambient"])
+        fit = heat_tuning.fit_first_order(times, temps, powers, ambient)
+        if fit is None:
+            return
+        stored = self.tuning_record.get("model")
+        if stored is not None:
+            fit = {key: (1 - MODEL_UPDATE_WEIGHT) * stored[key] + MODEL_UPDATE_WEIGHT * fit[key] for key in fit}
+        self.tuning_record["model"] = fit
+        self.manager.rc_changes = True
+
     def read_temp(self):
         if not self.manager.simulation:
             temp = self.temp_sensors[0].read_temp()
@@ -256,19 +663,37 @@ class Reactor(modules.FBFlask):
         """
         with self.stop_lock:
             self.stop_cmd = True
-    
+        self.scheduler.wake(self)
+
+    def next_ramp_step(self, now):
+        """Sets the stirrer to the next step of its spin up ramp
+
+        Args:
+            now (float): the current time
+        """
+        speed, secs = self.stir_ramp.pop(0)
+        self.mag_stirrers[0].start_stir(speed)
+        self.stir_speed = speed
+        self.ramp_step_end = now + secs if secs is not None else None
+
     def stop_stir(self):
         self.stirring = False
+        self.stir_speed = 0
+        self.stir_ramp = []
+        self.ramp_step_end = None
         self.mag_stirrers[0].stop_stir()
-        self.stir_task.complete = True
+        if self.stir_task is not None:
+            self.stir_task.complete = True
 
     def stop_heat(self):
         self.heating = False
         for heater in self.heaters:
             heater.stop_heat()
         self.preheating = False
+        self.ready_at = None
         self.integral_error = 0
-        self.heat_task.complete = True
+        if self.heat_task is not None:
+            self.heat_task.complete = True
 
     def resume(self, command_dicts):
         """
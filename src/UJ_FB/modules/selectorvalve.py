@@ -1,14 +1,65 @@
 from UJ_FB.modules import modules
+from UJ_FB import telemetry
+import os
 import time
 import logging
+import datetime
+import numpy as np
 
 MAX_DIFF_THRESHOLD = 50
 MIN_DIFF_THRESHOLD = 10
 ERROR_THRESHOLD = 20
 POS_THRESHOLD = 600
 NEG_THRESHOLD = 490
+# number of ports when the valve configuration doesn't specify one
+DEFAULT_PORTS = 10
 HOMING_SPEED = 2000
 OPT_SPEED = 1000
+SWEEP_SPEED = 1000
+# readings taken across each window when searching for a magnet optimum
+OPT_SAMPLES = 5
+# maximum number of windows searched for a magnet optimum
+OPT_WINDOWS = 3
+# readings that curve by less than this across their positions are treated as flat when fitting a peak
+MIN_CURVATURE = 1
+# position confidence below which the valve is homed between reactions
+CONFIDENCE_THRESHOLD = 0.8
+# confidence lost per revolution of travel
+MOVE_CONFIDENCE_LOSS = 0.02
+# confidence gained when a magnet check confirms the position
+CHECK_CONFIDENCE_GAIN = 0.1
+# confidence lost when a magnet check needs the position corrected
+CORRECTION_CONFIDENCE_LOSS = 0.2
+# confidence lost when the robot is restarted, as the valve may have been moved while powered off
+STARTUP_CONFIDENCE_LOSS = 0.3
+# number of hall-effect sensor records kept for each valve
+TELEMETRY_SIZE = 20000
+TELEMETRY_DTYPE = [("time", "f8"), ("port", "i1"), ("position", "i4"), ("reading", "f4"), ("event", "i1")]
+# telemetry events
+EVENT_CHECK = 0
+EVENT_CORRECTION = 1
+EVENT_LOST = 2
+EVENT_HOMED = 3
+
+
+def fit_peak(positions, readings, maximum=True):
+    """Fits a parabola to readings to locate a peak between the positions they were taken at
+
+    Args:
+        positions (numpy.ndarray): the positions of the readings
+        readings (numpy.ndarray): the readings
+        maximum (bool, optional): True to locate a maximum, False to locate a minimum. Defaults to True.
+
+    Returns:
+        float: the position of the peak, or None if the readings do not curve towards a peak
+    """
+    a, b, _ = np.polyfit(positions, readings, 2)
+    # a straight line fits with a tiny, arbitrarily signed curvature, which would place the peak far away
+    if abs(a) * (np.ptp(positions) / 2) ** 2 < MIN_CURVATURE:
+        return None
+    if (maximum and a >= 0) or (not maximum and a <= 0):
+        return None
+    return float(-b / (2 * a))
 
 
 class SelectorValve(modules.Module):
@@ -30,26 +81,32 @@ class SelectorValve(modules.Module):
         self.mod_type = "selector_valve"
         self.syringe = None
         module_config = module_info["mod_config"]
-        self.num_ports = module_config["ports"]
-        # todo add ability to accommodate variable number of ports
-        # {port: position in steps}
-        self.pos_dict = {1: 0, 2: 320, 3: 640, 4: 960, 5: 1280, 6: 1600, 7: 1920, 8: 2240, 9: 2560, 10: 2880}
+        # "ports" is either the number of ports, or {"count": ports, "magnets": [ports], "gear": gear}
+        geometry = module_config["ports"]
+        if not isinstance(geometry, dict):
+            geometry = {"count": geometry}
+        self.num_ports = int(geometry.get("count", DEFAULT_PORTS))
+        # ports with a magnet beneath them. Port 1 holds the positive (home) magnet. Defaults to every other port.
+        self.magnet_ports = sorted(set(geometry.get("magnets", range(1, self.num_ports + 1, 2))) | {1})
         # Dictionary keeps track of names of modules attached to each port and their associated object.
-        self.ports = {-1: None, 1: None, 2: None, 3: None, 4: None, 5: None, 6: None, 7: None, 8: None,
-                      9: None, 10: None}
-        self.magnet_readings = self.manager.prev_run_config['magnet_readings'][self.name]
-        if self.magnet_readings[1] == 0:
-            self.magnet_readings = {1: POS_THRESHOLD, 3: NEG_THRESHOLD, 5: NEG_THRESHOLD,
-                                    7: NEG_THRESHOLD, 9: NEG_THRESHOLD}
+        self.ports = {port: None for port in range(-1, self.num_ports + 1) if port != 0}
+        # {module name: port}
+        self.port_index = {}
+        self.open_ports = list(range(1, self.num_ports + 1))
+        self.magnet_readings = self.manager.prev_run_config['magnet_readings'].setdefault(self.name, {1: 0})
+        if self.magnet_readings.get(1, 0) == 0 or sorted(self.magnet_readings) != self.magnet_ports:
+            self.magnet_readings = {port: NEG_THRESHOLD for port in self.magnet_ports}
+            self.magnet_readings[1] = POS_THRESHOLD
         self.times_checked = 0
-        self.readings_history = []
+        # timestamped hall-effect readings, step positions and correction events
+        self.telemetry = telemetry.RingBuffer(TELEMETRY_DTYPE, TELEMETRY_SIZE)
+        self.telemetry_path = os.path.join(self.manager.script_dir, "configs", "telemetry", f"{self.name}.npy")
+        self.telemetry.load(self.telemetry_path)
         self.adj_valves = []
         self.current_port = self.manager.prev_run_config["valve_pos"][self.name]
-        # kd, kp
-        self.pd_constants = [1.5, 0.5]
         self.check_spd = 3000
         self.pos_he = []
-        geared = module_config['gear']
+        geared = geometry.get("gear", module_config.get("gear", "Direct drive"))
         self.stepper = self.steppers[0]
         self.he_sensor = self.he_sensors[0]
         self.reading = self.he_sensor.analog_read()
@@ -65,14 +122,66 @@ class SelectorValve(modules.Module):
             self.backlash = self.manager.prev_run_config['valve_backlash'][self.name]['backlash_steps']
         else:
             self.geared = False
-        if self.spr != 3200:
-            for position in range(1, 11):
-                self.pos_dict[position] = int((self.spr / 10) * (position-1))
+            self.backlash = 0
+        self.build_tables()
+        # {"confidence": 0-1, "last_homed": date, "homes": count, "moves_since_home": count}
+        self.homing_record = self.manager.prev_run_config.setdefault('valve_confidence', {}).setdefault(
+            self.name, {"confidence": 0.0, "last_homed": "", "homes": 0, "moves_since_home": 0})
+        self.confidence = self.homing_record["confidence"]
+
+    def build_tables(self):
+        """Precomputes the step position of each port, the steps between neighbouring magnets and the number of
+        magnets passed when moving between each pair of ports, so that moves don't need to search the valve geometry.
+        """
+        spr = int(self.spr)
+        # {port: position in steps}
+        self.pos_dict = {port: int((self.spr / self.num_ports) * (port - 1)) for port in range(1, self.num_ports + 1)}
+        # {magnet port: steps forward to the next magnet}
+        self.magnet_steps = {}
+        for i, port in enumerate(self.magnet_ports):
+            next_port = self.magnet_ports[(i + 1) % len(self.magnet_ports)]
+            self.magnet_steps[port] = (self.pos_dict[next_port] - self.pos_dict[port]) % spr or spr
+        # mean distance between magnets, used when searching for a magnet from an unknown position
+        self.magnet_spacing = self.spr / len(self.magnet_ports)
+        # {(start port, end port, forward): magnets passed}
+        self.magnet_counts = {}
+        for start in self.pos_dict:
+            for end in self.pos_dict:
+                for fwd in (True, False):
+                    magnets = 0
+                    port = start
+                    while port != end:
+                        if fwd:
+                            port = port % self.num_ports + 1
+                        else:
+                            port = (port - 2) % self.num_ports + 1
+                        if port in self.magnet_ports:
+                            magnets += 1
+                    self.magnet_counts[(start, end, fwd)] = magnets
+
+    def attach(self, port, module):
+        """Attaches a module to a port, indexing it by name
+
+        Args:
+            port (int): the port number, or -1 for the syringe pump
+            module (UJ_FB.modules.Module): the module attached to the port
+        """
+        if port not in self.ports:
+            self.write_log(f"{module.name} is attached to port {port}, but {self.name} only has {self.num_ports} "
+                           f"ports", level=logging.ERROR)
+            return
+        self.ports[port] = module
+        self.port_index[module.name] = port
+        if port in self.open_ports:
+            self.open_ports.remove(port)
 
     def init_valve(self):
         """
         Homes the valve before use
         """
+        # a valve that was confidently positioned before shutdown only needs to be near the home reading
+        home_tolerance = MIN_DIFF_THRESHOLD if self.confidence >= CONFIDENCE_THRESHOLD else 0
+        self.set_confidence(self.confidence - STARTUP_CONFIDENCE_LOSS)
         if self.current_port is not None:
             self.stepper.set_current_position(self.pos_dict[self.current_port])
             self.move_to_pos(1, check=False)
@@ -86,9 +195,11 @@ class SelectorValve(modules.Module):
             self.find_zero()
         # ended up between magnets
         self.reading = self.he_sensor.analog_read()
-        if self.reading < POS_THRESHOLD or self.reading < self.magnet_readings[1]:
+        if self.reading < POS_THRESHOLD or self.reading < self.magnet_readings[1] - home_tolerance:
             self.current_port = None
             self.home_valve()
+        else:
+            self.set_confidence(self.confidence + CHECK_CONFIDENCE_GAIN)
         # check magnet positions against config
         if self.geared:
             if self.manager.prev_run_config['valve_backlash'][self.name]['check_backlash'] % 10 == 0\
@@ -109,22 +220,16 @@ class SelectorValve(modules.Module):
         """
         if self.current_port != position:
             self.write_log(f"{self.name} is moving to position {position} ({target})")
-            backlash = 0
-            # we need to move backwards
-            if self.current_port > position:
-                self.last_direction = self.current_direction
-                self.current_direction = 'R'
-            elif self.current_port < position:
-                self.last_direction = self.current_direction
-                self.current_direction = 'F'
-            if self.last_direction != self.current_direction:
-                backlash = self.backlash
-                if self.current_direction == 'R':
-                    backlash = -backlash
+            steps, fwd = self.plan_rotation(position)
+            self.last_direction = self.current_direction
+            self.current_direction = 'F' if fwd else 'R'
             self.ready = False
-            self.stepper.move_to(self.pos_dict[position] + backlash)
+            self.stepper.move_steps(self.reverse_steps(steps, fwd))
+            self.homing_record["moves_since_home"] += 1
+            self.set_confidence(self.confidence - MOVE_CONFIDENCE_LOSS * steps / self.spr)
             if check:
-                self.check_pos(position)
+                self.check_pos(position, fwd)
+            # position is kept within one revolution, so moves that wrap past port 1 are re-referenced
             cur_stepper_pos = int(self.stepper.get_current_position())
             if cur_stepper_pos != self.pos_dict[position]:
                 self.stepper.set_current_position(self.pos_dict[position])
@@ -132,6 +237,40 @@ class SelectorValve(modules.Module):
             self.current_port = position
             self.ready = True
 
+    def plan_rotation(self, position):
+        """Plans the shortest rotation to a port, treating the valve as circular. Reversing the direction of travel
+        costs an additional self.backlash steps, which are added to the move.
+
+        Args:
+            position (int): The number of the destination port
+
+        Returns:
+            tuple: the number of steps to move, and True if moving forward (False if moving in reverse)
+        """
+        spr = int(self.spr)
+        fwd_steps = (self.pos_dict[position] - self.pos_dict[self.current_port]) % spr
+        rev_steps = (spr - fwd_steps) % spr
+        if self.current_direction != 'F':
+            fwd_steps += self.backlash
+        if self.current_direction != 'R':
+            rev_steps += self.backlash
+        if fwd_steps <= rev_steps:
+            return fwd_steps, True
+        return rev_steps, False
+
+    def count_magnets(self, start, end, fwd):
+        """Counts the magnets passed when moving between two ports. Magnets on the starting port aren't counted.
+
+        Args:
+            start (int): The starting port
+            end (int): The destination port
+            fwd (bool): True if moving forward, False otherwise
+
+        Returns:
+            int: the number of magnets passed, including a magnet on the destination port
+        """
+        return self.magnet_counts[(start, end, fwd)]
+
     def move_to_target(self, target, task):
         """ 
         Gets the required port for movement and moves to that port using move_to_pos
@@ -140,32 +279,42 @@ class SelectorValve(modules.Module):
             target (string): name of the target module
             task (Task): the Task object for this operation
         """
-        for i, port in enumerate(self.ports.items()):
-            if port[1] is None:
-                if target == 'empty':
-                    self.move_to_pos(i)
-                    return
-                continue
-            elif target in port[1].name:
-                self.move_to_pos(port[0], target)
-                return
+        port = self.find_port(target)
+        if port is not None:
+            self.move_to_pos(port, target)
+            return
         self.write_log(f"{target} not found on valve {self.name}", level=logging.WARNING)
         if task is not None:
             task.error = True
 
+    def find_port(self, target):
+        """Finds the port that a target is attached to
+
+        Args:
+            target (str): name of the target module, or "empty" for an unused port
+
+        Returns:
+            int: the port number, or None if the target is not attached to this valve
+        """
+        port = self.port_index.get(target)
+        if port is not None:
+            return port
+        if target == 'empty':
+            return self.find_open_port()
+        # fall back to partial names
+        for port, module in self.ports.items():
+            if module is not None and target in module.name:
+                return port
+        return None
+
     def find_target(self, target):
-        target_found = False
-        for port in self.ports.items():
-            if port[1] is None:
-                continue
-            elif target in port[1].name:
-                target_found = True
-        return target_found
+        if target in self.port_index:
+            return True
+        return any(module is not None and target in module.name for module in self.ports.values())
 
     def find_open_port(self):
-        for i in range(1, 11):
-            if self.ports[i] is None:
-                return i
+        if self.open_ports:
+            return self.open_ports[0]
         return None
 
     def jog(self, steps, invert_direction):
@@ -181,9 +330,12 @@ class SelectorValve(modules.Module):
         self.stepper.move_steps(steps)
         self.ready = True
 
-    def home_valve(self):
+    def home_valve(self, sweep=True):
         """
         Homes the valve using the hall-effect sensor
+
+        Args:
+            sweep (bool, optional): whether to try homing with a single sweep first. Defaults to True.
         """
         self.ready = False
         self.write_log(f"{self.name} is homing")
@@ -192,6 +344,11 @@ class SelectorValve(modules.Module):
         self.manager.rc_changes = True
         with self.stop_lock:
             self.stop_cmd = False
+        if sweep and self.sweep_home():
+            self.record_homing()
+            self.write_log(f"{self.name} finished homing")
+            self.ready = True
+            return
         prev_speed = self.stepper.running_speed
         self.stepper.set_running_speed(HOMING_SPEED)
         if self.current_port is not None:
@@ -222,6 +379,7 @@ class SelectorValve(modules.Module):
             self.stepper.set_current_position(0)
             self.current_port = 1
             self.reading = self.he_sensor.analog_read()
+            self.record_homing()
         # had to stop unexpectedly
         else:
             self.current_port = None
@@ -236,67 +394,240 @@ class SelectorValve(modules.Module):
         self.write_log(f"{self.name} finished homing")
         self.ready = True
 
+    def set_confidence(self, confidence):
+        """Sets the confidence in the valve's position, which is stored in the running configuration
+
+        Args:
+            confidence (float): the confidence, limited to between 0 and 1
+        """
+        self.confidence = min(max(confidence, 0.0), 1.0)
+        self.homing_record["confidence"] = round(self.confidence, 3)
+        self.manager.rc_changes = True
+
+    def record_homing(self):
+        """
+        Records that the valve has been homed, restoring full confidence in its position
+        """
+        self.homing_record["last_homed"] = datetime.datetime.today().strftime("%Y-%m-%dT%H:%M")
+        self.homing_record["homes"] += 1
+        self.homing_record["moves_since_home"] = 0
+        self.set_confidence(1.0)
+        self.record_reading(1, self.reading, EVENT_HOMED)
+
+    def record_reading(self, port, reading, event=EVENT_CHECK):
+        """Adds a hall-effect sensor reading to the valve's telemetry
+
+        Args:
+            port (int): the port the reading was taken at
+            reading (float): the sensor reading
+            event (int, optional): the event that the reading was taken for. Defaults to EVENT_CHECK.
+        """
+        self.telemetry.append((time.time(), port, int(self.stepper.position), reading, event))
+
+    def save_telemetry(self):
+        """
+        Saves the valve's telemetry and stores a summary of it in the running configuration
+        """
+        self.telemetry.save(self.telemetry_path)
+        self.manager.prev_run_config.setdefault('valve_telemetry', {})[self.name] = self.summarise_telemetry()
+        self.manager.rc_changes = True
+
+    def summarise_telemetry(self):
+        """Summarises the magnet readings in the valve's telemetry. A linear fit of each magnet's readings over time
+        gives its drift, which is used to estimate how long until the magnet can no longer be detected.
+
+        Returns:
+            dict: {port: {"mean", "std", "drift_per_day", "days_to_threshold", "samples"}}, with counts of corrections
+                  and lost positions
+        """
+        records = self.telemetry.to_array()
+        summary = {"corrections": int(np.count_nonzero(records["event"] == EVENT_CORRECTION)),
+                   "lost": int(np.count_nonzero(records["event"] == EVENT_LOST))}
+        for port in self.magnet_readings:
+            port_records = records[records["port"] == port]
+            if port_records.size < 2:
+                continue
+            readings = port_records["reading"].astype(float)
+            days = (port_records["time"] - port_records["time"][0]) / 86400
+            drift = 0.0
+            if days[-1] > 0:
+                drift = float(np.polyfit(days, readings, 1)[0])
+            # the home magnet must stay above POS_THRESHOLD, the others below NEG_THRESHOLD
+            if port == 1:
+                margin, towards_threshold = readings[-1] - POS_THRESHOLD, -drift
+            else:
+                margin, towards_threshold = NEG_THRESHOLD - readings[-1], drift
+            days_to_threshold = None
+            if towards_threshold > 0:
+                days_to_threshold = round(float(max(margin, 0)) / towards_threshold, 1)
+            summary[port] = {"mean": round(float(readings.mean()), 1), "std": round(float(readings.std()), 2),
+                             "drift_per_day": round(drift, 3), "days_to_threshold": days_to_threshold,
+                             "samples": int(readings.size)}
+        return summary
+
+    @property
+    def needs_homing(self):
+        return self.current_port is None or self.confidence < CONFIDENCE_THRESHOLD
+
+    def sweep_home(self):
+        """Homes the valve by rotating once while sampling the hall-effect sensor. The magnets are found from the peaks
+        in the readings and compared to the stored magnet readings, then the valve moves directly to the home magnet.
+
+        Returns:
+            bool: True if the valve was homed, False if the magnets could not be found
+        """
+        spr = int(self.spr)
+        prev_speed = self.stepper.running_speed
+        self.stepper.set_running_speed(SWEEP_SPEED)
+        # sweep past a full revolution so a magnet at the starting position is seen in full
+        positions, readings = self.stepper.sampled_move(spr + spr // 10, self.he_sensor.analog_read)
+        self.stepper.set_running_speed(prev_speed)
+        if self.check_stop:
+            return False
+        magnets = self.find_magnets(np.array(positions, dtype=float), np.array(readings, dtype=float))
+        if magnets is None:
+            self.write_log(f"{self.name} could not find the magnets in one sweep", level=logging.WARNING)
+            return False
+        home_pos = magnets[1][0]
+        steps = (home_pos - self.stepper.get_current_position()) % spr
+        if steps > spr / 2:
+            steps -= spr
+        self.stepper.move_steps(int(round(steps)))
+        self.last_direction = self.current_direction
+        self.current_direction = 'F' if steps >= 0 else 'R'
+        self.reading = self.he_sensor.analog_read()
+        if self.reading < self.magnet_readings[1] - MIN_DIFF_THRESHOLD:
+            self.find_opt(self.magnet_readings[1] + 40)
+            self.reading = self.he_sensor.analog_read()
+        if self.reading < POS_THRESHOLD:
+            return False
+        self.stepper.set_current_position(0)
+        self.current_port = 1
+        # readings taken while moving differ slightly from stationary readings, so only large changes are rechecked
+        changed = [port for port, magnet in magnets.items()
+                   if abs(magnet[1] - self.magnet_readings[port]) > MAX_DIFF_THRESHOLD]
+        if changed:
+            self.write_log(f"{self.name} magnet readings have changed at ports {changed}, updating",
+                           level=logging.WARNING)
+            self.update_stored_readings()
+        return True
+
+    def find_magnets(self, positions, readings):
+        """Finds the magnets in readings taken over one revolution. The home magnet is the maximum reading, and the
+        other magnets are the minimum readings found near each magnet port's position relative to home.
+
+        Args:
+            positions (numpy.ndarray): the step positions of the readings
+            readings (numpy.ndarray): the hall-effect sensor readings
+
+        Returns:
+            dict: {port: (step position, reading)} for each magnet, or None if a magnet was not found
+        """
+        if readings.size < 3:
+            return None
+        spr = int(self.spr)
+        spacing = min(self.magnet_steps.values())
+        home = int(np.argmax(readings))
+        if readings[home] < POS_THRESHOLD:
+            return None
+        home_pos = positions[home]
+        if 0 < home < readings.size - 1:
+            # fit a parabola through the peak and its neighbours to locate the peak between samples
+            vertex = fit_peak(positions[home - 1:home + 2] - home_pos, readings[home - 1:home + 2])
+            if vertex is not None:
+                home_pos += float(np.clip(vertex, -spacing / 4, spacing / 4))
+        magnets = {1: (home_pos, readings[home])}
+        offsets = (positions - home_pos) % spr
+        for port in self.magnet_ports[1:]:
+            window = np.flatnonzero(np.abs(offsets - self.pos_dict[port]) < spacing / 2)
+            if window.size == 0:
+                return None
+            magnet = window[np.argmin(readings[window])]
+            if readings[magnet] > NEG_THRESHOLD:
+                return None
+            magnets[port] = (positions[magnet], readings[magnet])
+        return magnets
+
     def find_opt(self, target):
-        """Finds a local optimum for the magnet reading from the hall effect sensor using a PID controller
+        """Finds the magnet reading optimum near the current position. A few readings are taken across a window around
+        the position and a parabola is fitted to them, then the valve moves straight to the fitted optimum. The window
+        is shifted towards the best reading if the optimum lies outside it, at most OPT_WINDOWS times.
 
         Args:
-            target (int): The target reading
+            target (int): The target reading. Targets above POS_THRESHOLD search for a maximum (the home magnet),
+                          otherwise a minimum is searched for.
 
         Returns:
             bool: True if optimum found, False otherwise
         """
         prev_speed = self.stepper.running_speed
         self.stepper.set_running_speed(OPT_SPEED)
-        kd, kp = self.pd_constants
-        direction = True
-        dir_changes = 0
-        iters = 0
-        readings = [self.reading]
-        opt_pos = self.stepper.get_current_position()
-        error = abs(target - readings[-1])
-        last_error = error
-        prev_time = time.time()
-        errors = [error]
-        while abs(error) > ERROR_THRESHOLD:
-            iters += 1
-            dt = time.time() - prev_time
-            if dt == 0.0:
-                dt += 0.1
-            prop_error = kp * error
-            # if error < last error, kd*de/dt = neg
-            deriv_error = kd * ((error - last_error) / dt)
-            u = prop_error + deriv_error
-            # moving in wrong direction
-            if error > last_error + 10:
-                direction = not direction
-                dir_changes += 1
-                u += self.backlash
-            if direction is False:
-                u = -u
-            last_error = error
-            prev_time = time.time()
-            self.stepper.move_steps(u)
-            readings.append(self.he_sensor.analog_read())
-            # Found new minimum
-            if target < NEG_THRESHOLD and readings[-1] < min(readings):
-                opt_pos = self.stepper.get_current_position()
-            # Found new_maximum
-            elif target > POS_THRESHOLD and readings[-1] > max(readings[0:-1]):
-                opt_pos = self.stepper.get_current_position()
-            error = abs(target - readings[-1])
-            errors.append(error)
-            if self.check_stop:
+        maximum = target > POS_THRESHOLD
+        half_width = self.spr / 40
+        offsets = np.linspace(-half_width, half_width, OPT_SAMPLES)
+        centre = self.stepper.get_current_position()
+        found = False
+        for _ in range(OPT_WINDOWS):
+            readings = self.sample_window(centre, offsets)
+            if readings is None:
                 self.stepper.set_running_speed(prev_speed)
                 return False
-            if iters > 10 or dir_changes > 3:
-                self.stepper.move_to(opt_pos)
-                opt = self.he_sensor.analog_read()
-                if opt > self.magnet_readings[1]:
-                    self.magnet_readings[1] = opt
-                self.reading = opt
+            best = int(np.argmax(readings)) if maximum else int(np.argmin(readings))
+            vertex = fit_peak(offsets, readings, maximum)
+            if vertex is not None and abs(vertex) <= half_width:
+                opt_pos = centre + vertex
+                found = True
                 break
+            # the optimum is outside the window, so look around the best reading
+            centre += offsets[best]
+            opt_pos = centre
+        best_reading = readings[best]
+        best_pos = centre + offsets[best] if found else opt_pos
+        # approach from below, as the window was sampled, so that backlash doesn't shift the position
+        self.approach(opt_pos)
+        self.reading = self.he_sensor.analog_read()
+        if (maximum and self.reading < best_reading - ERROR_THRESHOLD) or \
+                (not maximum and self.reading > best_reading + ERROR_THRESHOLD):
+            self.approach(best_pos)
+            self.reading = self.he_sensor.analog_read()
+        if maximum and self.reading > self.magnet_readings[1]:
+            self.magnet_readings[1] = self.reading
         self.stepper.set_running_speed(prev_speed)
-        return True
+        return not self.check_stop
+
+    def sample_window(self, centre, offsets):
+        """Reads the hall-effect sensor at offsets from a position, moving forward through the offsets
+
+        Args:
+            centre (float): the step position at the centre of the window
+            offsets (numpy.ndarray): the offsets from centre to read at, in ascending order
+
+        Returns:
+            numpy.ndarray: the readings at each offset, or None if the valve was stopped
+        """
+        readings = np.empty(offsets.size)
+        for i, offset in enumerate(offsets):
+            if i == 0:
+                self.approach(centre + offset)
+            else:
+                self.stepper.move_steps(int(round(offset - offsets[i - 1])))
+            readings[i] = self.he_sensor.analog_read()
+            if self.check_stop:
+                return None
+        return readings
+
+    def approach(self, position):
+        """Moves to a step position, always finishing with a forward move so that backlash is taken up
+
+        Args:
+            position (float): the step position to move to
+        """
+        steps = int(round(position - self.stepper.get_current_position()))
+        if steps < 0:
+            self.stepper.move_steps(steps - self.backlash)
+            steps = self.backlash
+        if steps:
+            self.stepper.move_steps(steps)
 
     def find_zero(self):
         """Checks each magnet position for the magnet at the home (0), which has a reading above 600.
@@ -307,8 +638,8 @@ class SelectorValve(modules.Module):
         """
         # keys are HE readings, values are stepper positions
         readings = {}
-        for i in range(5):
-            self.stepper.move_steps(self.spr / 5)
+        for i in range(len(self.magnet_ports)):
+            self.stepper.move_steps(self.magnet_spacing)
             self.reading = self.he_sensors[0].analog_read()
             readings[self.reading] = self.stepper.get_current_position()
             if self.reading >= POS_THRESHOLD:
@@ -325,51 +656,64 @@ class SelectorValve(modules.Module):
         """
         if self.reading < POS_THRESHOLD:
             self.home_valve()
-        for i in range(1, 5):
-            self.stepper.move_steps(self.spr/5)
-            # move to position 3, 5, 7, 9
+        for prev_port, port in zip(self.magnet_ports, self.magnet_ports[1:]):
+            # move to each of the other magnets in turn
+            self.stepper.move_steps(self.magnet_steps[prev_port])
             reading = self.he_sensors[0].analog_read()
-            self.magnet_readings[i*2+1] = reading
+            self.magnet_readings[port] = reading
+            self.record_reading(port, reading)
         self.manager.prev_run_config['magnet_readings'][self.name] = self.magnet_readings
         self.manager.rc_changes = True
         # move back to 0
-        self.stepper.move_steps(self.spr/5)
+        self.stepper.move_steps(self.magnet_steps[self.magnet_ports[-1]])
 
-    def check_pos(self, position):
+    def check_pos(self, position, fwd=None):
         """Checks whether the magnet reading at position is within 20 of the reference value
 
         Args:
             position (int): The port number to check
+            fwd (bool, optional): The direction the valve moved in. Defaults to the direction of the port numbers.
         """
         magnets_passed = self.stepper.magnets_passed
-        pos_diff = abs(self.current_port - position)
-        req_magnets = pos_diff//2
-        # if we start on an even position, will pass an additional magnet (magnets on starting position aren't counted)
-        if self.current_port % 2 == 0 and position % 2 == 1:
-            req_magnets += 1
+        if fwd is None:
+            fwd = position > self.current_port
+        req_magnets = self.count_magnets(self.current_port, position, fwd)
         if magnets_passed < req_magnets:
             self.write_log("Valve encoder error, checking position", level=logging.WARNING)
+            self.record_reading(position, self.he_sensor.analog_read(), EVENT_LOST)
+            self.set_confidence(0.0)
             self.home_valve()
             self.move_to_pos(position)
+        elif position not in self.magnet_readings:
+            # no magnet at this port, so only the magnet count confirms the position
+            self.set_confidence(self.confidence + CHECK_CONFIDENCE_GAIN / 2)
         if position in self.magnet_readings:
             self.reading = self.he_sensors[0].analog_read()
+            self.record_reading(position, self.reading)
+            gain = CHECK_CONFIDENCE_GAIN
             if position == 1:
                 if self.reading < self.magnet_readings[position] - MIN_DIFF_THRESHOLD:
+                    gain = -CORRECTION_CONFIDENCE_LOSS
                     self.find_opt(self.magnet_readings[position]+50)
                     self.reading = self.he_sensor.analog_read()
+                    self.record_reading(position, self.reading, EVENT_CORRECTION)
                 # if this is still true, we must have lost position.
                 if self.reading < self.magnet_readings[position] - MIN_DIFF_THRESHOLD:
+                    self.record_reading(position, self.reading, EVENT_LOST)
                     self.home_valve()
             else:
                 if self.reading > self.magnet_readings[position] + MIN_DIFF_THRESHOLD:
+                    gain = -CORRECTION_CONFIDENCE_LOSS
                     self.find_opt(self.magnet_readings[position]-50)
                     self.reading = self.he_sensor.analog_read()
+                    self.record_reading(position, self.reading, EVENT_CORRECTION)
                 # if this is still true, we must have lost position.
                 if self.reading > self.magnet_readings[position] + MIN_DIFF_THRESHOLD and self.times_checked < 2:
-                    self.readings_history.append(self.reading)
+                    self.record_reading(position, self.reading, EVENT_LOST)
                     self.home_valve()
                     self.times_checked += 1
                     self.move_to_pos(position)
+            self.set_confidence(self.confidence + gain)
             self.magnet_readings[position] = self.reading
             self.manager.prev_run_config['magnet_readings'][self.name] = self.magnet_readings
             self.manager.rc_changes = True
@@ -378,7 +722,7 @@ class SelectorValve(modules.Module):
     def find_next_magnet(self, invert_direction=False):
         reading = self.he_sensor.analog_read()
         iterations = 0
-        steps = self.spr/20
+        steps = self.magnet_spacing / 4
         if invert_direction:
             steps = -steps
         while NEG_THRESHOLD < reading < POS_THRESHOLD and iterations < 4:
@@ -393,9 +737,9 @@ class SelectorValve(modules.Module):
         start_pos = self.stepper.get_current_position()
         # we start at zero.
         # move in fwd direction to next magnet
-        self.stepper.move_steps(self.spr/5)
+        self.stepper.move_steps(self.magnet_steps[1])
         # move back
-        self.stepper.move_steps(-self.spr/5)
+        self.stepper.move_steps(-self.magnet_steps[1])
         # get within 10 of reading
         start_reading = self.he_sensor.analog_read()
         last_reading = start_reading
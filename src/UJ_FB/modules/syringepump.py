@@ -2,6 +2,9 @@ import logging
 import time
 from UJ_FB.modules import modules
 
+# longest time in seconds to let the fluid settle after a move, however fast the move was
+MAX_SETTLE_SECS = 4
+
 
 class SyringePump(modules.Module):
     """
@@ -37,11 +40,41 @@ class SyringePump(modules.Module):
         self.stepper = self.steppers[0]
         self.steps_per_rev = self.stepper.steps_per_rev
         self.valve = None
+        self.calibrating = False
 
     def set_max_volume(self, volume):
         self.max_volume = float(volume) * 1000.0
         self.syringe_length = self.syringe_lengths[self.max_volume]
 
+    def flow_rate_to_speed(self, flow_rate):
+        """
+        Args:
+            flow_rate (float): flow rate in uL/min
+
+        Returns:
+            float: motor speed in steps/sec
+        """
+        return (flow_rate * self.steps_per_rev * self.syringe_length) / (self.screw_lead * self.max_volume * 60)
+
+    def speed_to_flow_rate(self, speed):
+        """
+        Args:
+            speed (float): motor speed in steps/sec
+
+        Returns:
+            float: flow rate in uL/min
+        """
+        return (speed * self.screw_lead * self.max_volume * 60) / (self.steps_per_rev * self.syringe_length)
+
+    def max_flow_rate(self):
+        """
+        Returns:
+            float: the flow rate in uL/min at the motor's maximum speed, or None if the syringe volume is not set
+        """
+        if not self.syringe_length:
+            return None
+        return self.speed_to_flow_rate(self.stepper.max_speed)
+
     def move_syringe(self, target, volume, flow_rate, direction, air, task=None):
         """Moves the syringe to aspirate (take in) or dispense fluid. Updates the target volume (if target is not None)
         Args:
@@ -54,8 +87,11 @@ class SyringePump(modules.Module):
         """
         self.ready = False
         self.stepper.encoder_error = False
-        # speed in steps/sec
-        speed = (flow_rate * self.steps_per_rev * self.syringe_length) / (self.screw_lead * self.max_volume * 60)
+        fluid = self.get_fluid(target, direction, air)
+        # speed in steps/sec, which the motor can't exceed
+        speed = min(round(self.flow_rate_to_speed(flow_rate)), self.stepper.max_speed)
+        # record the flow rate the pump actually moves at
+        flow_rate = self.speed_to_flow_rate(speed)
         # calculate number of steps to send to motor
         steps = (volume * self.syringe_length * self.steps_per_rev) / (self.max_volume * self.screw_lead)
         adj_steps = False
@@ -92,16 +128,18 @@ class SyringePump(modules.Module):
         if move_flag:
             with self.lock:
                 self.cur_step_pos = self.stepper.get_current_position()
-                self.stepper.set_running_speed(round(speed))
+                self.stepper.set_running_speed(speed)
                 self.stepper.move_steps(actual_steps)
                 # Blocked until move complete or stop command received
                 if self.stepper.encoder_error:
+                    self.manager.flow_model.record_stall(self.name, fluid, flow_rate)
                     new_step_pos = self.correct_error(actual_steps)
                     if self.stepper.encoder_error:
                         if task is not None:
                             task.error = True
                         self.write_log(f"{self.name}: Unable to move, check for obstructions", level=logging.ERROR)
                 else:
+                    self.manager.flow_model.record_success(self.name, fluid, flow_rate)
                     new_step_pos = self.stepper.get_current_position()
                 # if aspirating, step change is neg.
                 step_change = new_step_pos - self.cur_step_pos
@@ -120,7 +158,7 @@ class SyringePump(modules.Module):
                 self.change_volume(vol_change, target, air)
                 self.last_dir = direction
             self.ready = True
-            time.sleep(flow_rate/5000)
+            time.sleep(min(flow_rate/5000, MAX_SETTLE_SECS))
             self.error_count = 0
             return
         self.remaining_volume = abs(volume)
@@ -128,6 +166,82 @@ class SyringePump(modules.Module):
         if task is not None:
             task.error = True
 
+    def calibrate_flow_rate(self, fluid, volume, default, task=None):
+        """Finds the highest flow rate at which the pump can move a fluid. The pump repeatedly aspirates and dispenses
+        the fluid at the valve's current port, raising the flow rate after each successful cycle until the pump stalls
+        or reaches its maximum speed. Calibration is the only time the flow rate model tries flow rates above the
+        highest safe flow rate.
+
+        Args:
+            fluid (str): the fluid at the valve's current port
+            volume (float): the volume in uL to aspirate and dispense each cycle
+            default (float): the default flow rate for moves of this fluid in uL/min
+            task (Task, optional): Task object associated with this function call. Defaults to None.
+        """
+        flow_model = self.manager.flow_model
+        steps = round((volume * self.syringe_length * self.steps_per_rev) / (self.max_volume * self.screw_lead))
+        travel = (steps / self.steps_per_rev) * self.screw_lead
+        if self.position - travel < -self.syringe_length:
+            self.write_log(f"{self.name}: not enough room to aspirate {volume} ul for calibration", level=logging.ERROR)
+            if task is not None:
+                task.error = True
+            return
+        self.ready = False
+        self.calibrating = True
+        last_flow_rate = 0.0
+        self.write_log(f"{self.name}: calibrating flow rate for {fluid}")
+        with self.lock:
+            while self.calibrating:
+                flow_rate = flow_model.next_probe(self.name, fluid, default, self.max_flow_rate())
+                if flow_rate is None:
+                    break
+                speed = min(round(self.flow_rate_to_speed(flow_rate)), self.stepper.max_speed)
+                flow_rate = self.speed_to_flow_rate(speed)
+                if flow_rate <= last_flow_rate:
+                    break
+                last_flow_rate = flow_rate
+                self.stepper.encoder_error = False
+                self.stepper.set_running_speed(speed)
+                start_pos = self.stepper.get_current_position()
+                backlash = self.backlash if self.last_dir != "A" else 0
+                self.stepper.move_steps(-(steps + backlash))
+                if not self.stepper.encoder_error:
+                    self.stepper.move_steps(steps + self.backlash)
+                # restore the syringe to where it started if a stall stopped it partway
+                end_pos = self.stepper.get_current_position()
+                self.last_dir = "D"
+                if self.stepper.encoder_error:
+                    flow_model.record_stall(self.name, fluid, flow_rate)
+                    self.stepper.encoder_error = False
+                    self.stepper.move_steps(start_pos - end_pos)
+                    break
+                flow_model.record_success(self.name, fluid, flow_rate)
+                time.sleep(min(flow_rate/5000, MAX_SETTLE_SECS))
+        self.write_log(f"{self.name}: {fluid} flow rate calibrated to "
+                       f"{round(flow_model.max_flow_rate(self.name, fluid, default, self.max_flow_rate()))} ul/min")
+        self.calibrating = False
+        self.ready = True
+
+    def get_fluid(self, target, direction, air):
+        """Determines which fluid a move will pump
+
+        Args:
+            target (Module Object): the module that is receiving/supplying the fluid
+            direction (str): "A" - aspirate, "D" - dispense
+            air (bool): True if syringe is pumping air
+
+        Returns:
+            str: the name of the fluid
+        """
+        if air:
+            return "air"
+        if direction == "A" and target is not None:
+            if target.mod_type == "syringe_pump":
+                return target.contents[1][0]
+            if target.mod_type != "storage":
+                return target.contents[0]
+        return self.contents[1][0]
+
     def home(self):
         """Moves the pump until the limit switch is triggered
         Args:
@@ -161,6 +275,7 @@ class SyringePump(modules.Module):
     def stop(self):
         """Stops the pump movement
         """
+        self.calibrating = False
         with self.stepper.stop_lock:
             self.stepper.stop_cmd = True
         self.stepper.stop()
@@ -0,0 +1,151 @@
+"""This script contains the Outbox class, a durable queue of requests waiting to be sent to the server. Requests are
+stored in an SQLite database, so status changes, reaction completions and images survive losing the connection to the
+server, or the robot restarting. Each request has an idempotency key, so the server can ignore a request that is sent
+again after its response was lost.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+from threading import Lock
+
+COLUMNS = "id, key, endpoint, json_data, data, created, attempts"
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE NOT NULL,
+    endpoint TEXT NOT NULL,
+    json_data TEXT,
+    data BLOB,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)"""
+
+
+class Outbox:
+    """
+    First in, first out queue of requests, stored in an SQLite database
+    """
+
+    def __init__(self, fp):
+        """
+        Args:
+            fp (str): the database file path. ":memory:" keeps the outbox in memory.
+        """
+        if fp != ":memory:":
+            os.makedirs(os.path.dirname(fp), exist_ok=True)
+        self.lock = Lock()
+        self.db = sqlite3.connect(fp, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(SCHEMA)
+        # IDs of requests being sent by a worker, which other workers skip
+        self.claimed = set()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def put(self, endpoint, json_data=None, data=None, key=None):
+        """Adds a request to the end of the outbox
+
+        Args:
+            endpoint (str): the server endpoint, eg "/status"
+            json_data (dict, optional): the request's JSON payload. Defaults to None.
+            data (bytes, optional): binary data sent after the JSON payload, eg an image. Defaults to None.
+            key (str, optional): the idempotency key. Defaults to a new random key.
+
+        Returns:
+            str: the idempotency key
+        """
+        if key is None:
+            key = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO outbox (key, endpoint, json_data, data, created) "
+                            "VALUES (?, ?, ?, ?, ?)", (key, endpoint, json.dumps(json_data), data, time.time()))
+        return key
+
+    def peek(self, limit, exclude_endpoint=None):
+        """Gets the oldest requests without removing them
+
+        Args:
+            limit (int): the most requests to return
+            exclude_endpoint (str, optional): leaves out requests to this endpoint. Defaults to None.
+
+        Returns:
+            list: [{"id", "key", "endpoint", "json_data", "data", "created", "attempts"}], oldest first
+        """
+        with self.lock:
+            rows = self.db.execute(f"SELECT {COLUMNS} FROM outbox WHERE endpoint IS NOT ? ORDER BY id LIMIT ?",
+                                   (exclude_endpoint, limit)).fetchall()
+        return [self.to_message(row) for row in rows]
+
+    def has_before(self, endpoint, request_id):
+        """
+        Args:
+            endpoint (str): the endpoint, eg "/send_image"
+            request_id (int): the request ID
+
+        Returns:
+            bool: True if a request to the endpoint was added before the request
+        """
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM outbox WHERE endpoint = ? AND id < ? LIMIT 1",
+                                  (endpoint, request_id)).fetchone()
+        return row is not None
+
+    def claim(self, endpoint):
+        """Claims the oldest request to an endpoint that no other worker has claimed, so requests to the endpoint
+        can be sent concurrently
+
+        Args:
+            endpoint (str): the endpoint, eg "/send_image"
+
+        Returns:
+            dict: the request, as returned by peek, or None if there are no unclaimed requests
+        """
+        with self.lock:
+            placeholders = ",".join("?" * len(self.claimed))
+            row = self.db.execute(f"SELECT {COLUMNS} FROM outbox WHERE endpoint = ? AND id NOT IN ({placeholders}) "
+                                  "ORDER BY id LIMIT 1", (endpoint, *self.claimed)).fetchone()
+            if row is None:
+                return None
+            self.claimed.add(row[0])
+        return self.to_message(row)
+
+    def release(self, request_id):
+        """Releases a claimed request that wasn't sent, so it can be claimed again
+
+        Args:
+            request_id (int): the request ID
+        """
+        with self.lock:
+            self.claimed.discard(request_id)
+
+    @staticmethod
+    def to_message(row):
+        return {"id": row[0], "key": row[1], "endpoint": row[2], "json_data": json.loads(row[3]), "data": row[4],
+                "created": row[5], "attempts": row[6]}
+
+    def remove(self, ids):
+        """Removes sent requests in one transaction
+
+        Args:
+            ids (list): the IDs of the requests
+        """
+        if not ids:
+            return
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self.db.execute("COMMIT")
+            self.claimed.difference_update(ids)
+
+    def record_attempt(self, request_id):
+        with self.lock:
+            self.db.execute("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", (request_id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,132 @@
+"""This script contains the ReactorScheduler class, which runs the control loops of every reactor from one thread.
+Reactors are held in a timer wheel, a ring of slots that is advanced once per tick. Each reactor sits in the slot for
+the time its next update is due, so a tick only visits the reactors that are due, and the temperature sensors of those
+reactors are read together before any of them are updated.
+"""
+
+import time
+import logging
+from threading import Thread, Lock
+
+# seconds between advances of the wheel
+TICK = 0.05
+# number of slots in the wheel. Updates due more than one turn ahead wait in their slot for the remaining turns.
+WHEEL_SLOTS = 128
+
+
+class ReactorScheduler(Thread):
+    """
+    Services the heating, stirring, idle temperature updates and stop requests of any number of reactors from a single
+    timer wheel. Each reactor sets its own update rate.
+    """
+
+    def __init__(self, name="ReactorScheduler"):
+        """
+        Args:
+            name (str, optional): the name of the scheduler thread. Defaults to "ReactorScheduler".
+        """
+        Thread.__init__(self, name=name, daemon=True)
+        self.lock = Lock()
+        # [{reactor: turns of the wheel remaining}]
+        self.slots = [{} for _ in range(WHEEL_SLOTS)]
+        # {reactor: slot}
+        self.reactor_slots = {}
+        self.current_slot = 0
+        self.exit = False
+        self.start()
+
+    def add(self, reactor):
+        """Adds a reactor to the scheduler, with its first update on the next tick
+
+        Args:
+            reactor (UJ_FB.modules.reactor.Reactor): the reactor to update
+        """
+        self.schedule(reactor, 0)
+
+    def remove(self, reactor):
+        """Removes a reactor from the scheduler
+
+        Args:
+            reactor (UJ_FB.modules.reactor.Reactor): the reactor to stop updating
+        """
+        with self.lock:
+            self.unschedule(reactor)
+
+    def wake(self, reactor):
+        """Brings a reactor's next update forward to the next tick, eg after a command changes its state
+
+        Args:
+            reactor (UJ_FB.modules.reactor.Reactor): the reactor to update
+        """
+        self.schedule(reactor, 0)
+
+    def schedule(self, reactor, delay):
+        """Schedules the next update of a reactor, replacing any update already scheduled
+
+        Args:
+            reactor (UJ_FB.modules.reactor.Reactor): the reactor to update
+            delay (float): seconds until the update. Updates are made on the next tick at the earliest.
+        """
+        ticks = max(1, int(round(delay / TICK)))
+        with self.lock:
+            self.unschedule(reactor)
+            slot = (self.current_slot + ticks) % WHEEL_SLOTS
+            self.slots[slot][reactor] = (ticks - 1) // WHEEL_SLOTS
+            self.reactor_slots[reactor] = slot
+
+    def unschedule(self, reactor):
+        slot = self.reactor_slots.pop(reactor, None)
+        if slot is not None:
+            del self.slots[slot][reactor]
+
+    def run(self):
+        next_tick = time.monotonic()
+        while not self.exit:
+            next_tick += TICK
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind, so carry on from now rather than running a burst of ticks
+                next_tick = time.monotonic()
+            due = []
+            with self.lock:
+                self.current_slot = (self.current_slot + 1) % WHEEL_SLOTS
+                slot = self.slots[self.current_slot]
+                for reactor, turns in list(slot.items()):
+                    if turns > 0:
+                        slot[reactor] = turns - 1
+                    else:
+                        del slot[reactor]
+                        del self.reactor_slots[reactor]
+                        due.append(reactor)
+            if due:
+                self.service(due)
+
+    def service(self, reactors):
+        """Updates the reactors that are due. Every sensor reading is taken before any reactor is updated, so the
+        serial bus is used in one burst each tick.
+
+        Args:
+            reactors (list): the reactors that are due an update
+        """
+        now = time.time()
+        reactors = [reactor for reactor in reactors if not reactor.exit]
+        readings = {}
+        # one reactor failing is logged and doesn't hold up the others
+        for reactor in reactors:
+            try:
+                if reactor.needs_reading(now):
+                    readings[reactor] = reactor.read_sensor()
+            except Exception as e:
+                reactor.write_log(f"{reactor.name} sensor read failed: {e}", level=logging.ERROR)
+        for reactor in reactors:
+            try:
+                reactor.tick(now, readings.get(reactor))
+            except Exception as e:
+                reactor.write_log(f"{reactor.name} update failed: {e}", level=logging.ERROR)
+            if not reactor.exit:
+                try:
+                    self.schedule(reactor, reactor.next_update(time.time()))
+                except Exception as e:
+                    reactor.write_log(f"{reactor.name} could not be rescheduled: {e}", level=logging.ERROR)
@@ -19,6 +19,7 @@ from PIL import ImageTk, Image
 import cv2 as cv
 import numpy as np
 import networkx as nx
+from UJ_FB.fluidicbackbone import DEFAULT_TUBING_ID
 
 FIELD_NAMES = {"Maximum volume in ml": "max_volume",
                "Current volume in ml": "cur_volume",
@@ -1266,6 +1267,7 @@ class SetupGUI:
             except KeyError:
                 self.write_message(f"{args[2]} not found in graph")
         else:
+            kwargs.setdefault("tubing_id", DEFAULT_TUBING_ID)
             self.graph_tmp.add_edge(args[0], args[1], **kwargs)
             if dual:
                 self.graph_tmp.add_edge(args[1], args[0], **kwargs)
@@ -0,0 +1,186 @@
+"""This script contains the RingBuffer class, used to hold sensor telemetry. Records are stored in a fixed size NumPy
+structured array, so memory use stays constant no matter how long the robot runs, and can be saved to and loaded from
+.npy files. The TieredBuffer class keeps records at several resolutions using a RingBuffer for each.
+"""
+
+import os
+from threading import Lock
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of records backed by a NumPy structured array. Once full, the oldest records are overwritten.
+    """
+
+    def __init__(self, dtype, capacity):
+        """
+        Args:
+            dtype (list): the NumPy structured dtype of each record, eg [("time", "f8"), ("reading", "f4")]
+            capacity (int): the maximum number of records held
+        """
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=self.dtype)
+        # index that the next record is written to
+        self.index = 0
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        """Adds a record, overwriting the oldest record if the buffer is full
+
+        Args:
+            record (tuple): the record's values, in the order of the dtype's fields
+        """
+        with self.lock:
+            self.data[self.index] = record
+            self.index = (self.index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def to_array(self):
+        """
+        Returns:
+            numpy.ndarray: a copy of the records, oldest first
+        """
+        with self.lock:
+            if self.count < self.capacity:
+                return self.data[:self.count].copy()
+            return np.concatenate((self.data[self.index:], self.data[:self.index]))
+
+    def save(self, fp):
+        """Saves the records to a .npy file
+
+        Args:
+            fp (str): the file path
+        """
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        np.save(fp, self.to_array())
+
+    def load(self, fp):
+        """Loads records from a .npy file, keeping the most recent records if there are more than the capacity
+
+        Args:
+            fp (str): the file path
+
+        Returns:
+            bool: True if records were loaded, False if the file is missing or holds different fields
+        """
+        try:
+            records = np.load(fp)
+        except (FileNotFoundError, ValueError, OSError):
+            return False
+        if records.dtype != self.dtype:
+            return False
+        records = records[-self.capacity:]
+        with self.lock:
+            self.data[:records.size] = records
+            self.count = records.size
+            self.index = records.size % self.capacity
+        return True
+
+
+class TieredBuffer:
+    """
+    Holds records at several resolutions. Records are averaged over each interval of each tier and kept in a RingBuffer
+    per tier, so recent records are held in detail and older records at a lower resolution, within a fixed memory.
+    """
+
+    def __init__(self, dtype, tiers):
+        """
+        Args:
+            dtype (list): the NumPy structured dtype of each record. The first field must be the record's time.
+            tiers (tuple): (interval in seconds, capacity) of each tier, finest first
+        """
+        self.dtype = np.dtype(dtype)
+        self.time_field = self.dtype.names[0]
+        self.intervals = [interval for interval, _ in tiers]
+        self.buffers = [RingBuffer(dtype, capacity) for _, capacity in tiers]
+        # the start time of the current interval of each tier, and the sum and number of values of each field in it.
+        # NaN values are left out of the averages.
+        self.bucket_starts = [None] * len(tiers)
+        self.sums = [np.zeros(len(self.dtype.names) - 1) for _ in tiers]
+        self.counts = [np.zeros(len(self.dtype.names) - 1) for _ in tiers]
+        self.lock = Lock()
+
+    def append(self, record):
+        """Adds a record to the current interval of each tier. Intervals that have ended are averaged and stored.
+
+        Args:
+            record (tuple): the record's values, in the order of the dtype's fields, starting with the time
+        """
+        values = np.array(record[1:], dtype=float)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+        with self.lock:
+            for tier, interval in enumerate(self.intervals):
+                bucket_start = record[0] - record[0] % interval
+                if self.bucket_starts[tier] != bucket_start:
+                    self.flush(tier)
+                    self.bucket_starts[tier] = bucket_start
+                self.sums[tier] += values
+                self.counts[tier] += valid
+
+    def flush(self, tier):
+        record = self.current(tier)
+        if record is not None:
+            self.buffers[tier].append(record)
+        self.sums[tier][:] = 0
+        self.counts[tier][:] = 0
+
+    def current(self, tier):
+        """
+        Args:
+            tier (int): the index of the tier
+
+        Returns:
+            tuple: the record averaged over the tier's current interval so far, or None if it has no records
+        """
+        if self.bucket_starts[tier] is None:
+            return None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.sums[tier] / self.counts[tier]
+        return (self.bucket_starts[tier], *means)
+
+    def history(self, start=0.0):
+        """Gets the records since a time at the finest resolution held. Where older records have been overwritten in
+        a finer tier, records from the coarser tiers are used. The interval in progress is included, averaged over the
+        records so far.
+
+        Args:
+            start (float, optional): the earliest time to include. Defaults to 0.0.
+
+        Returns:
+            numpy.ndarray: the records, oldest first
+        """
+        parts = []
+        end = np.inf
+        for tier, buffer in enumerate(self.buffers):
+            records = buffer.to_array()
+            with self.lock:
+                current = self.current(tier)
+            if current is not None:
+                records = np.append(records, np.array([current], dtype=self.dtype))
+            times = records[self.time_field]
+            parts.insert(0, records[(times >= start) & (times < end)])
+            if records.size:
+                end = min(end, times[0])
+        return np.concatenate(parts)
+
+    def save(self, fp, start=0.0):
+        """Saves the records since a time to a .csv file, or a .npy file for any other extension
+
+        Args:
+            fp (str): the file path
+            start (float, optional): the earliest time to include. Defaults to 0.0.
+        """
+        records = self.history(start)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        if fp.endswith(".csv"):
+            np.savetxt(fp, records, delimiter=",", header=",".join(self.dtype.names), comments="",
+                       fmt=["%.3f"] + ["%.2f"] * (len(self.dtype.names) - 1))
+        else:
+            np.save(fp, records)
@@ -1,77 +1,308 @@
 import xml.etree.ElementTree as et
-from threading import Lock
+from threading import Lock, Thread, Event
+from urllib.parse import urlsplit
 import time
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import socket
 import json
+import gzip
+import os
+from UJ_FB import outbox
 
 # IP address of PI server
 DEFAULT_URL = "http://127.0.0.1:5000/robots_api"
+# seconds the server holds a push request open while waiting for events
+LONG_POLL_SECS = 25
+# seconds before trying the push channel again after falling back to polling
+PUSH_RETRY_SECS = 60
+# timeouts, retries, and whether requests can be safely repeated once the server has received them, for each endpoint.
+# Timeouts are (connect, read) in seconds. Requests are made from the listener's threads, never the manager's.
+ENDPOINTS = {"/": {"timeout": (3.05, 10), "retries": 2, "repeatable": True},
+             "/status": {"timeout": (3.05, 5), "retries": 2, "repeatable": True},
+             "/reaction": {"timeout": (3.05, 10), "retries": 1, "repeatable": False},
+             "/send_image": {"timeout": (3.05, 30), "retries": 3, "repeatable": False},
+             "/events": {"timeout": (3.05, LONG_POLL_SECS + 5), "retries": 0, "repeatable": True}}
+# seconds between retries grow as BACKOFF * 2 ** (retry - 1)
+BACKOFF = 0.5
+# server responses that are retried
+RETRY_STATUSES = (502, 503, 504)
+# connections kept alive to the server
+POOL_SIZE = 4
+# connections kept alive to each server by a session shared between robots
+SHARED_POOL_SIZE = 64
+# JSON payloads smaller than this are not worth compressing, in bytes
+COMPRESS_MIN_BYTES = 1024
+# requests taken from the outbox at a time
+OUTBOX_BATCH = 20
+# seconds between attempts to reconnect and flush the outbox while the server is unreachable
+OUTBOX_RETRY_SECS = 30
+# images uploaded at the same time
+UPLOAD_WORKERS = 2
+IMAGE_ENDPOINT = "/send_image"
+
+
+def mount_endpoints(session, url, pool_size):
+    """Mounts an adapter for each endpoint of a server on a session, giving each endpoint its own retry budget
+
+    Args:
+        session (requests.Session): the session
+        url (str): the URL of the server's robots API
+        pool_size (int): the connections kept alive to the server by each adapter
+    """
+    for endpoint, settings in ENDPOINTS.items():
+        retries = settings["retries"]
+        # requests that aren't repeatable are only retried if they never reached the server
+        retry = Retry(total=retries, connect=retries, read=retries if settings["repeatable"] else 0,
+                      status=retries if settings["repeatable"] else 0, other=0, allowed_methods=None,
+                      status_forcelist=RETRY_STATUSES, backoff_factor=BACKOFF, raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+        session.mount(url + endpoint, adapter)
+
+
+class UploadPool:
+    """
+    Pool of worker threads that uploads images for several robots, so each robot doesn't need its own upload workers
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, name="UploadPool"):
+        """
+        Args:
+            workers (int, optional): images uploaded at the same time. Defaults to UPLOAD_WORKERS.
+            name (str, optional): the name of the worker threads. Defaults to "UploadPool".
+        """
+        self.lock = Lock()
+        self.listeners = []
+        # set when any robot has images to upload
+        self.event = Event()
+        self.exit = False
+        self.threads = [Thread(target=self.run, name=f"{name}{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+        self.event.set()
+
+    def remove(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def run(self):
+        """Takes images from each robot in turn, until no robot has an image that can be uploaded
+        """
+        while not self.exit:
+            self.event.wait(OUTBOX_RETRY_SECS)
+            self.event.clear()
+            uploaded = True
+            while uploaded and not self.exit:
+                uploaded = False
+                with self.lock:
+                    listeners = list(self.listeners)
+                for listener in listeners:
+                    if listener.upload_next():
+                        uploaded = True
+
+    def stop(self):
+        self.exit = True
+        self.event.set()
 
 
 class WebListener:
     """This class is used for all the web related tasks for the robot, and also to parse XDL for
     execution on the robots.
     """
-    def __init__(self, robot_manager, robot_id,  robot_key):
+    def __init__(self, robot_manager, robot_id,  robot_key, session=None, upload_pool=None):
         """
         Args:
             robot_manager (UJ_FB.Manager): the manager for this robot
             robot_id (str): the robot's ID
             robot_key (str): the robot's key (password)
+            session (requests.Session, optional): a session shared with other robots, so that robots using the same
+                server share its connections. Defaults to None, which gives the robot its own session.
+            upload_pool (UploadPool, optional): a pool that uploads images for several robots. Defaults to None, which
+                starts upload workers for this robot.
         """
         self.manager = robot_manager
+        self.shared_session = session
         self.id = robot_id
         self.key = robot_key
+        # guards the URL, session, and connection state. Requests are made without holding it.
         self.url_lock = Lock()
-        self.url = self.manager.prev_run_config["url"]
-        if "http" in self.url:
-            self.ip = self.url.split("/")[2]
-        if self.url == "":
-            self.url = DEFAULT_URL
+        self.session = None
+        url = self.manager.prev_run_config["url"]
+        if url == "":
+            url = DEFAULT_URL
+        self.set_url(url)
         self.manager.prev_run_config["url"] = self.url
+        # gzip JSON payloads sent to the server. The server must accept Content-Encoding: gzip.
+        self.compress = self.manager.prev_run_config.setdefault("compress_requests", False)
         self.valid_connection = False
         self.polling_time = 20
         self.last_set_status = ""
         self.last_execution_update = 0
         self.last_reaction_update = 0
         self.last_error_update = 0
+        # the server pushes execution changes and new reactions over a long-poll request when it supports it, and
+        # the robot falls back to polling when it doesn't
+        self.push_enabled = self.manager.prev_run_config.setdefault("push_updates", True)
+        self.push_active = False
+        self.push_thread = None
+        # ID of the last event received. None asks the server for the current state.
+        self.last_event_id = None
+        # latest execute action pushed by the server
+        self.execute_state = None
+        self.reaction_pending = False
+        # set when an event arrives or a poll finds a change, to wake the manager
+        self.push_event = Event()
+        # the execute state, reactions and the error state are polled by a background thread, so a slow server
+        # can't stall the manager. The manager asks for a reaction, and takes the response once it arrives.
+        self.reaction_wanted = False
+        self.received_reaction = None
+        self.error_cleared = False
+        self.poll_event = Event()
+        self.poll_thread = Thread(target=self.poll_loop, name=f"{self.id}Poll", daemon=True)
+        self.poll_thread.start()
+        # status changes are sent in order from the outbox by a background thread, and images are uploaded from it
+        # by a pool of workers. Both are kept while the server is unreachable. Robots running offline have no outbox.
+        self.outbox = None
+        self.outbox_event = Event()
+        self.outbox_thread = None
+        self.upload_pool = None
+        self.upload_event = Event()
+        self.upload_threads = []
+        if not self.manager.web_enabled:
+            return
+        self.outbox = outbox.Outbox(os.path.join(self.manager.script_dir, "configs", "outbox.db"))
+        self.outbox_thread = Thread(target=self.flush_outbox, name=f"{self.id}Outbox", daemon=True)
+        self.outbox_thread.start()
+        if upload_pool is not None:
+            self.upload_pool = upload_pool
+            self.upload_event = upload_pool.event
+            upload_pool.add(self)
+        else:
+            self.upload_threads = [Thread(target=self.upload_images, name=f"{self.id}Upload{i}", daemon=True)
+                                   for i in range(UPLOAD_WORKERS)]
+            for thread in self.upload_threads:
+                thread.start()
+
+    def set_url(self, url):
+        """Sets the server URL and opens a new session to it. The session keeps connections to the server alive
+        between requests, and each endpoint is mounted with its own retry budget. A shared session is reused, and
+        adapters are only mounted on it for servers that no other robot uses.
+
+        Args:
+            url (str): the URL of the server's robots API
+        """
+        if self.shared_session is not None:
+            session = self.shared_session
+            with self.url_lock:
+                if url + "/" not in session.adapters:
+                    mount_endpoints(session, url, SHARED_POOL_SIZE)
+        else:
+            session = requests.Session()
+            mount_endpoints(session, url, POOL_SIZE)
+        with self.url_lock:
+            old_session = self.session
+            self.url = url
+            self.ip = urlsplit(url).hostname
+            self.session = session
+        if old_session is not None and old_session is not self.shared_session:
+            old_session.close()
+
+    def request(self, method, endpoint, json_data=None, **kwargs):
+        """Makes a request to the server over the pooled session, using the endpoint's timeout
+
+        Args:
+            method (str): the HTTP method
+            endpoint (str): the endpoint, eg "/status"
+            json_data (dict, optional): the JSON payload. Defaults to None.
+            **kwargs: passed to requests.Session.request
+
+        Returns:
+            requests.Response: the server's response
+        """
+        with self.url_lock:
+            url = self.url
+            session = self.session
+        kwargs.setdefault("timeout", ENDPOINTS[endpoint]["timeout"])
+        if json_data is not None:
+            payload = json.dumps(json_data).encode()
+            if self.compress and len(payload) >= COMPRESS_MIN_BYTES:
+                kwargs["data"] = gzip.compress(payload)
+                kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Type": "application/json",
+                                     "Content-Encoding": "gzip"}
+            else:
+                kwargs["json"] = json_data
+        return session.request(method, url + endpoint, **kwargs)
+
+    def stop(self):
+        """Wakes the listener's threads so they see that the manager is exiting, and leaves any shared upload pool
+        """
+        if self.upload_pool is not None:
+            self.upload_pool.remove(self)
+        else:
+            self.upload_event.set()
+        self.outbox_event.set()
+        self.poll_event.set()
 
     def update_url(self, ip):
-        self.ip = ip
-        self.url = "http://" + ip + "/robots_api"
+        self.set_url("http://" + ip + "/robots_api")
         self.test_connection()
 
-    def test_connection(self):
+    def test_connection(self, reconnect=False):
         """Tests whether a connection can be successfully established with a server. 
+
+        Args:
+            reconnect (bool, optional): True when retrying a lost connection. The URL is kept and failures are not
+                logged. Defaults to False.
         """
-        retry = False
-        with self.url_lock:
-            try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.connect((self.ip, 80))
-                ip_address = s.getsockname()[0]
-                r = requests.get(self.url + "/", json={"robot_id": self.id, "robot_key": self.key,
-                                                       "cmd": "connect", "ip": ip_address}, timeout=10)
-                r = r.json()
-                self.manager.prev_run_config["url"] = self.url
-                self.manager.rc_changes = True
-                if r["conn_status"] == "accepted":
-                    self.manager.write_log(f"Connection established to {self.url}", level=logging.INFO)
-                    self.valid_connection = True
-                else:
-                    self.manager.write_log("Connection refused. Please check robot ID and key in configuration files.",
-                                           level=logging.WARNING)
-            except (requests.ConnectionError, json.decoder.JSONDecodeError, socket.gaierror) as e:
-                if self.url != DEFAULT_URL:
-                    self.url = DEFAULT_URL
-                    retry = True
-                else:
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect((self.ip, 80))
+            ip_address = s.getsockname()[0]
+            s.close()
+            r = self.request("GET", "/", {"robot_id": self.id, "robot_key": self.key, "cmd": "connect",
+                                          "ip": ip_address})
+            r = r.json()
+        except (requests.RequestException, json.decoder.JSONDecodeError, OSError):
+            if reconnect:
+                return
+            if self.url != DEFAULT_URL:
+                self.set_url(DEFAULT_URL)
+                self.test_connection()
+            else:
+                with self.url_lock:
                     self.valid_connection = False
-                    self.manager.write_log("Could not connect to server, running offline. ", level=logging.WARNING)
-        if retry:
-            self.test_connection()
+                self.manager.write_log("Could not connect to server, running offline. ", level=logging.WARNING)
+            return
+        self.manager.prev_run_config["url"] = self.url
+        self.manager.rc_changes = True
+        if r.get("conn_status") == "accepted":
+            self.manager.write_log(f"Connection established to {self.url}", level=logging.INFO)
+            with self.url_lock:
+                self.valid_connection = True
+            self.start_push()
+            self.poll_event.set()
+            self.outbox_event.set()
+            self.upload_event.set()
+        else:
+            self.manager.write_log("Connection refused. Please check robot ID and key in configuration files.",
+                                   level=logging.WARNING)
+
+    def connection_failed(self, e):
+        """Marks the connection as lost after a failed request
+
+        Args:
+            e (Exception): the exception raised by the request
+        """
+        with self.url_lock:
+            self.valid_connection = False
+        self.manager.write_log(f"Lost connection to {self.url}, {e}", level=logging.WARNING)
 
     def update_status(self, ready, error=False, reaction_complete=False):
         """Updates the robot's status on the server
@@ -81,114 +312,327 @@ class WebListener:
             error (bool, optional): True if robot has encountered an error. Defaults to False.
             reaction_complete (bool, optional): True if reaction is complete. Defaults to False.
         """
-        time_elapsed = time.time() - self.last_error_update
-        with self.url_lock:
-            if self.valid_connection:
-                if error:
-                    status = "ERROR"
-                elif ready:
-                    status = "IDLE"
-                else:
-                    status = "BUSY"
-                if status != self.last_set_status or reaction_complete:
-                    json_data = {"robot_id": self.id, "robot_key": self.key, "cmd": "robot_status",
-                                 "robot_status": status}
-                    if reaction_complete:
-                        json_data.update({"reaction_complete": True, "reaction_id": self.manager.reaction_id})
-                    requests.post(self.url + "/status", json=json_data)
-                    self.last_set_status = status
-                elif error and time_elapsed > self.polling_time:
-                    response = requests.get(self.url + "/status", json={"robot_id": self.id, "robot_key": self.key,
-                                                                        "cmd": "error_state"})
-                    json_args = response.json()
-                    error_state = int(json_args.get("error_state"))
-                    self.last_error_update = time.time()
-                    if not error_state:
-                        self.manager.error = False
-                        self.manager.resume()
+        if self.outbox is None:
+            return
+        if error:
+            status = "ERROR"
+        elif ready:
+            status = "IDLE"
+        else:
+            status = "BUSY"
+        if status != self.last_set_status or reaction_complete:
+            # queued even while offline so that the server receives every change, in order
+            json_data = {"robot_id": self.id, "robot_key": self.key, "cmd": "robot_status", "robot_status": status}
+            if reaction_complete:
+                json_data.update({"reaction_complete": True, "reaction_id": self.manager.reaction_id})
+            self.outbox.put("/status", json_data)
+            self.outbox_event.set()
+            self.last_set_status = status
+        elif error and self.error_cleared:
+            # the poll thread found that the error was cleared on the server
+            self.error_cleared = False
+            self.manager.error = False
+            self.manager.resume()
 
     def update_execution(self):
-        """Queries whether the robot should continue to execute the queue
+        """Gets whether the robot should continue to execute the queue, as last pushed by the server or polled by the
+        poll thread
 
         Returns:
-            bool/None: Returns True/False if response received from server. Otherwise returns None.
+            bool/None: Returns True/False if the server has sent the execute action. Otherwise returns None.
         """
-        time_elapsed = time.time() - self.last_execution_update
-        with self.url_lock:
-            if self.valid_connection and time_elapsed > self.polling_time:
-                try:
-                    response = requests.get(self.url + "/status", json={"robot_id": self.id, "robot_key": self.key,
-                                                                        "cmd": "robot_execute"})
-                    response = response.json()
-                    execute = response.get("action")
-                    self.last_execution_update = time.time()
-                    return execute
-                except (requests.ConnectionError, json.JSONDecodeError) as e:
-                    self.valid_connection = False
-                    return None
-            return None
+        return self.execute_state
 
-    def send_image(self, image_metadata, img_data):
-        """Sends an image to the server. Images are sent in two post requests. The first request holds the images 
-        metadata, and the second holds the image encoded as bytes
+    def poll_loop(self):
+        """Polls the server every polling_time seconds, or when woken. The execute state is polled while the push
+        channel is closed, a reaction is fetched once the manager asks for one, and the error state is polled while
+        the robot has an error. Results are stored for the manager to take, and the manager is woken.
+        """
+        while not self.manager.exit_flag:
+            self.poll_event.wait(self.polling_time)
+            self.poll_event.clear()
+            if not self.manager.web_enabled or not self.valid_connection:
+                continue
+            now = time.time()
+            if not self.push_active and now - self.last_execution_update > self.polling_time:
+                self.poll_execution()
+            if self.reaction_wanted and self.received_reaction is None:
+                self.fetch_reaction()
+            if self.manager.error and now - self.last_error_update > self.polling_time:
+                self.poll_error_state()
+
+    def poll_execution(self):
+        try:
+            response = self.request("GET", "/status", {"robot_id": self.id, "robot_key": self.key,
+                                                       "cmd": "robot_execute"})
+            response = response.json()
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            self.connection_failed(e)
+            return
+        self.last_execution_update = time.time()
+        execute = response.get("action")
+        if execute != self.execute_state:
+            self.execute_state = execute
+            self.push_event.set()
+
+    def fetch_reaction(self):
+        self.reaction_wanted = False
+        try:
+            response = self.request("GET", "/reaction", {"robot_id": self.id, "robot_key": self.key,
+                                                         "cmd": "get_reaction"})
+            response = response.json()
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            self.manager.write_log(f"Connection failed, {e}", level=logging.INFO)
+            return
+        self.last_reaction_update = time.time()
+        if response.get("protocol") is not None:
+            self.received_reaction = response
+            # the manager only asks for reactions now and then, so tell it one is waiting
+            self.reaction_pending = True
+            self.push_event.set()
+
+    def poll_error_state(self):
+        try:
+            response = self.request("GET", "/status", {"robot_id": self.id, "robot_key": self.key,
+                                                       "cmd": "error_state"})
+            json_args = response.json()
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            self.connection_failed(e)
+            return
+        self.last_error_update = time.time()
+        if not int(json_args.get("error_state")):
+            self.error_cleared = True
+            self.push_event.set()
+
+    def send_image(self, image_metadata, img_data, content_type="image/png"):
+        """Queues an image to be uploaded to the server by the upload workers. The image and its metadata are sent
+        together in one multipart request.
 
         Args:
             image_metadata (dict): the metadata for the image, like the date, name etc
-            img_data (bytes): the image encoded in bytes
+            img_data (bytes): the encoded image
+            content_type (str, optional): the image's MIME type. Defaults to "image/png".
 
         Returns:
-            requests.Response/bool: returns the response if one received, otherwise returns False
+            str: the idempotency key of the queued image, or None if the robot is offline
+        """
+        if self.outbox is None:
+            return None
+        image_metadata = {**image_metadata, "img_content_type": content_type}
+        key = self.outbox.put(IMAGE_ENDPOINT, image_metadata, data=bytes(img_data))
+        self.upload_event.set()
+        return key
+
+    def upload_images(self):
+        """Uploads images from the outbox whenever images are added or the connection is restored. Each worker
+        claims one image at a time, so UPLOAD_WORKERS images are uploaded at once.
+        """
+        while not self.manager.exit_flag:
+            self.upload_event.wait(OUTBOX_RETRY_SECS)
+            self.upload_event.clear()
+            while self.upload_next():
+                pass
+
+    def upload_next(self):
+        """Claims the oldest image in the outbox that no other worker is uploading, and uploads it
+
+        Returns:
+            bool: True if an image was uploaded, False if there was none or it couldn't be sent
         """
         if not self.valid_connection:
-            self.test_connection()
-        with self.url_lock:
-            try:
-                r = requests.post(self.url + "/send_image", json=image_metadata)
-                if r.ok:
-                    request_id = r.json().get("request_id")
-            except requests.ConnectionError:
-                self.manager.write_log(f"A connection to {self.url} could not be established, trying again.",
-                                       level=logging.WARNING)
-                self.valid_connection = False
-                time.sleep(20)
-                return False
+            return False
+        message = self.outbox.claim(IMAGE_ENDPOINT)
+        if message is None:
+            return False
+        if not self.send_message(message):
+            self.outbox.release(message["id"])
+            return False
+        self.outbox.remove([message["id"]])
+        # a reaction completion may be waiting for this image
+        self.outbox_event.set()
+        return True
+
+    def flush_outbox(self):
+        """Sends the requests in the outbox other than images in order, in batches, whenever requests are added or the
+        connection is restored. While the server is unreachable the connection is retried every OUTBOX_RETRY_SECS.
+        A reaction completion is held back until the images queued before it are uploaded, so the server has every
+        image of a reaction when it is told the reaction is complete.
+        """
+        while not self.manager.exit_flag:
+            self.outbox_event.wait(OUTBOX_RETRY_SECS)
+            self.outbox_event.clear()
+            # a lost connection is retried even with nothing to send, so polling and the push channel resume
+            if not self.valid_connection:
+                self.test_connection(reconnect=True)
+                if not self.valid_connection:
+                    continue
+            if not len(self.outbox):
+                continue
+            batch = self.outbox.peek(OUTBOX_BATCH, exclude_endpoint=IMAGE_ENDPOINT)
+            while batch:
+                sent = []
+                for message in batch:
+                    if message["json_data"].get("reaction_complete") and \
+                            self.outbox.has_before(IMAGE_ENDPOINT, message["id"]):
+                        break
+                    if not self.send_message(message):
+                        break
+                    sent.append(message["id"])
+                self.outbox.remove(sent)
+                if len(sent) < len(batch):
+                    break
+                batch = self.outbox.peek(OUTBOX_BATCH, exclude_endpoint=IMAGE_ENDPOINT)
+
+    def send_message(self, message):
+        """Sends a request from the outbox. Requests the server rejects are logged and dropped, so they don't hold up
+        the rest of the outbox.
+
+        Args:
+            message (dict): the request, as returned by Outbox.peek
+
+        Returns:
+            bool: True if the request is finished with, False if it should be sent again later
+        """
+        headers = {"Idempotency-Key": message["key"]}
+        try:
+            if message["data"] is None:
+                r = self.request("POST", message["endpoint"], message["json_data"], headers=headers)
             else:
-                r = requests.post(self.url + "/send_image", data=img_data.tobytes(), params={"request_id": request_id})
-                return r
+                metadata = message["json_data"]
+                files = {"metadata": (None, json.dumps(metadata), "application/json"),
+                         "image": (str(metadata.get("img_number", "image")), message["data"],
+                                   metadata.get("img_content_type", "application/octet-stream"))}
+                r = self.request("POST", message["endpoint"], headers=headers, files=files)
+        except (requests.RequestException, json.JSONDecodeError) as e:
+            self.outbox.record_attempt(message["id"])
+            self.connection_failed(e)
+            return False
+        if r.ok:
+            return True
+        self.outbox.record_attempt(message["id"])
+        if r.status_code >= 500 or r.status_code in (408, 429):
+            return False
+        self.manager.write_log(f"Server rejected request to {message['endpoint']}, {r.status_code}",
+                               level=logging.ERROR)
+        return True
+
+    def request_reaction(self, stage=False):
+        """Loads a reaction fetched from the server by the poll thread. If none has been fetched, asks the poll thread
+        to fetch one, so the manager isn't held up waiting for the server.
 
-    def request_reaction(self):
-        """Requests a reaction from the server
+        Args:
+            stage (bool, optional): True to stage the reaction to run after the current one. Defaults to False.
 
         Returns:
             bool: True if reaction received, False if nothing received or no valid connection
         """
-        time_elapsed = time.time() - self.last_reaction_update
-        with self.url_lock:
-            if self.valid_connection and time_elapsed > self.polling_time:
-                try:
-                    response = requests.get(self.url + "/reaction", json={"robot_id": self.id, "robot_key": self.key,
-                                                                          "cmd": "get_reaction"})
-                    response = response.json()
-                    # get the xdl string
-                    protocol = response.get("protocol")
-                    if protocol is not None:
-                        self.manager.write_log(f"Received reaction {response.get('name')}", level=logging.INFO)
-                        self.manager.reaction_name = response.get("name")
-                        self.manager.reaction_id = response.get("reaction_id")
-                        clean_step = response.get("clean_step")
-                        self.load_xdl(protocol, is_file=False, clean_step=clean_step)
-                        return True
-                except requests.exceptions.ConnectionError as e:
-                    self.manager.write_log(f"Connection failed, {e}", level=logging.INFO)
+        response = self.received_reaction
+        if response is None:
+            time_elapsed = time.time() - self.last_reaction_update
+            if self.valid_connection and (time_elapsed > self.polling_time or self.reaction_pending):
+                self.reaction_pending = False
+                self.reaction_wanted = True
+                self.poll_event.set()
             return False
+        self.received_reaction = None
+        self.reaction_pending = False
+        # get the xdl string
+        protocol = response.get("protocol")
+        if stage:
+            self.manager.write_log(f"Received next reaction {response.get('name')}", level=logging.INFO)
+            # kept with its XDL so it can be compiled again if the staged pipeline is discarded
+            self.manager.staged_reaction = {"name": response.get("name"), "reaction_id": response.get("reaction_id"),
+                                            "xdl": protocol, "clean_step": response.get("clean_step"),
+                                            "compiled": False}
+            self.load_xdl(protocol, is_file=False, clean_step=response.get("clean_step"), stage=True)
+            return True
+        self.manager.write_log(f"Received reaction {response.get('name')}", level=logging.INFO)
+        self.manager.reaction_name = response.get("name")
+        self.manager.reaction_id = response.get("reaction_id")
+        clean_step = response.get("clean_step")
+        self.load_xdl(protocol, is_file=False, clean_step=clean_step)
+        return True
 
-    def load_xdl(self, xdl, is_file=True, clean_step=False):
+    def start_push(self):
+        """Starts listening for events pushed by the server, if enabled and not already listening
+        """
+        if not self.push_enabled or (self.push_thread is not None and self.push_thread.is_alive()):
+            return
+        self.push_thread = Thread(target=self.push_loop, name=f"{self.id}Push", daemon=True)
+        self.push_thread.start()
+
+    def push_loop(self):
+        """Holds a long-poll request open to the server's events endpoint while the connection is valid. The server
+        replies as soon as there are events newer than the last one received, or after LONG_POLL_SECS with none.
+        If the server doesn't support the push channel, or the request fails, the robot polls until the push channel
+        is tried again.
+        """
+        while self.valid_connection and not self.manager.exit_flag:
+            try:
+                response = self.request("GET", "/events", {"robot_id": self.id, "robot_key": self.key,
+                                                           "cmd": "wait_events", "since": self.last_event_id,
+                                                           "timeout": LONG_POLL_SECS})
+                if response.status_code == 404:
+                    raise requests.HTTPError("server has no push channel", response=response)
+                response.raise_for_status()
+                response = response.json()
+            except (requests.RequestException, json.JSONDecodeError) as e:
+                if self.push_active:
+                    self.manager.write_log(f"Push channel closed, polling the server. {e}", level=logging.INFO)
+                self.push_active = False
+                self.poll_event.set()
+                time.sleep(PUSH_RETRY_SECS)
+                continue
+            if not self.push_active:
+                self.manager.write_log("Receiving updates pushed by the server", level=logging.INFO)
+                # polls are skipped while the push channel is open, so check for a reaction that may have been missed
+                self.reaction_pending = True
+                self.push_active = True
+            for event in response.get("events", []):
+                self.handle_event(event)
+            self.last_event_id = response.get("last_id", self.last_event_id)
+        self.push_active = False
+
+    def handle_event(self, event):
+        """Acts on an event pushed by the server
+
+        Args:
+            event (dict): the event. "execute" events hold the execute action, "reaction" events announce a new
+                reaction, and "stop" events stop all operations.
+        """
+        if event.get("type") == "execute":
+            self.execute_state = event.get("action")
+        elif event.get("type") == "reaction":
+            self.reaction_pending = True
+        elif event.get("type") == "stop":
+            with self.manager.interrupt_lock:
+                self.manager.pause_flag = True
+                self.manager.stop_flag = True
+                self.manager.interrupt = True
+            self.manager.write_log("Server requested stop", level=logging.WARNING)
+        self.push_event.set()
+
+    def wait_for_push(self, timeout):
+        """Waits for an event to be pushed by the server, or for a poll to find a change
+
+        Args:
+            timeout (float): the longest time to wait in seconds
+
+        Returns:
+            bool: True if an event arrived, False if the wait timed out
+        """
+        pushed = self.push_event.wait(timeout)
+        self.push_event.clear()
+        return pushed
+
+    def load_xdl(self, xdl, is_file=True, clean_step=False, stage=False):
         """Loads an XDL file or string
 
         Args:
             xdl (str, file-like object): the XDL data
             is_file (bool, optional): Whether the XDL data is a file or a string. Defaults to True.
             clean_step (bool, optional): True if a cleaning step is required at the end of the reaction. Defaults to False.
+            stage (bool, optional): True to compile the XDL as the staged reaction. Defaults to False.
 
         Returns:
             bool: True if XDL loaded and parsed correctly. Otherwise False.
@@ -207,19 +651,26 @@ class WebListener:
             except et.ParseError as e:
                 self.manager.write_log(f"The XDL provided is not formatted correctly, {str(e)}", level=logging.ERROR)
                 return False
-        return self.parse_xdl(tree, clean_step=clean_step)
+        return self.parse_xdl(tree, clean_step=clean_step, stage=stage)
 
-    def parse_xdl(self, tree, clean_step=False):
+    def parse_xdl(self, tree, clean_step=False, stage=False):
         """Parse the XDL and determine what steps need to be carried out. Put the steps into the Manager's queue.
 
         Args:
             tree (Element): an Element object representing the XML tree
             clean_step (bool, optional): True if cleaning step required after reaction. Defaults to False.
+            stage (bool, optional): True to compile the XDL as the staged reaction, which is validated against the
+                state the robot is projected to be in once the current reaction ends. Defaults to False.
 
         Returns:
             bool: True if XDL parsed successfully. False otherwise.
         """
+        staged = self.manager.staged_reaction
+        if not stage and staged is not None:
+            # the staged pipeline is replaced, so the staged reaction is compiled again when it is due to run
+            staged["compiled"] = False
         self.manager.pipeline.queue.clear()
+        self.manager.line_contents = {}
         reagents = {}
         modules = {}
         if tree.find("Synthesis"):
@@ -244,11 +695,18 @@ class WebListener:
                 return False
             modules[module_id] = mod.name
         parse_success = True
+        # consecutive additions are queued together so that additions over separate routes can run concurrently
+        additions = []
         for step in procedure:
             if step.tag == "Add":
-                if not self.process_xdl_add(reagents, step):
+                if not self.process_xdl_add(reagents, step, additions):
+                    parse_success = False
+                continue
+            if additions:
+                if not self.manager.move_fluids_concurrently(additions):
                     parse_success = False
-            elif step.tag == "Transfer":
+                additions = []
+            if step.tag == "Transfer":
                 if not self.process_xdl_transfer(step):
                     parse_success = False
             elif "Stir" in step.tag:
@@ -260,12 +718,30 @@ class WebListener:
             elif "Wait" in step.tag:
                 if not self.process_xdl_wait(step, metadata):
                     parse_success = False
+        if additions and not self.manager.move_fluids_concurrently(additions):
+            parse_success = False
+        # return any liquid left in primed transfer lines to its vessel
+        self.manager.add_to_queue(self.manager.flush_primed_lines(), self.manager.pipeline)
         if clean_step:
             self.manager.wait(0, {"wait_user": True, "wait_reason": "cleaning"})
+        if parse_success:
+            report = self.manager.validate_pipeline(state=self.manager.projected_state if stage else None)
+            if not report["valid"]:
+                self.manager.write_log(f"{reaction_name} cannot be run: {report['message']}", level=logging.ERROR)
+                parse_success = False
+            for flask, reagent in report["reagents"].items():
+                self.manager.write_log(f"Requires {round(reagent['volume'])} ul of {reagent['contents']} from {flask}")
         if not parse_success:
             self.manager.pipeline.queue.clear()
             return False
+        elif stage:
+            staged["compiled"] = True
+            if not staged["name"]:
+                staged["name"] = reaction_name
+            self.manager.write_log(f"Staged {staged['name']} to run after the current reaction")
+            return True
         else:
+            self.manager.projected_state = report["state"]
             with self.manager.interrupt_lock:
                 self.manager.reaction_ready = True
                 if not self.manager.reaction_name:
@@ -273,12 +749,14 @@ class WebListener:
                 self.manager.write_log("XDL loaded successfully")
                 return True
 
-    def process_xdl_add(self, reagents, add_info):
+    def process_xdl_add(self, reagents, add_info, additions=None):
         """Process reagent addition step
 
         Args:
             reagents (dict): dictionary of reagents and their corresponding flask
             add_info (dict): additional information for the addition
+            additions (list, optional): if given, the addition is appended to this list as a
+                                        (source, target, volume, flow_rate) tuple instead of being queued.
 
         Returns:
             bool: True if successful processed and queued. False otherwise
@@ -316,6 +794,9 @@ class WebListener:
                 flow_rate = (volume*1000)/float(a_time[0])
         else:
             flow_rate = 0
+        if additions is not None:
+            additions.append((source, target, volume, flow_rate))
+            return True
         return self.manager.move_fluid(source, target, volume, flow_rate)
 
     def process_xdl_transfer(self, transfer_info):
@@ -362,7 +843,8 @@ class WebListener:
                 flow_rate = (volume * 1000) / float(t_time[0])
         else:
             flow_rate = 0
-        return self.manager.move_fluid(source, target, volume, flow_rate, adjust_dead_vol=True, transfer=True)
+        return self.manager.move_fluid(source, target, volume, flow_rate, adjust_dead_vol=True, transfer=True,
+                                       keep_primed=True)
 
     def process_xdl_stir(self, stir_info):
         """Process a stir step
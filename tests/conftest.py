@@ -0,0 +1,164 @@
+import os
+import sys
+import logging
+from queue import Queue
+from threading import Lock
+
+import networkx as nx
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import fluidicbackbone, flow_model
+
+STEPPER = {"steps_per_rev": 3200, "enabled_acceleration": False, "speed": 1000, "max_speed": 10000,
+           "acceleration": 1000}
+
+
+class FakeDevice:
+    """
+    Stands in for a Commanduino device. Moves complete instantly and sensors return a fixed level.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.pos = 0
+        self.magnets_passed = 0
+        self.level = 512
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return lambda *args, **kwargs: None
+
+    def get_current_position(self):
+        return self.pos
+
+    def set_current_position(self, position):
+        self.pos = position
+
+    def move(self, steps, wait):
+        self.pos += steps
+
+    def move_to(self, position, wait):
+        self.pos = position
+
+    def get_move_complete(self):
+        return True
+
+    def get_level(self):
+        return self.level
+
+    def get_switch_state(self):
+        return 0
+
+
+class FakeCommandManager:
+    """
+    Stands in for a Commanduino CommandManager, creating a FakeDevice for each device the modules ask for
+    """
+
+    def __init__(self):
+        self.devices = {}
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return self.devices.setdefault(item, FakeDevice(item))
+
+
+def build_graph():
+    """Builds the module connections of a robot with two valves, each with a syringe pump:
+
+        valve1: 1 flask1 (50 ml water), 2 flask2 (empty), 3 waste1, 4 valve2
+        valve2: 1 flask4 (empty, 50 ml), 2 flask3 (20 ml ethanol), 4 valve1
+    """
+    g = nx.MultiDiGraph()
+    g.add_node("meta", robot_id="T1", key="k", rxn_name="")
+
+    def valve(name, stepper, sensor):
+        g.add_node(name, name=name, mod_type="selector_valve", class_type="SelectorValve",
+                   mod_config={"ports": 10, "linear_stepper": False, "gear": "Direct drive"},
+                   devices={"stepper": {"name": stepper, "cmd_id": stepper, "device_config": dict(STEPPER)},
+                            "he_sens": {"name": sensor, "cmd_id": sensor, "device_config": {}}})
+
+    def syringe(name, stepper):
+        g.add_node(name, name=name, mod_type="syringe_pump", class_type="SyringePump",
+                   mod_config={"screw_lead": 8, "linear_stepper": True, "backlash": 0, "max_volume": 10,
+                               "contents": ""},
+                   devices={"stepper": {"name": stepper, "cmd_id": stepper, "device_config": dict(STEPPER)}})
+
+    def flask(name, contents, cur_volume, max_volume, mod_type="flask"):
+        g.add_node(name, name=name, mod_type=mod_type, class_type="FBFlask",
+                   mod_config={"contents": contents, "cur_volume": cur_volume, "max_volume": max_volume}, devices={})
+
+    def link(module, valve_name, port, length=100):
+        g.add_edge(module, valve_name, port=[0, port], tubing_length=length)
+        g.add_edge(valve_name, module, port=[0, port], tubing_length=length)
+
+    valve("valve1", "stepperX", "AR1")
+    valve("valve2", "stepperY", "AR2")
+    syringe("syringe1", "stepperZ")
+    syringe("syringe2", "stepperE0")
+    flask("flask1", "water", 50, 100)
+    flask("flask2", "empty", 0, 100)
+    flask("waste1", "waste", 0, 500, "waste")
+    flask("flask3", "ethanol", 20, 100)
+    flask("flask4", "empty", 0, 50)
+    link("flask1", "valve1", 1)
+    link("flask2", "valve1", 2)
+    link("waste1", "valve1", 3)
+    g.add_edge("valve2", "valve1", port=[1, 4], tubing_length=50)
+    g.add_edge("valve1", "valve2", port=[0, 4], tubing_length=50)
+    link("syringe1", "valve1", -1, 0)
+    link("flask4", "valve2", 1)
+    link("flask3", "valve2", 2)
+    link("syringe2", "valve2", -1, 0)
+    return g
+
+
+def build_manager(script_dir):
+    """Builds a FluidicBackbone for the robot from build_graph, with fake hardware and without starting its thread
+
+    Args:
+        script_dir (str): the directory the robot writes its configs to
+
+    Returns:
+        FluidicBackbone: the manager, with its modules set up
+    """
+    m = fluidicbackbone.FluidicBackbone.__new__(fluidicbackbone.FluidicBackbone)
+    m.graph = build_graph()
+    m.cmd_mng = FakeCommandManager()
+    readings = {1: 700, 3: 400, 5: 400, 7: 400, 9: 400}
+    m.prev_run_config = {"magnet_readings": {"valve1": dict(readings), "valve2": dict(readings), "check_magnets": 0},
+                         "valve_pos": {"valve1": 1, "valve2": 1},
+                         "valve_backlash": {"valve1": {"check_backlash": 1, "backlash_steps": 0},
+                                            "valve2": {"check_backlash": 1, "backlash_steps": 0}},
+                         "url": ""}
+    m.flow_model = flow_model.FlowRateModel(m)
+    m.logger = logging.getLogger("T1")
+    m.id, m.key = "T1", "k"
+    m.simulation = True
+    m.gui_main = None
+    m.script_dir = script_dir
+    for attr, value in dict(q=Queue(), pipeline=Queue(), error_queue=Queue(), tasks=[], serial_lock=Lock(),
+                            interrupt_lock=Lock(), valid_nodes=[], num_valves=0, rc_changes=False,
+                            default_transfer_fr=5000, default_fr=10000, default_flush_fr=20000, waiting=False,
+                            pause_flag=False, stop_flag=False, error=False, claims={}, claim_tasks={},
+                            claim_waits=set(), claim_count=0, line_contents={}, premoves={},
+                            preheats={}, staged_reaction=None, projected_state=None).items():
+        setattr(m, attr, value)
+    m.modules = {"valves": {}, "syringes": {}, "reactors": {}, "flasks": {}, "cameras": {}, "storage": {}}
+    m.valves = m.modules["valves"]
+    m.syringes = m.modules["syringes"]
+    m.reactors = m.modules["reactors"]
+    m.flasks = m.modules["flasks"]
+    m.cameras = m.modules["cameras"]
+    m.storage = m.modules["storage"]
+    m.setup_modules()
+    return m
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return build_manager(str(tmp_path))
@@ -0,0 +1,243 @@
+"""End-to-end load test of the web path. Runs a number of simulated robots against the stand-in robots API server and
+reports request rates, reaction dispatch latency and how long robots take to recover from a server outage. Each robot
+runs the real WebListener, driven by a loop that makes the same web calls as the FluidicBackbone manager, including
+fetching and staging the next reaction while one runs. Reactions are run by waiting for a set time rather than by
+parsing XDL and driving hardware, so compiling reactions and checking staged reactions against the robot's projected
+state are not exercised.
+
+    python load_test.py --robots 20 --duration 120 --reaction-rate 10 --outage-at 40 --outage-secs 15
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from threading import Thread, Lock
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import web_listener
+from robots_api_server import RobotsAPIServer
+
+# seconds between iterations of a simulated robot's loop while it runs a reaction
+LOOP_SECS = 0.1
+# seconds between reaction requests while idle, as in the manager's loop
+REACTION_CHECK_SECS = 10
+# bytes in each simulated image
+IMAGE_BYTES = 200000
+XDL = "<Synthesis><Metadata name='load_test'/><Hardware/><Reagents/><Procedure/></Synthesis>"
+
+
+class SimulatedListener(web_listener.WebListener):
+    """
+    WebListener that accepts reactions without parsing their XDL, as parsing needs a robot's modules
+    """
+
+    def load_xdl(self, xdl, is_file=True, clean_step=False, stage=False):
+        if stage:
+            self.manager.staged_reaction["compiled"] = True
+        else:
+            self.manager.reaction_ready = True
+        self.manager.received_times.append(time.time())
+        return True
+
+
+class SimulatedRobot(Thread):
+    """
+    Stands in for a FluidicBackbone manager. Makes the same calls to its WebListener as the manager's loop, and runs
+    each reaction by waiting.
+    """
+
+    def __init__(self, robot_id, url, reaction_secs, images, workdir):
+        """
+        Args:
+            robot_id (str): the robot's ID
+            url (str): the URL of the robots API
+            reaction_secs (float): seconds each reaction takes
+            images (int): images sent during each reaction
+            workdir (str): directory for the robot's outbox
+        """
+        Thread.__init__(self, name=robot_id, daemon=True)
+        self.id = robot_id
+        self.logger = logging.getLogger(robot_id)
+        self.prev_run_config = {"url": url}
+        self.script_dir = workdir
+        self.rc_changes = False
+        self.web_enabled = True
+        self.exit_flag = False
+        self.interrupt_lock = Lock()
+        self.pause_flag = False
+        self.stop_flag = False
+        self.interrupt = False
+        self.error = False
+        self.reaction_ready = False
+        self.reaction_name = ""
+        self.reaction_id = None
+        self.staged_reaction = None
+        self.reaction_secs = reaction_secs
+        self.images = images
+        self.received_times = []
+        self.completed = 0
+        self.listener = SimulatedListener(self, robot_id, "key")
+
+    def write_log(self, message, level=logging.INFO):
+        self.logger.log(level, message)
+
+    def resume(self):
+        pass
+
+    def run(self):
+        self.listener.test_connection()
+        rxn_last_check = 0.0
+        while not self.exit_flag:
+            execute = self.listener.update_execution()
+            if not self.reaction_ready and self.staged_reaction is not None:
+                self.start_staged_reaction()
+            if not self.reaction_ready:
+                self.listener.update_status(ready=True)
+                if time.time() - rxn_last_check > REACTION_CHECK_SECS or self.listener.reaction_pending:
+                    rxn_last_check = time.time()
+                    self.listener.request_reaction()
+                if not self.reaction_ready:
+                    self.listener.wait_for_push(2)
+            elif execute:
+                self.run_reaction()
+
+    def run_reaction(self):
+        self.reaction_ready = False
+        self.listener.update_status(False)
+        end_time = time.time() + self.reaction_secs
+        image_times = list(np.linspace(time.time(), end_time, self.images + 2)[1:-1])
+        rxn_last_check = 0.0
+        while time.time() < end_time and not self.exit_flag:
+            # fetch the next reaction while this one runs, as the manager does
+            if self.staged_reaction is None and (time.time() - rxn_last_check > REACTION_CHECK_SECS
+                                                 or self.listener.reaction_pending):
+                rxn_last_check = time.time()
+                self.listener.request_reaction(stage=True)
+            if image_times and time.time() >= image_times[0]:
+                image_times.pop(0)
+                metadata = {"robot_id": self.id, "robot_key": "key", "reaction_id": self.reaction_id,
+                            "img_number": self.images - len(image_times)}
+                self.listener.send_image(metadata, os.urandom(IMAGE_BYTES))
+            self.listener.update_execution()
+            time.sleep(LOOP_SECS)
+        self.completed += 1
+        self.listener.update_status(True, reaction_complete=True)
+        self.reaction_name = ""
+        self.reaction_id = None
+
+    def start_staged_reaction(self):
+        staged = self.staged_reaction
+        self.staged_reaction = None
+        self.reaction_name = staged["name"]
+        self.reaction_id = staged["reaction_id"]
+        self.reaction_ready = True
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = np.array(values)
+    return (f"mean {values.mean():.3f} s, p50 {np.percentile(values, 50):.3f} s, "
+            f"p95 {np.percentile(values, 95):.3f} s, max {values.max():.3f} s")
+
+
+def report(server, robots, start_time, end_time, outage_end):
+    """Prints the results of a load test
+
+    Args:
+        server (RobotsAPIServer): the server the robots ran against
+        robots (list): the SimulatedRobots
+        start_time (float): the time the test started
+        end_time (float): the time the test ended
+        outage_end (float): the time the outage ended, or None if there was no outage
+    """
+    duration = end_time - start_time
+    log = [entry for entry in server.request_log if start_time <= entry[0] <= end_time]
+    print(f"{len(robots)} robots for {duration:.0f} s, {len(log)} requests, {len(log) / duration:.1f} requests/s")
+    counts = {}
+    for _, endpoint, _, outcome in log:
+        counts[(endpoint, outcome)] = counts.get((endpoint, outcome), 0) + 1
+    for (endpoint, outcome), count in sorted(counts.items()):
+        print(f"  {endpoint:<12} {outcome:<8} {count:>7} {count / duration:>8.2f}/s")
+    waits = [fetched - queued for _, queued, fetched in server.dispatches if queued is not None]
+    print(f"dispatch latency ({len(waits)} reactions): {percentiles(waits)}")
+    completed = sum(len(robot.completed) for robot in server.robots.values())
+    print(f"reactions completed: {sum(robot.completed for robot in robots)} run, {completed} reported to the server")
+    print(f"images received: {len(server.images)}")
+    backlog = sum(len(robot.listener.outbox) for robot in robots)
+    print(f"requests left in outboxes: {backlog}")
+    if outage_end is not None:
+        recoveries = []
+        for robot in robots:
+            times = [entry[0] for entry in log if entry[2] == robot.id and entry[3] == "ok" and entry[0] >= outage_end]
+            if times:
+                recoveries.append(times[0] - outage_end)
+        print(f"recovery after outage ({len(recoveries)}/{len(robots)} robots): {percentiles(recoveries)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs simulated robots against the stand-in robots API server")
+    parser.add_argument("--robots", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run for")
+    parser.add_argument("--reaction-rate", type=float, default=6, help="reactions queued per minute, across robots")
+    parser.add_argument("--reaction-secs", type=float, default=20, help="seconds each reaction takes")
+    parser.add_argument("--images", type=int, default=2, help="images sent during each reaction")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--no-push", action="store_true", help="disable the server's push channel")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before each response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of connections dropped")
+    parser.add_argument("--outage-at", type=float, default=None, help="seconds into the test that the server fails")
+    parser.add_argument("--outage-secs", type=float, default=10, help="length of the outage in seconds")
+    parser.add_argument("--retry-secs", type=float, default=None,
+                        help="overrides the robots' reconnect and push retry intervals")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    if args.retry_secs is not None:
+        web_listener.OUTBOX_RETRY_SECS = args.retry_secs
+        web_listener.PUSH_RETRY_SECS = args.retry_secs
+    server = RobotsAPIServer(port=args.port, push=not args.no_push, latency=args.latency,
+                             failure_rate=args.failure_rate, drop_rate=args.drop_rate, seed=args.seed)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="uj_fb_load_test")
+    robots = [SimulatedRobot(f"load{i}", server.url, args.reaction_secs, args.images,
+                             os.path.join(workdir, f"load{i}")) for i in range(args.robots)]
+    for robot in robots:
+        server.set_execute(robot.id, True)
+        robot.start()
+
+    start_time = time.time()
+    end_time = start_time + args.duration
+    outage_start = start_time + args.outage_at if args.outage_at is not None else None
+    outage_end = None
+    next_reaction = start_time
+    reaction_count = 0
+    while time.time() < end_time:
+        now = time.time()
+        if args.reaction_rate > 0 and now >= next_reaction:
+            robot = robots[reaction_count % len(robots)]
+            reaction_count += 1
+            server.add_reaction(robot.id, f"reaction{reaction_count}", XDL, reaction_id=reaction_count)
+            next_reaction += 60 / args.reaction_rate
+        if outage_start is not None and now >= outage_start:
+            server.outage(args.outage_secs)
+            outage_end = now + args.outage_secs
+            outage_start = None
+        time.sleep(0.05)
+
+    for robot in robots:
+        robot.exit_flag = True
+    report(server, robots, start_time, time.time(), outage_end)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""Local stand-in for the robots API server, used to test the WebListener without a real server. It answers the same
+requests as the server, and pushes execution changes and new reactions to robots that hold a long-poll request open
+on the events endpoint. Latency, failed requests, dropped connections and outages can be injected, and every request
+is logged so that load tests can measure request rates, dispatch latency and recovery times. Reactions and execution
+changes are made from Python, or the server can be run on its own:
+
+    python robots_api_server.py --port 5000 --latency 0.2 --failure-rate 0.05
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import random
+import socket
+import sys
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Condition
+
+# events kept for each robot. Robots that fall further behind are sent the current state instead.
+MAX_EVENTS = 100
+
+
+class RobotState:
+    """
+    The server's record of one robot
+    """
+
+    def __init__(self):
+        self.status = ""
+        # every status received, in order
+        self.statuses = []
+        self.execute = False
+        self.error_state = 0
+        self.reactions = []
+        # {reaction ID: time the reaction was queued}
+        self.queued_times = {}
+        self.completed = []
+        # [(event id, event)]
+        self.events = []
+        # ID of the newest event dropped from the events kept
+        self.dropped_id = 0
+
+
+class RobotsAPIServer(ThreadingHTTPServer):
+    """
+    Serves the robots API for any number of robots. Any robot ID and key are accepted.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5000, push=True, latency=0.0, failure_rate=0.0, drop_rate=0.0,
+                 seed=None):
+        """
+        Args:
+            host (str, optional): the address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): the port to listen on. Defaults to 5000.
+            push (bool, optional): whether to serve the events endpoint. Robots poll when it is disabled.
+                Defaults to True.
+            latency (float, optional): seconds added before each response. Defaults to 0.0.
+            failure_rate (float, optional): fraction of requests answered with 503. Defaults to 0.0.
+            drop_rate (float, optional): fraction of requests whose connection is closed without a response.
+                Defaults to 0.0.
+            seed (int, optional): seeds the fault injection so runs can be repeated. Defaults to None.
+        """
+        super().__init__((host, port), RequestHandler)
+        self.daemon_threads = True
+        self.push = push
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        # requests are dropped until this time
+        self.down_until = 0.0
+        # [(time, endpoint, robot ID, outcome)] of every request. The outcome is "ok", "failed" or "dropped".
+        self.request_log = []
+        # [(reaction ID, time queued, time dispatched)] of every reaction fetched by a robot
+        self.dispatches = []
+        self.robots = {}
+        self.event_ids = itertools.count(1)
+        self.last_event_id = 0
+        self.condition = Condition()
+        self.request_counts = {}
+        # [{"metadata", "data"}] of each image received
+        self.images = []
+        # responses to requests with an idempotency key, replayed if the request is sent again. {(key, path): response}
+        self.idempotent_responses = {}
+        # open client connections, closed when the server stops
+        self.connections = set()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/robots_api"
+
+    def start(self):
+        """Serves requests from a background thread
+        """
+        self.thread = Thread(target=self.serve_forever, name="RobotsAPIServer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops serving and closes any connections kept alive, as if the server went down
+        """
+        self.shutdown()
+        self.server_close()
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def handle_error(self, request, client_address):
+        # connections closed by an outage or a robot going away are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        super().shutdown_request(request)
+
+    def robot(self, robot_id):
+        return self.robots.setdefault(robot_id, RobotState())
+
+    def outage(self, secs):
+        """Drops every request for a time, as if the server or network went down
+
+        Args:
+            secs (float): the length of the outage in seconds
+        """
+        self.down_until = time.time() + secs
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def inject_fault(self):
+        """Waits for the injected latency, then decides whether the request fails
+
+        Returns:
+            str: "dropped" if the connection should be closed without a response, "failed" if the request should be
+                answered with 503, or "ok"
+        """
+        if time.time() < self.down_until:
+            return "dropped"
+        if self.latency:
+            time.sleep(self.latency)
+        roll = self.random.random()
+        if roll < self.drop_rate:
+            return "dropped"
+        if roll < self.drop_rate + self.failure_rate:
+            return "failed"
+        return "ok"
+
+    def log_request(self, endpoint, robot_id, outcome):
+        with self.condition:
+            self.request_log.append((time.time(), endpoint, robot_id, outcome))
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    def take_reaction(self, robot_id):
+        """Takes the next reaction queued for a robot, recording how long it waited
+
+        Args:
+            robot_id (str): the robot's ID
+
+        Returns:
+            dict: the reaction, or an empty dict if none are queued
+        """
+        with self.condition:
+            robot = self.robot(robot_id)
+            if not robot.reactions:
+                return {}
+            reaction = robot.reactions.pop(0)
+            queued_time = robot.queued_times.pop(reaction["reaction_id"], None)
+            self.dispatches.append((reaction["reaction_id"], queued_time, time.time()))
+            return reaction
+
+    def push_event(self, robot_id, event):
+        """Records an event for a robot and wakes any long-poll request waiting for it
+
+        Args:
+            robot_id (str): the robot's ID
+            event (dict): the event
+        """
+        with self.condition:
+            event_id = next(self.event_ids)
+            self.last_event_id = event_id
+            robot = self.robot(robot_id)
+            robot.events.append((event_id, event))
+            if len(robot.events) > MAX_EVENTS:
+                robot.dropped_id = robot.events.pop(0)[0]
+            self.condition.notify_all()
+
+    def set_execute(self, robot_id, execute):
+        """Starts or pauses execution on a robot
+
+        Args:
+            robot_id (str): the robot's ID
+            execute (bool): True to execute the queue, False to pause it
+        """
+        self.robot(robot_id).execute = execute
+        self.push_event(robot_id, {"type": "execute", "action": execute})
+
+    def stop_robot(self, robot_id):
+        self.robot(robot_id).execute = False
+        self.push_event(robot_id, {"type": "stop"})
+
+    def add_reaction(self, robot_id, name, protocol, reaction_id=None, clean_step=False):
+        """Queues a reaction for a robot
+
+        Args:
+            robot_id (str): the robot's ID
+            name (str): the reaction name
+            protocol (str): the reaction's XDL
+            reaction_id (int, optional): the reaction's ID. Defaults to the next event ID.
+            clean_step (bool, optional): whether the robot should wait for cleaning after the reaction.
+                Defaults to False.
+        """
+        with self.condition:
+            if reaction_id is None:
+                reaction_id = self.last_event_id + 1
+            robot = self.robot(robot_id)
+            robot.reactions.append({"name": name, "protocol": protocol, "reaction_id": reaction_id,
+                                    "clean_step": clean_step})
+            robot.queued_times[reaction_id] = time.time()
+        self.push_event(robot_id, {"type": "reaction", "reaction_id": reaction_id})
+
+    def wait_events(self, robot_id, since, timeout):
+        """Waits for events newer than the last one a robot received. A robot that has just connected, or fell too
+        far behind, is sent its current state.
+
+        Args:
+            robot_id (str): the robot's ID
+            since (int): the ID of the last event the robot received, or None if it has just connected
+            timeout (float): the longest time to wait in seconds
+
+        Returns:
+            dict: {"events": [event], "last_id": int}
+        """
+        end_time = time.time() + timeout
+        with self.condition:
+            robot = self.robot(robot_id)
+            if since is None or since > self.last_event_id or since < robot.dropped_id:
+                events = [{"type": "execute", "action": robot.execute}]
+                if robot.reactions:
+                    events.append({"type": "reaction"})
+                return {"events": events, "last_id": self.last_event_id}
+            while True:
+                events = [event for event_id, event in robot.events if event_id > since]
+                remaining = end_time - time.time()
+                if events or remaining <= 0:
+                    return {"events": events, "last_id": self.last_event_id}
+                self.condition.wait(remaining)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles one connection to the RobotsAPIServer. Connections are kept alive between requests.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    @staticmethod
+    def parse_json(body):
+        try:
+            return json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            return {}
+
+    def parse_multipart(self, body):
+        """
+        Returns:
+            dict: the content of each part of a multipart/form-data request, by name
+        """
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                for part in message.iter_parts()}
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def endpoint(self):
+        return "/" + self.path.split("?")[0].split("/robots_api", 1)[-1].strip("/")
+
+    def do_GET(self):
+        self.handle_request(self.handle_get)
+
+    def do_POST(self):
+        self.handle_request(self.handle_post)
+
+    def handle_request(self, handler):
+        """Reads a request, injects any fault, and sends the handler's response. POST responses are recorded
+        against their idempotency key and replayed if the request is sent again.
+
+        Args:
+            handler (function): handle_get or handle_post
+        """
+        server = self.server
+        endpoint = self.endpoint
+        body = self.read_body()
+        outcome = server.inject_fault()
+        if outcome == "dropped":
+            server.log_request(endpoint, None, outcome)
+            self.close_connection = True
+            return
+        if outcome == "failed":
+            server.log_request(endpoint, None, outcome)
+            self.send_json({"error": "injected failure"}, status=503)
+            return
+        key = self.headers.get("Idempotency-Key") if self.command == "POST" else None
+        if key is not None and (key, self.path) in server.idempotent_responses:
+            response, robot_id = server.idempotent_responses[(key, self.path)]
+        else:
+            response, robot_id = handler(endpoint, body)
+            if key is not None:
+                server.idempotent_responses[(key, self.path)] = response, robot_id
+        server.log_request(endpoint, robot_id, outcome)
+        self.send_json(*response)
+
+    def handle_get(self, endpoint, body):
+        """
+        Args:
+            endpoint (str): the endpoint, eg "/status"
+            body (bytes): the request body
+
+        Returns:
+            tuple: the JSON response and status code, and the ID of the robot that sent the request
+        """
+        server = self.server
+        data = self.parse_json(body)
+        robot_id = data.get("robot_id")
+        robot = server.robot(robot_id)
+        cmd = data.get("cmd")
+        if endpoint == "/" and cmd == "connect":
+            return ({"conn_status": "accepted"}, 200), robot_id
+        elif endpoint == "/status" and cmd == "robot_execute":
+            return ({"action": robot.execute}, 200), robot_id
+        elif endpoint == "/status" and cmd == "error_state":
+            return ({"error_state": robot.error_state}, 200), robot_id
+        elif endpoint == "/reaction" and cmd == "get_reaction":
+            return (server.take_reaction(robot_id), 200), robot_id
+        elif endpoint == "/events" and server.push:
+            return (server.wait_events(robot_id, data.get("since"), data.get("timeout", 25)), 200), robot_id
+        return ({"error": "not found"}, 404), robot_id
+
+    def handle_post(self, endpoint, body):
+        """
+        Args:
+            endpoint (str): the endpoint, eg "/status"
+            body (bytes): the request body
+
+        Returns:
+            tuple: the JSON response and status code, and the ID of the robot that sent the request
+        """
+        server = self.server
+        if endpoint == "/status":
+            data = self.parse_json(body)
+            robot = server.robot(data.get("robot_id"))
+            robot.status = data.get("robot_status")
+            robot.statuses.append(robot.status)
+            if data.get("reaction_complete"):
+                robot.completed.append(data.get("reaction_id"))
+            return ({}, 200), data.get("robot_id")
+        elif endpoint == "/send_image":
+            if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+                parts = self.parse_multipart(body)
+                metadata = json.loads(parts["metadata"])
+                server.images.append({"metadata": metadata, "data": parts["image"]})
+                return ({"request_id": len(server.images)}, 200), metadata.get("robot_id")
+            # images sent as metadata followed by the image bytes
+            if "request_id" in self.path:
+                server.images.append({"metadata": None, "data": body})
+                return ({}, 200), None
+            metadata = self.parse_json(body)
+            return ({"request_id": len(server.images)}, 200), metadata.get("robot_id")
+        return ({"error": "not found"}, 404), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a local stand-in for the robots API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--no-push", action="store_true", help="disable the events endpoint")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before each response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of connections dropped")
+    args = parser.parse_args()
+    server = RobotsAPIServer(args.host, args.port, push=not args.no_push, latency=args.latency,
+                             failure_rate=args.failure_rate, drop_rate=args.drop_rate)
+    print(f"Serving {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
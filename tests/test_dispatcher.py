@@ -0,0 +1,90 @@
+from UJ_FB.fluidicbackbone import Task
+
+
+class RunningTask:
+    """
+    Task whose module is still working
+    """
+
+    def __init__(self, complete=False):
+        self.is_complete = complete
+
+
+def claimed(manager, module_name, claim_id, claims):
+    command = manager.generate_cmd_dict("selector_valve", module_name, 2, {"wait": True})[0]
+    return dict(command, claim_id=claim_id, claims=claims)
+
+
+def test_disjoint_moves_are_interleaved(manager):
+    assert manager.move_fluids_concurrently([("flask1", "flask2", 1000, 0), ("flask3", "flask4", 1000, 0)])
+    commands = list(manager.pipeline.queue)
+    groups = [command["claim_id"] for command in commands]
+    assert len(set(groups)) == 2
+    # the groups alternate rather than running one after the other
+    assert groups[0] != groups[1]
+    first, second = sorted(set(groups))
+    assert {module for command in commands if command["claim_id"] == first for module in command["claims"]} == \
+        {"valve1", "syringe1"}
+    assert {module for command in commands if command["claim_id"] == second for module in command["claims"]} == \
+        {"valve2", "syringe2"}
+
+
+def test_moves_sharing_a_valve_are_serialised(manager):
+    assert manager.move_fluids_concurrently([("flask1", "flask2", 1000, 0), ("flask2", "waste1", 1000, 0)])
+    commands = list(manager.pipeline.queue)
+    assert all(command.get("claim_id") is None for command in commands)
+    targets = [command["parameters"].get("target") for command in commands
+               if command["mod_type"] == "syringe_pump" and command["parameters"].get("target") in
+               ("flask1", "flask2", "waste1")]
+    # every command of the first move comes before the second move takes from flask2 and empties to waste
+    assert targets.index("waste1") > max(i for i, target in enumerate(targets) if target == "flask1")
+
+
+def test_next_command_skips_group_blocked_by_claim(manager):
+    manager.claims = {"valve1": "a-1", "syringe1": "a-1"}
+    manager.claim_tasks = {"a-1": [RunningTask()]}
+    blocked = claimed(manager, "valve1", "b-2", ["syringe1", "valve1"])
+    free = claimed(manager, "valve2", "c-3", ["syringe2", "valve2"])
+    manager.q.put(blocked)
+    manager.q.put(free)
+    assert manager.next_command() is free
+    assert manager.next_command() is None
+    # the first group finishing releases its claims
+    manager.claim_tasks["a-1"][0].is_complete = True
+    assert manager.next_command() is blocked
+    assert "a-1" not in manager.claims.values()
+
+
+def test_group_waiting_keeps_its_order(manager):
+    manager.claim_waits = {"b-2"}
+    manager.claim_tasks = {"b-2": [RunningTask()]}
+    manager.q.put(claimed(manager, "valve1", "b-2", ["valve1"]))
+    manager.q.put(claimed(manager, "valve1", "b-2", ["valve1"]))
+    assert manager.next_command() is None
+
+
+def test_unclaimed_command_waits_for_claimed_groups(manager):
+    manager.claim_tasks = {"a-1": [RunningTask()]}
+    manager.claims = {"valve1": "a-1"}
+    manager.q.put(manager.generate_cmd_dict("selector_valve", "valve2", 2, {"wait": True})[0])
+    assert manager.next_command() is None
+
+
+def test_dispatch_records_claims_and_stop_releases_them(manager):
+    command = claimed(manager, "valve1", "a-1", ["syringe1", "valve1"])
+    assert manager.dispatch_command(command)
+    assert manager.claims == {"syringe1": "a-1", "valve1": "a-1"}
+    assert isinstance(manager.claim_tasks["a-1"][0], Task)
+    assert "a-1" in manager.claim_waits
+    manager.q.put(claimed(manager, "valve1", "a-1", ["syringe1", "valve1"]))
+    manager.stop_all()
+    assert manager.claims == {} and manager.claim_tasks == {} and manager.claim_waits == set()
+    assert manager.q.empty()
+
+
+def test_clear_claims(manager):
+    manager.claims = {"valve1": "a-1"}
+    manager.claim_tasks = {"a-1": [RunningTask()]}
+    manager.claim_waits = {"a-1"}
+    manager.clear_claims()
+    assert manager.claims == {} and manager.claim_tasks == {} and manager.claim_waits == set()
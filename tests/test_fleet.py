@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import threading
+from queue import Queue
+from threading import Lock
+from types import SimpleNamespace
+
+import networkx as nx
+import pytest
+
+from UJ_FB import fleet, fbexceptions
+
+
+class StubRobot:
+    """
+    Holds the parts of a FluidicBackbone that the FleetHost reports on and exits
+    """
+
+    def __init__(self, robot_id, temps=None, **state):
+        self.id = robot_id
+        self.ready = True
+        self.execute = False
+        self.paused = False
+        self.error = False
+        self.reaction_name = ""
+        self.staged_reaction = None
+        self.q = Queue()
+        self.tasks = []
+        self.listener = SimpleNamespace(valid_connection=False, push_active=False, outbox=None)
+        self.reactors = {name: SimpleNamespace(cur_temp=temp) for name, temp in (temps or {}).items()}
+        self.interrupt_lock = Lock()
+        self.exit_flag = False
+        self.interrupt = False
+        self.joined = False
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+    def join(self):
+        self.joined = True
+
+
+def write_config(config_dir, robot_id):
+    graph = nx.MultiDiGraph()
+    graph.add_node("meta", robot_id=robot_id, key="k", rxn_name="")
+    os.makedirs(os.path.join(config_dir, "configs"))
+    with open(os.path.join(config_dir, "configs", "module_connections.json"), "w") as file:
+        json.dump(nx.node_link_data(graph), file)
+    return str(config_dir)
+
+
+def make_fleet(robots):
+    host = fleet.FleetHost.__new__(fleet.FleetHost)
+    host.robots = {robot.id: robot for robot in robots}
+    return host
+
+
+def test_status():
+    busy = StubRobot("R2", temps={"reactor1": 65.04}, ready=False, reaction_name="esterification",
+                     staged_reaction={"name": "wash"}, execute=True)
+    busy.q.put({})
+    busy.listener = SimpleNamespace(valid_connection=True, push_active=True, outbox=[{}, {}])
+    status = make_fleet([StubRobot("R1"), busy]).status()
+    assert status["R1"] == {"ready": True, "execute": False, "paused": False, "error": False, "reaction": "",
+                            "staged": "", "queued": 0, "tasks": 0, "connected": False, "push": False, "outbox": 0,
+                            "temps": {}}
+    assert status["R2"]["reaction"] == "esterification"
+    assert status["R2"]["staged"] == "wash"
+    assert status["R2"]["execute"] and not status["R2"]["ready"]
+    assert status["R2"]["queued"] == 1 and status["R2"]["outbox"] == 2
+    assert status["R2"]["temps"] == {"reactor1": 65.0}
+
+
+def test_status_table():
+    robots = [StubRobot("R1"), StubRobot("R2", ready=False, reaction_name="esterification", temps={"reactor1": 40}),
+              StubRobot("R3", error=True), StubRobot("R4", paused=True)]
+    robots[1].listener = SimpleNamespace(valid_connection=True, push_active=False, outbox=[{}])
+    lines = make_fleet(robots).status_table().splitlines()
+    assert lines[0].split() == ["robot", "state", "reaction", "staged", "queued", "tasks", "server", "outbox", "temps"]
+    assert lines[1].split() == ["R1", "IDLE", "0", "0", "offline", "0"]
+    assert lines[2].split() == ["R2", "BUSY", "esterification", "0", "0", "polling", "1", "reactor1", "40"]
+    assert lines[3].split()[:2] == ["R3", "ERROR"]
+    assert lines[4].split()[:2] == ["R4", "PAUSED"]
+
+
+def test_duplicate_robot_ids_rejected(tmp_path):
+    config_dirs = [write_config(tmp_path / name, robot_id) for name, robot_id in
+                   (("robot1", "R1"), ("robot2", "R2"), ("robot3", "R1"))]
+    with pytest.raises(fbexceptions.FBConfigurationError, match="R1"):
+        fleet.FleetHost(config_dirs)
+
+
+def test_failed_robot_exits_fleet(tmp_path, monkeypatch):
+    config_dirs = [write_config(tmp_path / name, robot_id) for name, robot_id in (("robot1", "R1"), ("robot2", "R2"))]
+    started = []
+
+    def start_robot(config_dir, **kwargs):
+        if started:
+            raise fbexceptions.FBConfigurationError("invalid configuration")
+        started.append(StubRobot("R1"))
+        return started[0]
+
+    monkeypatch.setattr(fleet, "FluidicBackbone", start_robot)
+    handlers = list(logging.getLogger().handlers)
+    with pytest.raises(fbexceptions.FBConfigurationError):
+        fleet.FleetHost(config_dirs)
+    assert started[0].exit_flag and started[0].joined
+    assert logging.getLogger().handlers == handlers
+    # the shared reactor scheduler and upload pool are stopped
+    for thread in threading.enumerate():
+        if thread.name.startswith("Fleet"):
+            thread.join(5)
+            assert not thread.is_alive()
@@ -0,0 +1,94 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import flow_model
+
+
+class ModelManager:
+    """
+    Holds the parts of the manager that FlowRateModel uses
+    """
+
+    def __init__(self):
+        self.prev_run_config = {}
+        self.rc_changes = False
+        self.syringes = {}
+        self.logs = []
+
+    def write_log(self, message, level=None):
+        self.logs.append(message)
+
+
+def make_model():
+    manager = ModelManager()
+    return manager, flow_model.FlowRateModel(manager)
+
+
+def test_unknown_fluid_uses_default():
+    _, model = make_model()
+    assert model.max_flow_rate("syringe1", "water", 10000) == 10000
+
+
+def test_success_does_not_raise_above_safe_rate():
+    _, model = make_model()
+    model.record_success("syringe1", "water", 12000)
+    assert model.max_flow_rate("syringe1", "water", 10000) == 12000
+    model.record_success("syringe1", "water", 12000)
+    assert model.max_flow_rate("syringe1", "water", 10000) == 12000
+
+
+def test_max_flow_rate_capped_by_pump_limit():
+    _, model = make_model()
+    model.record_success("syringe1", "water", 30000)
+    assert model.max_flow_rate("syringe1", "water", 10000, limit=20000) == 20000
+    assert model.max_flow_rate("syringe1", "water", 10000, limit=5000) == 5000
+
+
+def test_record_stall_limits_flow_rate():
+    manager, model = make_model()
+    model.record_success("syringe1", "glycerol", 15000)
+    model.record_stall("syringe1", "glycerol", 12000)
+    assert manager.rc_changes
+    record = manager.prev_run_config["flow_rates"]["syringe1"]["glycerol"]
+    assert record["stall"] == 12000
+    assert record["safe"] == 12000 * flow_model.STALL_MARGIN
+    assert model.max_flow_rate("syringe1", "glycerol", 10000) == 12000 * flow_model.STALL_MARGIN
+    # a later success can't raise the flow rate past the stall
+    model.record_success("syringe1", "glycerol", 11000)
+    assert model.max_flow_rate("syringe1", "glycerol", 10000) == 12000 * flow_model.STALL_MARGIN
+
+
+def test_record_stall_keeps_lowest_stall():
+    manager, model = make_model()
+    model.record_stall("syringe1", "water", 20000)
+    model.record_stall("syringe1", "water", 30000)
+    assert manager.prev_run_config["flow_rates"]["syringe1"]["water"]["stall"] == 20000
+    model.record_stall("syringe1", "water", 15000)
+    assert manager.prev_run_config["flow_rates"]["syringe1"]["water"]["stall"] == 15000
+
+
+def test_stall_limits_requested_flow_rate():
+    _, model = make_model()
+    model.record_stall("syringe1", "water", 10000)
+    assert model.flow_rate("syringe1", "water", 20000, 10000) == 10000 * flow_model.STALL_MARGIN
+    assert model.flow_rate("syringe1", "water", 5000, 10000) == 5000
+
+
+def test_next_probe_steps_up_to_ceiling():
+    _, model = make_model()
+    assert model.next_probe("syringe1", "air", 10000, limit=15000) == 10000
+    model.record_success("syringe1", "air", 10000)
+    assert model.next_probe("syringe1", "air", 10000, limit=15000) == 10000 * flow_model.PROBE_STEP
+    model.record_success("syringe1", "air", 14500)
+    assert model.next_probe("syringe1", "air", 10000, limit=15000) == 15000
+    model.record_success("syringe1", "air", 15000)
+    assert model.next_probe("syringe1", "air", 10000, limit=15000) is None
+
+
+def test_next_probe_stops_below_stall():
+    _, model = make_model()
+    model.record_success("syringe1", "air", 10000)
+    model.record_stall("syringe1", "air", 11000)
+    assert model.next_probe("syringe1", "air", 10000) is None
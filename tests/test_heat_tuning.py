@@ -0,0 +1,125 @@
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import heat_tuning
+
+GAIN = 0.5
+TIME_CONSTANT = 200.0
+DEAD_TIME = 20.0
+AMBIENT = 20.0
+MAX_POWER = 100.0
+MODEL = {"gain": GAIN, "time_constant": TIME_CONSTANT, "dead_time": DEAD_TIME, "ambient": AMBIENT}
+
+
+def simulate(heater, duration, dt=0.1, sample=1.0):
+    """Simulates a first order plus dead time reactor, reading it every sample seconds
+
+    Args:
+        heater (function): takes the time and temperature of a reading and returns the heater power in W
+        duration (float): the time to simulate in seconds
+
+    Returns:
+        numpy.ndarray: the time, temperature and heater power of each reading
+    """
+    temp = AMBIENT
+    delayed = [0.0] * int(round(DEAD_TIME / dt))
+    readings = []
+    power = 0.0
+    for i in range(int(round(duration / dt))):
+        now = i * dt
+        if i % int(round(sample / dt)) == 0:
+            power = heater(now, temp)
+            readings.append((now, temp, power))
+        delayed.append(power)
+        temp += dt * (GAIN * delayed.pop(0) - (temp - AMBIENT)) / TIME_CONSTANT
+    return np.array(readings)
+
+
+def ultimate_point():
+    """Finds the ultimate gain and period of the simulated reactor, where its phase lag is 180°"""
+    low, high = 1e-4, 1.0
+    for _ in range(100):
+        w = (low + high) / 2
+        if math.atan(w * TIME_CONSTANT) + w * DEAD_TIME < math.pi:
+            low = w
+        else:
+            high = w
+    return math.sqrt(1 + (w * TIME_CONSTANT) ** 2) / GAIN, 2 * math.pi / w
+
+
+def test_fopdt_from_relay_recovers_model():
+    ku, tu = ultimate_point()
+    plant = heat_tuning.fopdt_from_relay(ku, tu, GAIN, AMBIENT)
+    assert abs(plant["time_constant"] - TIME_CONSTANT) < 1e-6 * TIME_CONSTANT
+    assert abs(plant["dead_time"] - DEAD_TIME) < 1e-6 * DEAD_TIME
+    assert plant["gain"] == GAIN and plant["ambient"] == AMBIENT
+
+
+def test_relay_tuner_identifies_reactor():
+    tuner = heat_tuning.RelayTuner(50, 0, AMBIENT, MAX_POWER)
+    assert tuner.result() is None
+
+    def relay(now, temp):
+        if tuner.complete:
+            return 0.0
+        return MAX_POWER if tuner.update(now, temp) else 0.0
+
+    simulate(relay, heat_tuning.TUNE_TIMEOUT)
+    assert tuner.complete
+    result = tuner.result()
+    assert result["temp"] == 50
+    # hysteresis slows the oscillation, and the describing function is an approximation, so the model is only close
+    # to the reactor's
+    _, tu = ultimate_point()
+    assert tu < result["tu"] < 1.3 * tu
+    plant = result["plant"]
+    assert abs(plant["gain"] - GAIN) < 0.05 * GAIN
+    assert abs(plant["time_constant"] - TIME_CONSTANT) < 0.25 * TIME_CONSTANT
+    assert abs(plant["dead_time"] - DEAD_TIME) < 0.35 * DEAD_TIME
+    kp, ki, kd = heat_tuning.pid_from_relay(result["ku"], result["tu"])
+    assert abs(kp - 0.2 * result["ku"]) < 1e-9
+    assert abs(ki - kp * 2 / result["tu"]) < 1e-9
+    assert abs(kd - kp * result["tu"] / 3) < 1e-9
+
+
+def test_fit_first_order_recovers_model():
+    readings = simulate(lambda now, temp: MAX_POWER, 600)
+    model = heat_tuning.fit_first_order(readings[:, 0], readings[:, 1], readings[:, 2], AMBIENT)
+    assert abs(model["gain"] - GAIN) < 0.02 * GAIN
+    assert abs(model["time_constant"] - TIME_CONSTANT) < 0.02 * TIME_CONSTANT
+    # the dead time ends once the temperature has risen by RISE_THRESHOLD
+    assert DEAD_TIME <= model["dead_time"] < DEAD_TIME + 5
+
+
+def test_fit_first_order_rejects_short_curves():
+    readings = simulate(lambda now, temp: MAX_POWER, 30)
+    assert heat_tuning.fit_first_order(readings[:, 0], readings[:, 1], readings[:, 2], AMBIENT) is None
+
+
+def test_time_to_temp():
+    assert abs(heat_tuning.time_to_temp(MODEL, 20, 45, MAX_POWER) - (DEAD_TIME + TIME_CONSTANT * math.log(2))) < 1e-9
+    assert abs(heat_tuning.time_to_temp(MODEL, 60, 40, MAX_POWER) - (DEAD_TIME + TIME_CONSTANT * math.log(2))) < 1e-9
+    # the heater can only reach 70 °C, and the reactor can't cool below ambient
+    assert heat_tuning.time_to_temp(MODEL, 20, 70, MAX_POWER) is None
+    assert heat_tuning.time_to_temp(MODEL, 60, 15, MAX_POWER) is None
+
+
+def test_time_to_temp_matches_simulation():
+    readings = simulate(lambda now, temp: MAX_POWER, 600)
+    reached = readings[np.argmax(readings[:, 1] >= 45), 0]
+    assert abs(heat_tuning.time_to_temp(MODEL, AMBIENT, 45, MAX_POWER) - reached) < 2
+
+
+def test_pid_from_model():
+    kp, ki, kd = heat_tuning.pid_from_model(MODEL)
+    assert abs(kp - TIME_CONSTANT / (GAIN * 2 * DEAD_TIME)) < 1e-9
+    assert abs(ki - kp / (8 * DEAD_TIME)) < 1e-9
+    assert kd == 0.0
+    # slow reactors use their time constant as the integral time
+    kp, ki, _ = heat_tuning.pid_from_model(dict(MODEL, time_constant=100.0))
+    assert abs(ki - kp / 100.0) < 1e-9
@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import outbox
+
+
+def status(value):
+    return {"cmd": "robot_status", "robot_status": value}
+
+
+def test_requests_flush_in_order():
+    box = outbox.Outbox(":memory:")
+    box.put("/status", status("BUSY"))
+    image = box.put("/send_image", {"img_number": 1}, data=b"image")
+    box.put("/status", status("IDLE"))
+    box.put("/status", status("BUSY"))
+    batch = box.peek(2, exclude_endpoint="/send_image")
+    assert [message["json_data"]["robot_status"] for message in batch] == ["BUSY", "IDLE"]
+    # the second status was queued after the image, the first before it
+    assert not box.has_before("/send_image", batch[0]["id"])
+    assert box.has_before("/send_image", batch[1]["id"])
+    box.remove([message["id"] for message in batch])
+    assert [message["json_data"]["robot_status"] for message in box.peek(10, exclude_endpoint="/send_image")] == \
+        ["BUSY"]
+    assert box.peek(10)[0]["key"] == image
+    assert len(box) == 2
+
+
+def test_released_request_keeps_its_idempotency_key():
+    box = outbox.Outbox(":memory:")
+    first = box.put("/send_image", {"img_number": 1}, data=b"first")
+    second = box.put("/send_image", {"img_number": 2}, data=b"second")
+    claimed = box.claim("/send_image")
+    assert claimed["key"] == first
+    # another worker skips the claimed image
+    assert box.claim("/send_image")["key"] == second
+    assert box.claim("/send_image") is None
+    box.record_attempt(claimed["id"])
+    box.release(claimed["id"])
+    retry = box.claim("/send_image")
+    assert retry["id"] == claimed["id"] and retry["key"] == first
+    assert retry["attempts"] == 1
+    # a request queued again with the same key isn't duplicated
+    assert box.put("/send_image", {"img_number": 1}, data=b"first", key=first) == first
+    assert len(box) == 2
+
+
+def test_outbox_persists_across_reopen(tmp_path):
+    fp = os.path.join(tmp_path, "configs", "outbox.db")
+    box = outbox.Outbox(fp)
+    key = box.put("/send_image", {"img_number": 1}, data=b"\x89PNG")
+    box.put("/status", status("IDLE"))
+    box.close()
+    box = outbox.Outbox(fp)
+    assert len(box) == 2
+    messages = box.peek(10)
+    assert messages[0]["key"] == key and messages[0]["data"] == b"\x89PNG"
+    assert messages[1]["json_data"] == status("IDLE")
+    box.remove([messages[0]["id"]])
+    box.close()
+    assert len(outbox.Outbox(fp)) == 1
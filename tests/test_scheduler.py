@@ -0,0 +1,87 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import scheduler
+
+
+class StubReactor:
+    """
+    Holds the parts of a reactor that the ReactorScheduler uses, optionally failing in one of them
+    """
+
+    def __init__(self, name, fail=""):
+        self.name = name
+        self.fail = fail
+        self.exit = False
+        self.ticks = []
+        self.logs = []
+
+    def check(self, stage):
+        if self.fail == stage:
+            raise RuntimeError(f"{stage} failed")
+
+    def needs_reading(self, now):
+        return True
+
+    def read_sensor(self):
+        self.check("read")
+        return 25.0
+
+    def tick(self, now, reading=None):
+        self.check("tick")
+        self.ticks.append(reading)
+
+    def next_update(self, now):
+        self.check("next_update")
+        return 1.0
+
+    def write_log(self, message, level=None):
+        self.logs.append(message)
+
+
+def make_scheduler():
+    reactor_scheduler = scheduler.ReactorScheduler()
+    reactor_scheduler.exit = True
+    reactor_scheduler.join()
+    return reactor_scheduler
+
+
+def test_failed_sensor_read_does_not_stop_other_reactors():
+    reactor_scheduler = make_scheduler()
+    broken, working = StubReactor("reactor1", "read"), StubReactor("reactor2")
+    reactor_scheduler.service([broken, working])
+    assert broken.ticks == [None]
+    assert working.ticks == [25.0]
+    assert len(broken.logs) == 1
+    assert set(reactor_scheduler.reactor_slots) == {broken, working}
+
+
+def test_failed_update_does_not_stop_other_reactors():
+    reactor_scheduler = make_scheduler()
+    broken, working = StubReactor("reactor1", "tick"), StubReactor("reactor2")
+    reactor_scheduler.service([broken, working])
+    assert working.ticks == [25.0]
+    assert len(broken.logs) == 1
+    assert set(reactor_scheduler.reactor_slots) == {broken, working}
+
+
+def test_failed_reschedule_does_not_stop_other_reactors():
+    reactor_scheduler = make_scheduler()
+    broken, working = StubReactor("reactor1", "next_update"), StubReactor("reactor2")
+    reactor_scheduler.service([broken, working])
+    assert broken.ticks == [25.0] and working.ticks == [25.0]
+    assert len(broken.logs) == 1
+    assert set(reactor_scheduler.reactor_slots) == {working}
+
+
+def test_schedule_places_reactor_in_wheel():
+    reactor_scheduler = make_scheduler()
+    reactor = StubReactor("reactor1")
+    reactor_scheduler.schedule(reactor, scheduler.TICK * (scheduler.WHEEL_SLOTS + 3))
+    slot = (reactor_scheduler.current_slot + scheduler.WHEEL_SLOTS + 3) % scheduler.WHEEL_SLOTS
+    assert reactor_scheduler.slots[slot] == {reactor: 1}
+    reactor_scheduler.remove(reactor)
+    assert reactor_scheduler.reactor_slots == {}
+    assert reactor_scheduler.slots[slot] == {}
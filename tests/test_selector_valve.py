@@ -0,0 +1,156 @@
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB.modules import selectorvalve
+
+
+def make_valve(confidence, reading):
+    """Builds a selector valve at port 3 without hardware, with a hall-effect sensor that always reads reading"""
+    valve = selectorvalve.SelectorValve.__new__(selectorvalve.SelectorValve)
+    valve.name = "valve1"
+    valve.manager = mock.Mock()
+    valve.manager.prev_run_config = {"magnet_readings": {"check_magnets": 1},
+                                     "valve_backlash": {"valve1": {"check_backlash": 1}}}
+    valve.num_ports = 10
+    valve.pos_dict = {port: 320 * (port - 1) for port in range(1, 11)}
+    valve.magnet_readings = {1: 650}
+    valve.current_port = 3
+    valve.geared = False
+    valve.backlash = 0
+    valve.stepper = mock.Mock()
+    valve.he_sensor = mock.Mock()
+    valve.he_sensor.analog_read.return_value = reading
+    valve.he_sensors = [valve.he_sensor]
+    valve.homing_record = {"confidence": confidence}
+    valve.confidence = confidence
+    valve.move_to_pos = mock.Mock()
+    valve.find_opt = mock.Mock()
+    valve.find_zero = mock.Mock()
+    valve.home_valve = mock.Mock()
+    return valve
+
+
+def test_confident_restart_near_home_skips_homing():
+    valve = make_valve(1.0, 645)
+    valve.init_valve()
+    valve.home_valve.assert_not_called()
+    expected = 1.0 - selectorvalve.STARTUP_CONFIDENCE_LOSS + selectorvalve.CHECK_CONFIDENCE_GAIN
+    assert abs(valve.confidence - expected) < 1e-9
+    assert valve.current_port == 1
+
+
+def test_unconfident_restart_near_home_homes():
+    valve = make_valve(0.5, 645)
+    valve.init_valve()
+    valve.home_valve.assert_called_once()
+
+
+def test_confident_restart_away_from_home_homes():
+    valve = make_valve(1.0, 630)
+    valve.init_valve()
+    valve.home_valve.assert_called_once()
+
+
+def make_geometry(num_ports, magnet_ports, backlash=0, direction="F"):
+    """Builds a selector valve with 3200 steps per revolution and its move tables, without hardware"""
+    valve = selectorvalve.SelectorValve.__new__(selectorvalve.SelectorValve)
+    valve.spr = 3200
+    valve.num_ports = num_ports
+    valve.magnet_ports = magnet_ports
+    valve.backlash = backlash
+    valve.current_direction = direction
+    valve.build_tables()
+    return valve
+
+
+def test_wrap_past_home_is_one_port_forward():
+    valve = make_geometry(10, [1, 3, 5, 7, 9])
+    valve.current_port = 10
+    assert valve.plan_rotation(1) == (320, True)
+    valve.current_port = 1
+    assert valve.plan_rotation(10) == (320, False)
+
+
+def test_backlash_flips_direction_at_tie():
+    # port 6 is half a revolution from port 1, so either direction is the same distance without backlash
+    valve = make_geometry(10, [1, 3, 5, 7, 9], backlash=20, direction="F")
+    valve.current_port = 1
+    assert valve.plan_rotation(6) == (1600, True)
+    valve.current_direction = "R"
+    assert valve.plan_rotation(6) == (1600, False)
+    # backlash is added when reversing the direction of travel
+    assert valve.plan_rotation(5) == (1280 + 20, True)
+
+
+def test_magnet_counts_wrap_around():
+    valve = make_geometry(10, [1, 3, 5, 7, 9])
+    assert valve.count_magnets(9, 2, True) == 1
+    assert valve.count_magnets(2, 9, False) == 2
+    assert valve.count_magnets(3, 3, True) == 0
+
+
+def test_twelve_port_magnet_tables():
+    valve = make_geometry(12, [1, 4, 7, 10])
+    assert valve.count_magnets(1, 7, True) == 2
+    assert valve.count_magnets(1, 7, False) == 2
+    assert valve.count_magnets(11, 2, True) == 1
+    assert valve.count_magnets(2, 11, False) == 1
+    assert valve.count_magnets(2, 3, True) == 0
+    assert valve.magnet_steps == {1: 800, 4: 800, 7: 800, 10: 800}
+    assert valve.magnet_spacing == 800
+
+
+def sweep(home, magnet_ports=(3, 5, 7, 9), spr=3200, step=20):
+    """Simulates hall-effect readings over one revolution, with the home magnet at step position home and a negative
+    magnet beneath each of magnet_ports, for a 10 port valve"""
+    positions = np.arange(0, spr, step, dtype=float)
+
+    def bump(centre):
+        distance = (positions - centre + spr / 2) % spr - spr / 2
+        return np.exp(-(distance / 60) ** 2)
+
+    readings = 512 + 250 * bump(home)
+    for port in magnet_ports:
+        readings -= 150 * bump(home + 320 * (port - 1))
+    return positions, readings
+
+
+def test_fit_peak_between_samples():
+    positions = np.array([-20.0, 0.0, 20.0])
+    assert abs(selectorvalve.fit_peak(positions, 700 - (positions - 7) ** 2) - 7) < 1e-6
+    assert abs(selectorvalve.fit_peak(positions, 400 + (positions + 3) ** 2, maximum=False) + 3) < 1e-6
+
+
+def test_fit_peak_rejects_readings_that_are_not_concave():
+    positions = np.array([-20.0, 0.0, 20.0])
+    assert selectorvalve.fit_peak(positions, 400 + positions ** 2) is None
+    assert selectorvalve.fit_peak(positions, np.array([600.0, 610.0, 620.0])) is None
+    assert selectorvalve.fit_peak(positions, 700 - positions ** 2, maximum=False) is None
+
+
+def test_find_magnets():
+    valve = make_geometry(10, [1, 3, 5, 7, 9])
+    magnets = valve.find_magnets(*sweep(1007))
+    assert sorted(magnets) == [1, 3, 5, 7, 9]
+    assert abs(magnets[1][0] - 1007) < 5
+    for port in (3, 5, 7, 9):
+        assert abs(magnets[port][0] - (1007 + 320 * (port - 1)) % 3200) <= 10
+        assert magnets[port][1] < selectorvalve.NEG_THRESHOLD
+
+
+def test_find_magnets_missing_negative_magnet():
+    valve = make_geometry(10, [1, 3, 5, 7, 9])
+    assert valve.find_magnets(*sweep(1007, magnet_ports=(3, 7, 9))) is None
+
+
+def test_find_magnets_home_near_wrap():
+    valve = make_geometry(10, [1, 3, 5, 7, 9])
+    magnets = valve.find_magnets(*sweep(3165))
+    assert abs(magnets[1][0] - 3165) < 5
+    assert abs(magnets[3][0] - 605) <= 10
+    assert abs(magnets[9][0] - 2525) <= 10
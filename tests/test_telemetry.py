@@ -0,0 +1,91 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+from UJ_FB import telemetry
+
+DTYPE = [("time", "f8"), ("reading", "f4")]
+
+
+def test_ring_buffer_wraps_around():
+    buffer = telemetry.RingBuffer(DTYPE, 4)
+    for t in range(6):
+        buffer.append((t, t * 10))
+    assert len(buffer) == 4
+    assert list(buffer.to_array()["time"]) == [2, 3, 4, 5]
+    assert list(buffer.to_array()["reading"]) == [20, 30, 40, 50]
+
+
+def test_ring_buffer_save_and_load(tmp_path):
+    fp = os.path.join(tmp_path, "telemetry", "valve1.npy")
+    buffer = telemetry.RingBuffer(DTYPE, 4)
+    for t in range(6):
+        buffer.append((t, t * 10))
+    buffer.save(fp)
+    loaded = telemetry.RingBuffer(DTYPE, 4)
+    assert loaded.load(fp)
+    assert np.array_equal(loaded.to_array(), buffer.to_array())
+    # appending carries on from the loaded records
+    loaded.append((6, 60))
+    assert list(loaded.to_array()["time"]) == [3, 4, 5, 6]
+    # only the most recent records are kept if the file holds more than the capacity
+    smaller = telemetry.RingBuffer(DTYPE, 2)
+    assert smaller.load(fp)
+    assert list(smaller.to_array()["time"]) == [4, 5]
+
+
+def test_ring_buffer_load_rejects_missing_or_different_file(tmp_path):
+    buffer = telemetry.RingBuffer(DTYPE, 4)
+    assert not buffer.load(os.path.join(tmp_path, "missing.npy"))
+    other = telemetry.RingBuffer([("time", "f8"), ("port", "i1")], 4)
+    other.append((0, 1))
+    fp = os.path.join(tmp_path, "other.npy")
+    other.save(fp)
+    assert not buffer.load(fp)
+    assert len(buffer) == 0
+
+
+def test_tiered_buffer_averages_intervals():
+    buffer = telemetry.TieredBuffer(DTYPE, ((10, 10),))
+    for t in range(10):
+        buffer.append((t, t))
+    buffer.append((10, np.nan))
+    buffer.append((11, 20))
+    history = buffer.history()
+    assert list(history["time"]) == [0, 10]
+    # NaN readings are left out of the averages
+    assert list(history["reading"]) == [4.5, 20]
+
+
+def test_tiered_buffer_includes_interval_in_progress():
+    buffer = telemetry.TieredBuffer(DTYPE, ((1, 10), (10, 10)))
+    assert buffer.history().size == 0
+    buffer.append((0.2, 5))
+    buffer.append((0.7, 7))
+    history = buffer.history()
+    assert list(history["time"]) == [0]
+    assert list(history["reading"]) == [6]
+
+
+def test_tiered_buffer_falls_back_to_coarser_tiers():
+    buffer = telemetry.TieredBuffer(DTYPE, ((1, 5), (10, 10)))
+    for t in range(30):
+        buffer.append((t, t))
+    history = buffer.history()
+    # the finest tier only holds the last five seconds and the interval in progress
+    assert list(history["time"]) == [0, 10, 20, 24, 25, 26, 27, 28, 29]
+    assert list(history["reading"]) == [4.5, 14.5, 24.5, 24, 25, 26, 27, 28, 29]
+    assert list(buffer.history(start=10)["time"]) == [10, 20, 24, 25, 26, 27, 28, 29]
+
+
+def test_tiered_buffer_save_csv(tmp_path):
+    buffer = telemetry.TieredBuffer(DTYPE, ((1, 10),))
+    buffer.append((0, 1.5))
+    buffer.append((1, 2.5))
+    fp = os.path.join(tmp_path, "history", "reactor1.csv")
+    buffer.save(fp)
+    with open(fp) as file:
+        assert file.read().splitlines() == ["time,reading", "0.000,1.50", "1.000,2.50"]
@@ -0,0 +1,52 @@
+def move(manager, syringe, volume, direction, target):
+    return manager.generate_cmd_dict("syringe_pump", syringe, "move",
+                                     {"volume": volume, "flow_rate": 5000, "direction": direction, "target": target,
+                                      "wait": True})
+
+
+def test_valid_pipeline_reports_peaks_and_reagents(manager):
+    commands = move(manager, "syringe1", 8000, "A", "flask1") + move(manager, "syringe1", 8000, "D", "flask2")
+    report = manager.validate_pipeline(commands)
+    assert report["valid"]
+    assert report["failed_step"] is None
+    assert report["peak_volumes"]["syringe1"] == 8000
+    assert report["peak_volumes"]["flask2"] == 8000
+    assert report["reagents"]["flask1"] == {"contents": "water", "volume": 8000}
+    assert report["state"]["vessels"]["flask1"] == 42000
+    assert report["state"]["syringes"]["syringe1"] == 0
+
+
+def test_vessel_over_volume_fails(manager):
+    state = manager.snapshot_state()
+    state["syringes"]["syringe2"] = 10000
+    state["vessels"]["flask4"] = 45000
+    report = manager.validate_pipeline(move(manager, "syringe2", 10000, "D", "flask4"), state)
+    assert not report["valid"]
+    assert report["failed_step"] == 0
+    assert "flask4" in report["message"]
+
+
+def test_syringe_overfill_fails_at_step(manager):
+    commands = move(manager, "syringe1", 8000, "A", "flask1") + move(manager, "syringe1", 8000, "D", "flask2") \
+        + move(manager, "syringe1", 12000, "A", "flask1")
+    report = manager.validate_pipeline(commands)
+    assert not report["valid"]
+    assert report["failed_step"] == 2
+    assert "syringe1" in report["message"]
+    assert report["peak_volumes"]["syringe1"] == 12000
+    # the state is that after the last command that passed
+    assert report["state"]["vessels"]["flask2"] == 8000
+
+
+def test_missing_valve_target_fails(manager):
+    commands = manager.generate_cmd_dict("selector_valve", "valve1", "target", {"target": "flask3", "wait": True})
+    report = manager.validate_pipeline(commands)
+    assert not report["valid"]
+    assert report["failed_step"] == 0
+    assert "flask3" in report["message"]
+
+
+def test_under_volume_is_a_warning(manager):
+    report = manager.validate_pipeline(move(manager, "syringe1", 5000, "A", "flask2"))
+    assert report["valid"]
+    assert report["warnings"] == ["Insufficient empty in flask2"]